@@ -27,9 +27,13 @@ if not _ASTROPY_SETUP_:  # noqa
     import os
     from warnings import warn
     from astropy.config.configuration import (
-        update_default_config,
         ConfigurationDefaultMissingError,
         ConfigurationDefaultMissingWarning)
+    try:
+        from astropy.config.configuration import update_default_config
+    except ImportError:
+        # (removed in Astropy 6.0)
+        update_default_config = None
 
     # Create the test function for self test
     from astropy.tests.runner import TestRunner
@@ -43,7 +47,7 @@ if not _ASTROPY_SETUP_:  # noqa
     if not os.environ.get('ASTROPY_SKIP_CONFIG_UPDATE', False):
         config_dir = os.path.dirname(__file__)
         config_template = os.path.join(config_dir, __package__ + ".cfg")
-        if os.path.isfile(config_template):
+        if os.path.isfile(config_template) and (update_default_config is not None):
             try:
                 update_default_config(
                     __package__, config_dir, version=__version__)
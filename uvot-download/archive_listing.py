@@ -0,0 +1,171 @@
+import urllib.parse
+from html.parser import HTMLParser
+
+# location of the Swift observations within the HEASARC archive
+SWIFT_OBS_PATH = '/FTP/swift/data/obs/'
+
+
+def obs_url(client, start_month, obsid, subdir=''):
+    """
+    URL of an observation's folder (or a subfolder, like 'uvot') in the
+    HEASARC archive
+
+    Parameters
+    ----------
+    client : HTTPClient object
+        Client whose base_url points to HEASARC
+
+    start_month : string
+        Month of the observation, formatted like '2018_01'
+
+    obsid : string
+        Observation ID
+
+    subdir : string (default='')
+        Subfolder of the observation
+
+    """
+    url = client.url(SWIFT_OBS_PATH + start_month + '/' + obsid + '/')
+    if subdir != '':
+        url += subdir.strip('/') + '/'
+    return url
+
+
+class _LinkParser(HTMLParser):
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            for name, value in attrs:
+                if name == 'href' and value:
+                    self.links.append(value)
+
+
+def parse_listing(html):
+    """
+    Get the entries from an Apache-style directory listing page
+
+    Parameters
+    ----------
+    html : string
+        Contents of the listing page
+
+    Returns
+    -------
+    entries : list of strings
+        Names of the files and folders in the directory.  Folders end with
+        '/'.  Parent links, sort links, absolute links, and index pages are
+        left out (same as `wget -np -R 'index*'`).
+
+    """
+
+    parser = _LinkParser()
+    parser.feed(html)
+
+    entries = []
+    for href in parser.links:
+        if href.startswith(('?', '/', '#', '.')) or ('://' in href):
+            continue
+        name = urllib.parse.unquote(href.split('?')[0])
+        if name.startswith('index') or (name in entries):
+            continue
+        entries.append(name)
+
+    return entries
+
+
+def list_directory(client, url, cache=None, revalidate=False):
+    """
+    Fetch and parse the listing of an archive directory
+
+    Parameters
+    ----------
+    client : HTTPClient object
+        Client to fetch the listing with
+
+    url : string
+        URL of the directory (ending in '/')
+
+    cache : ListingCache object (default=None)
+        If set, use the cached listing when it's fresh, revalidate it with a
+        conditional request when it's stale, and save new listings
+
+    revalidate : boolean (default=False)
+        If True, revalidate the cached listing even if it's fresh
+
+    Returns
+    -------
+    entries : list of strings
+        See parse_listing
+
+    """
+
+    headers = {}
+    cached = None
+    if cache is not None:
+        cached = cache.get(url)
+        if cached is not None:
+            if cached['fresh'] and not revalidate:
+                return cached['entries']
+            if cached['etag'] is not None:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified'] is not None:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+    response = client.get(url, headers=headers)
+
+    # listing hasn't changed
+    if (response.status == 304) and (cached is not None):
+        cache.touch(url)
+        return cached['entries']
+
+    response.raise_for_status()
+    entries = parse_listing(response.text())
+    if cache is not None:
+        cache.put(url, entries, etag=response.headers.get('ETag'),
+                      last_modified=response.headers.get('Last-Modified'))
+    return entries
+
+
+def crawl(client, url, cache=None, revalidate=False):
+    """
+    Recursively find all of the files below an archive directory (the
+    equivalent of `wget -r -l0 -np`)
+
+    Parameters
+    ----------
+    client : HTTPClient object
+        Client to fetch the listings with
+
+    url : string
+        URL of the top directory (ending in '/')
+
+    cache : ListingCache object (default=None)
+        Cache of directory listings (see list_directory)
+
+    revalidate : boolean (default=False)
+        If True, revalidate all of the cached listings (see list_directory)
+
+    Returns
+    -------
+    file_urls : list of strings
+        URLs of all of the files
+
+    """
+
+    file_urls = []
+    dir_list = [url]
+
+    while len(dir_list) > 0:
+        current = dir_list.pop(0)
+        for name in list_directory(client, current, cache=cache, revalidate=revalidate):
+            full_url = current + urllib.parse.quote(name)
+            if name.endswith('/'):
+                dir_list.append(full_url)
+            else:
+                file_urls.append(full_url)
+
+    return file_urls
@@ -0,0 +1,286 @@
+import os
+import argparse
+import json
+import shutil
+import sys
+import threading
+
+from transfer_journal import TransferJournal, JOURNAL_NAME
+
+# name of the file that records which targets link to each observation
+LINKS_NAME = 'store_links.jsonl'
+
+
+class ArchiveStore(object):
+    """
+    Shared folder that each observation is downloaded into once, no matter
+    how many targets it belongs to.  The observations are kept by obsid
+    (root/obs/obsid/..., the same layout as in a target's folder), and
+    the target folders get links to the files instead of copies, so
+    overlapping targets (galaxy groups, clusters) don't download or store
+    the same observation twice.
+
+    Files are hard linked if possible (so deleting the store copy doesn't
+    break the target), or symbolically linked if the store is on a
+    different filesystem (or link_mode='symlink').  The store keeps a list
+    of which targets each observation was linked into, so gc() can remove
+    the observations that no target uses any more.
+
+    Parameters
+    ----------
+    root : string
+        Folder for the store (created if needed)
+
+    link_mode : string (default='hardlink')
+        'hardlink' or 'symlink'
+
+    """
+
+    def __init__(self, root, link_mode='hardlink'):
+        if link_mode not in ['hardlink','symlink']:
+            raise ValueError("link_mode must be 'hardlink' or 'symlink'")
+        self.root = os.path.abspath(root)
+        self.obs_root = os.path.join(self.root, 'obs')
+        self.link_mode = link_mode
+        os.makedirs(self.obs_root, exist_ok=True)
+        self._lock = threading.Lock()
+
+        # the observations are downloaded into obs_root, so that's where
+        # their journal goes
+        self.journal = TransferJournal(os.path.join(self.obs_root, JOURNAL_NAME))
+
+        # targets linked to each observation
+        self.links_file = os.path.join(self.root, LINKS_NAME)
+        self.links = {}
+        if os.path.isfile(self.links_file):
+            with open(self.links_file, 'r') as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.links.setdefault(record['obsid'], set()).add(record['target'])
+
+    def obs_path(self, obsid):
+        """
+        Folder of an observation in the store
+        """
+        return os.path.join(self.obs_root, obsid)
+
+    def has_obs(self, obsid):
+        return os.path.isdir(self.obs_path(obsid))
+
+    def link_obs(self, obsid, target_path):
+        """
+        Link the files of an observation in the store into a target's folder
+        (as target_path/obsid/...).  Files that are already there are left
+        alone, unless the target was linked to this observation before (then
+        they're links to old versions of the files, e.g., from before a
+        corrupt file was downloaded again, and are replaced).
+
+        Parameters
+        ----------
+        obsid : string
+            Observation ID
+
+        target_path : string
+            The target's folder (where its heasarc_obs.dat is)
+
+        Returns
+        -------
+        n_linked : int
+            Number of new links
+
+        """
+
+        store_dir = self.obs_path(obsid)
+        if not os.path.isdir(store_dir):
+            return 0
+        target_path = os.path.abspath(target_path)
+        target_dir = os.path.join(target_path, obsid)
+
+        with self._lock:
+            relink = target_path in self.links.get(obsid, set())
+
+        n_linked = link_tree(store_dir, target_dir, link_mode=self.link_mode, relink=relink)
+
+        with self._lock:
+            if target_path not in self.links.get(obsid, set()):
+                self.links.setdefault(obsid, set()).add(target_path)
+                with open(self.links_file, 'a') as fh:
+                    fh.write(json.dumps({'obsid':obsid, 'target':target_path}) + '\n')
+
+        return n_linked
+
+    def is_linked(self, obsid, target_path):
+        """
+        True if the target's folder still has links to the observation's
+        files in the store
+        """
+        store_dir = self.obs_path(obsid)
+        target_dir = os.path.join(target_path, obsid)
+        if not os.path.isdir(target_dir):
+            return False
+        for dirpath, dirnames, filenames in os.walk(store_dir):
+            for name in filenames:
+                target_file = os.path.join(target_dir, os.path.relpath(dirpath, store_dir), name)
+                if os.path.exists(target_file) and os.path.samefile(os.path.join(dirpath, name), target_file):
+                    return True
+        return False
+
+    def gc(self, dry_run=False, verbose=True):
+        """
+        Remove the observations in the store that aren't linked into any
+        target's folder any more (e.g., because the target's folder, or the
+        observation's folder within it, was deleted).  With hard links, the
+        targets' copies are unaffected.
+
+        Parameters
+        ----------
+        dry_run : boolean (default=False)
+            If True, only report what would be removed
+
+        verbose : boolean (default=True)
+            If True, print what's removed
+
+        Returns
+        -------
+        removed : list of strings
+            The obsids that were (or would be) removed
+
+        nbytes : int
+            Space that was (or would be) freed in the store
+
+        """
+
+        removed = []
+        nbytes = 0
+
+        with self._lock:
+            for obsid in sorted(os.listdir(self.obs_root)):
+                store_dir = self.obs_path(obsid)
+                if not os.path.isdir(store_dir):
+                    continue
+                targets = set([target for target in self.links.get(obsid, set())
+                                   if self.is_linked(obsid, target)])
+                self.links[obsid] = targets
+                if len(targets) > 0:
+                    continue
+
+                removed.append(obsid)
+                nbytes += folder_size(store_dir)
+                if verbose:
+                    print('  '+('would remove ' if dry_run else 'removing ')+obsid)
+                if not dry_run:
+                    shutil.rmtree(store_dir)
+                    del self.links[obsid]
+
+            if not dry_run:
+                self._compact_links()
+
+        if verbose:
+            print('* '+('would free ' if dry_run else 'freed ')+str(nbytes)+' bytes from '
+                      +str(len(removed))+' observations')
+
+        return removed, nbytes
+
+    def _compact_links(self):
+        tmp_file = self.links_file + '.tmp'
+        with open(tmp_file, 'w') as fh:
+            for obsid in sorted(self.links):
+                for target in sorted(self.links[obsid]):
+                    fh.write(json.dumps({'obsid':obsid, 'target':target}) + '\n')
+        os.replace(tmp_file, self.links_file)
+
+
+def link_tree(src_dir, dst_dir, link_mode='hardlink', relink=False, fallback='symlink'):
+    """
+    Link the files in src_dir (and its subfolders) into the same places in
+    dst_dir (see link_file).  Files that are still being written (.part,
+    .tmp) are skipped.
+
+    Parameters
+    ----------
+    src_dir, dst_dir : string
+        Folders to link from and into
+
+    link_mode, fallback : string
+        See link_file
+
+    relink : boolean (default=False)
+        If True, files already in dst_dir that aren't the same as the ones
+        in src_dir are replaced; otherwise they're left alone
+
+    Returns
+    -------
+    n_linked : int
+        Number of new links
+
+    """
+    n_linked = 0
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        out_dir = os.path.join(dst_dir, os.path.relpath(dirpath, src_dir))
+        os.makedirs(out_dir, exist_ok=True)
+        for name in filenames:
+            # skip files that are still being written
+            if name.endswith('.part') or name.endswith('.tmp'):
+                continue
+            src_file = os.path.join(dirpath, name)
+            out_file = os.path.join(out_dir, name)
+            if os.path.lexists(out_file):
+                if (not relink) or (os.path.exists(out_file) and os.path.samefile(src_file, out_file)):
+                    continue
+                os.remove(out_file)
+            link_file(src_file, out_file, link_mode=link_mode, fallback=fallback)
+            n_linked += 1
+    return n_linked
+
+
+def link_file(src, dst, link_mode='hardlink', fallback='symlink'):
+    """
+    Link dst to src: a hard link if link_mode is 'hardlink' and they're on
+    the same filesystem, otherwise a symbolic link (or, if fallback is
+    'copy', a copy of the file)
+    """
+    if link_mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            if fallback == 'copy':
+                shutil.copy2(src, dst)
+                return
+    os.symlink(os.path.abspath(src), dst)
+
+
+def folder_size(path):
+    """
+    Total size of the files in a folder
+    """
+    nbytes = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            nbytes += os.path.getsize(os.path.join(dirpath, name))
+    return nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('store', nargs="?", help="Folder with the shared store", default='')
+    parser.add_argument('--gc', help="Remove observations that aren't linked into any target's folder", action='store_true', default=False)
+    parser.add_argument('-n','--dry_run', help="Only report what --gc would remove", action='store_true', default=False)
+    args = parser.parse_args()
+
+    if not args.store or not os.path.isdir(args.store):
+        print('Please specify the folder with the shared store.')
+        sys.exit()
+
+    store = ArchiveStore(args.store)
+    if args.gc:
+        store.gc(dry_run=args.dry_run)
+    else:
+        n_obs = len([obsid for obsid in os.listdir(store.obs_root) if store.has_obs(obsid)])
+        print('* '+str(n_obs)+' observations ('+str(folder_size(store.obs_root))+' bytes) in '+store.root)
+
+if __name__ =="__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import argparse
+import subprocess
+import sys
+import time
+
+# folder with the scripts (they import each other as top-level modules)
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# modules whose import time is measured
+MODULES = ['query_heasarc', 'download_heasarc', 'unzip_heasarc', 'swift_catalog', 'uvot_download']
+
+# command line scripts whose startup (to the end of `--help`) is measured
+CLI_SCRIPTS = ['query_heasarc.py', 'unzip_heasarc.py', 'swift_catalog.py', 'uvot_download.py']
+
+# dependencies that are slow to import, and shouldn't be loaded unless
+# they're needed
+HEAVY_MODULES = ['numpy', 'astropy', 'pdb']
+
+
+def time_command(cmd, repeat=10):
+    """
+    Run a command several times and return the median wall clock time (s)
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=SCRIPT_DIR, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times)//2]
+
+
+def heavy_imports(module):
+    """
+    Which of HEAVY_MODULES are loaded by importing a module
+    """
+    code = 'import sys, ' + module + '; ' + \
+      'print(" ".join([m for m in ' + repr(HEAVY_MODULES) + ' if m in sys.modules]))'
+    output = subprocess.run([sys.executable, '-c', code], cwd=SCRIPT_DIR,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True, check=True).stdout
+    return output.split()
+
+
+def startup_benchmark(modules=None, repeat=10, verbose=True):
+    """
+    Measure how long it takes to import each module and start each command
+    line script, compared to starting the interpreter with nothing else.
+    Each measurement is in a new process, so nothing is already imported.
+
+    Parameters
+    ----------
+    modules : list of strings (default=None)
+        Modules to check (if None, MODULES)
+
+    repeat : int (default=10)
+        Number of times to run each measurement (the median is reported)
+
+    verbose : boolean (default=True)
+        If True, print the results
+
+    Returns
+    -------
+    results : dict
+        For each module and script, the extra startup time (ms) beyond the
+        bare interpreter, and for modules, the HEAVY_MODULES they load
+
+    """
+
+    if modules is None:
+        modules = MODULES
+
+    baseline = time_command([sys.executable, '-c', 'pass'], repeat=repeat)
+    if verbose:
+        print('* python startup: {:.1f} ms'.format(baseline*1000))
+
+    results = {}
+
+    for module in modules:
+        t = time_command([sys.executable, '-c', 'import '+module], repeat=repeat)
+        heavy = heavy_imports(module)
+        results[module] = {'ms':(t - baseline)*1000, 'heavy':heavy}
+        if verbose:
+            print('  import {:<20s} {:7.1f} ms  {}'.format(module, (t - baseline)*1000,
+                                                            'loads '+', '.join(heavy) if heavy else ''))
+
+    for script in CLI_SCRIPTS:
+        if script[:-3] not in modules:
+            continue
+        t = time_command([sys.executable, script, '--help'], repeat=repeat)
+        results[script] = {'ms':(t - baseline)*1000}
+        if verbose:
+            print('  {:<27s} {:7.1f} ms'.format(script+' --help', (t - baseline)*1000))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*', help="Modules to check (default is all of the scripts)")
+    parser.add_argument('-n','--repeat', help="Number of times to run each measurement", type=int, default=10)
+    args = parser.parse_args()
+
+    startup_benchmark(modules=(args.modules if args.modules else None), repeat=args.repeat)
+
+if __name__ =="__main__":
+    main()
@@ -11,9 +11,16 @@ else:
     # automatically made available when Astropy is installed. This means it's
     # not necessary to import them here, but we still need to import global
     # variables that are used for configuration.
-    from astropy.tests.plugins.display import PYTEST_HEADER_MODULES, TESTED_VERSIONS
+    # (later versions of Astropy moved these to pytest-astropy-header)
+    try:
+        from astropy.tests.plugins.display import PYTEST_HEADER_MODULES, TESTED_VERSIONS
+    except ImportError:
+        pass
 
-from astropy.tests.helper import enable_deprecations_as_exceptions
+try:
+    from astropy.tests.helper import enable_deprecations_as_exceptions
+except ImportError:
+    pass
 
 ## Uncomment the following line to treat all DeprecationWarnings as
 ## exceptions. For Astropy v2.0 or later, there are 2 additional keywords,
@@ -0,0 +1,774 @@
+import os
+import fnmatch
+import email.utils
+import heapq
+import http.client
+import itertools
+import socket
+import threading
+import time
+import urllib.parse
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+from heasarc_http import HTTPClient, ResponseError
+from archive_listing import obs_url, crawl
+from transfer_journal import TransferJournal, JOURNAL_NAME
+from unzip_heasarc import gunzip_file
+from obs_manifest import ObsManifest
+
+# parts of each observation that get downloaded
+OBS_SUBDIRS = ['uvot','auxil']
+
+# kinds of files that can be picked out of an observation: the folder
+# they're in, and the pattern for their names ({filt} is the filter code
+# used in the file names, e.g., uw2)
+PRODUCT_TYPES = {'sky':('uvot/image', 'sw*{filt}_sk.img*'),
+                     'exposure':('uvot/image', 'sw*{filt}_ex.img*'),
+                     'raw':('uvot/image', 'sw*{filt}_rw.img*'),
+                     'event':('uvot/event', 'sw*{filt}*_uf.evt*'),
+                     'hk':('uvot/hk', '*'),
+                     'attitude':('auxil', 'sw*at.fits*'),
+                     'auxil':('auxil', '*')}
+
+# number of files to hash at the same time when verifying an observation
+HASH_WORKERS = 4
+
+# what's needed to do photometry on the sky images
+IMAGING_PRODUCTS = ['sky','exposure','attitude']
+
+
+class FileSelection(object):
+    """
+    Which files of an observation to download, by filter and product type
+    (see PRODUCT_TYPES).  Only the folders with the selected products are
+    crawled, so e.g. the event and hk/ listings aren't fetched at all when
+    only images are wanted.
+
+    Parameters
+    ----------
+    filters : list of strings (default=None)
+        Filters to download (e.g., ['w2','m2']).  If None, all filters.
+
+    products : list of strings (default=IMAGING_PRODUCTS)
+        Product types to download
+
+    """
+
+    def __init__(self, filters=None, products=IMAGING_PRODUCTS):
+        for product in products:
+            if product not in PRODUCT_TYPES:
+                raise ValueError(product+' is not a product type (options: '+', '.join(sorted(PRODUCT_TYPES))+')')
+        self.filters = None if filters is None else sorted(filters)
+        self.products = sorted(products)
+
+        filt_codes = ['u*'] if filters is None else ['u'+filt for filt in self.filters]
+        self.patterns = {}
+        for product in self.products:
+            subdir, pattern = PRODUCT_TYPES[product]
+            for filt_code in filt_codes:
+                name_pattern = pattern.format(filt=filt_code)
+                if name_pattern not in self.patterns.setdefault(subdir, []):
+                    self.patterns[subdir].append(name_pattern)
+
+    @property
+    def subdirs(self):
+        """
+        Folders (within the observation) that need to be crawled
+        """
+        return sorted(self.patterns)
+
+    @property
+    def key(self):
+        """
+        Short description of the selection, for the download journal
+        """
+        return ','.join(self.filters or ['all']) + ':' + ','.join(self.products)
+
+    def match(self, rel_path):
+        """
+        True if a file (path within the observation, like
+        'uvot/image/sw00084312006uw2_sk.img.gz') is selected
+        """
+        subdir, name = os.path.split(rel_path)
+        for pattern in self.patterns.get(subdir, []):
+            if fnmatch.fnmatchcase(name, pattern):
+                return True
+        return False
+
+
+class ObsJob(object):
+    """
+    One observation to download
+
+    Parameters
+    ----------
+    obsid : string
+        Observation ID
+
+    start_month : string
+        Month of the observation, formatted like '2018_01'
+
+    save_path : string
+        Folder to save into (files end up in save_path/obsid/...)
+
+    selection : FileSelection object (default=None)
+        Which files to download (if None, everything in OBS_SUBDIRS)
+
+    verify : boolean (default=False)
+        If True and the observation has a manifest from an earlier download
+        (see obs_manifest.ObsManifest), check the checksums of the files in
+        it and only download the ones that are missing or don't match
+
+    priority : float (default=0.0)
+        Observations with smaller values are downloaded first (see
+        download_heasarc.job_priorities)
+
+    download_all : boolean (default=False)
+        If True, check HEASARC for the observation even if the journal says
+        it's complete: the listings are fetched again (or revalidated), new
+        files are downloaded, and files that are already there are
+        downloaded again if HEASARC has a newer version (like `wget -N`)
+
+    """
+
+    def __init__(self, obsid, start_month, save_path, selection=None, verify=False,
+                     priority=0.0, download_all=False):
+        self.obsid = obsid
+        self.start_month = start_month
+        self.save_path = save_path
+        self.selection = selection
+        self.verify = verify
+        self.priority = priority
+        self.download_all = download_all
+
+
+class ObsResult(object):
+    """
+    Outcome of downloading one observation
+
+    Attributes
+    ----------
+    obsid : string
+        Observation ID
+
+    files : list of strings
+        Local paths of the files that were downloaded
+
+    skipped : list of strings
+        Local paths of files that already existed and weren't downloaded
+
+    nbytes : int
+        Number of bytes downloaded
+
+    error : string or None
+        Description of what went wrong, or None if it all worked
+
+    deferred : boolean
+        True if the observation wasn't started because the download budget
+        was used up (see DownloadBudget), so it's left for a later run
+
+    """
+
+    def __init__(self, obsid):
+        self.obsid = obsid
+        self.files = []
+        self.skipped = []
+        self.nbytes = 0
+        self.error = None
+        self.deferred = False
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return '<ObsResult '+self.obsid+': '+str(len(self.files))+' files, '+str(self.nbytes)+' bytes>'
+        if self.deferred:
+            return '<ObsResult '+self.obsid+': deferred ('+self.error+')>'
+        return '<ObsResult '+self.obsid+': failed ('+self.error+')>'
+
+
+class DownloadBudget(object):
+    """
+    Limit on how much to download in one run.  Once the budget is used up,
+    observations that haven't started yet are left for a later run (the
+    ones in progress are finished, so the budget can be overshot by up to
+    max_workers observations).
+
+    Parameters
+    ----------
+    max_bytes : int (default=None)
+        Stop starting observations after this many bytes are downloaded
+
+    max_time : float (default=None)
+        Stop starting observations after this many seconds
+
+    """
+
+    def __init__(self, max_bytes=None, max_time=None):
+        self.max_bytes = max_bytes
+        self.max_time = max_time
+        self.nbytes = 0
+        self.start_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, nbytes):
+        """
+        Count downloaded bytes against the budget
+        """
+        with self._lock:
+            self.nbytes += nbytes
+
+    def exhausted(self):
+        """
+        True if the byte or time limit has been reached
+        """
+        with self._lock:
+            if (self.max_bytes is not None) and (self.nbytes >= self.max_bytes):
+                return True
+        return (self.max_time is not None) and (time.monotonic() - self.start_time >= self.max_time)
+
+
+def download_file(client, url, local_file, journal=None, refresh=False):
+    """
+    Download a single file.  The data are written to a temporary '.part'
+    file that is renamed once it's complete, so an existing file is always
+    a complete one.  The modification time is set from the server's
+    Last-Modified header (like `wget -N`).
+
+    If a journal is given and it has a Last-Modified/ETag for a leftover
+    '.part' file, the download picks up where it stopped with an HTTP Range
+    request (the server sends the whole file instead if it has changed).
+
+    Parameters
+    ----------
+    client : HTTPClient object
+        Client to download with
+
+    url : string
+        URL of the file
+
+    local_file : string
+        Where to save the file
+
+    journal : TransferJournal object (default=None)
+        Journal to record the progress in
+
+    refresh : boolean (default=False)
+        If True and the file (or its unzipped version) is already there,
+        only download it if the server has a newer version (see
+        local_last_modified)
+
+    Returns
+    -------
+    nbytes : int or None
+        Number of bytes downloaded (not counting any resumed part), or None
+        if the file didn't need to be downloaded again
+
+    """
+
+    os.makedirs(os.path.dirname(local_file), exist_ok=True)
+    part_file = local_file + '.part'
+    nbytes = 0
+
+    headers = {}
+    offset = 0
+    entry = None if journal is None else journal.get_file(url)
+
+    # only replace a file that's already there with a newer version
+    if refresh and file_present(local_file):
+        headers['If-Modified-Since'] = local_last_modified(local_file, entry)
+
+    # see if there's a partial download to resume
+    elif (entry is not None) and os.path.isfile(part_file):
+        validator = entry.get('etag') or entry.get('last_modified')
+        if validator is not None:
+            offset = os.path.getsize(part_file)
+            headers['Range'] = 'bytes='+str(offset)+'-'
+            headers['If-Range'] = validator
+
+    with client.request('GET', url, headers=headers) as response:
+
+        # the file hasn't changed
+        if ('If-Modified-Since' in headers) and (response.status == 304):
+            return None
+
+        # the part file already has everything
+        if (response.status == 416) and (offset > 0) and (offset == entry.get('size')):
+            response.read()
+            last_modified = entry.get('last_modified')
+        else:
+            response.raise_for_status()
+            if response.status != 206:
+                offset = 0
+            last_modified = response.headers.get('Last-Modified')
+
+            length = response.headers.get('Content-Length')
+            size = None if length is None else offset+int(length)
+            if journal is not None:
+                journal.update_file(url, path=local_file, complete=False, size=size,
+                                        last_modified=last_modified,
+                                        etag=response.headers.get('ETag'))
+
+            try:
+                with open(part_file, 'ab' if offset > 0 else 'wb') as fh:
+                    for chunk in response.iter_content():
+                        fh.write(chunk)
+                        nbytes += len(chunk)
+            finally:
+                if journal is not None:
+                    journal.update_file(url, received=offset+nbytes)
+
+            # (http.client doesn't complain if the connection closes early)
+            if (size is not None) and (offset+nbytes != size):
+                raise ResponseError('download of '+url+' was cut off ('+str(offset+nbytes)
+                                        +' of '+str(size)+' bytes)')
+
+    os.replace(part_file, local_file)
+    if last_modified is not None:
+        mtime = email.utils.parsedate_to_datetime(last_modified).timestamp()
+        os.utime(local_file, (mtime, mtime))
+
+    if journal is not None:
+        journal.update_file(url, complete=True, mtime=os.path.getmtime(local_file))
+
+    return nbytes
+
+
+def local_last_modified(local_file, entry=None):
+    """
+    Last-Modified date (as an HTTP date string) of a file that's already
+    been downloaded: from its journal entry if it has one, otherwise from
+    the modification time of the file (or its unzipped version), which
+    download_file and gunzip_file set from the server's Last-Modified
+    """
+    if (entry is not None) and entry.get('complete') and (entry.get('last_modified') is not None):
+        return entry['last_modified']
+    present = local_file if os.path.isfile(local_file) else local_file[:-3]
+    return email.utils.formatdate(os.path.getmtime(present), usegmt=True)
+
+
+def file_present(local_file):
+    """
+    True if a downloaded file (or its unzipped version) is on disk
+    """
+    if os.path.isfile(local_file):
+        return True
+    return local_file.endswith('.gz') and os.path.isfile(local_file[:-3])
+
+
+def remove_local(local_file):
+    """
+    Delete a downloaded file (and its unzipped version)
+    """
+    for filename in [local_file] + ([local_file[:-3]] if local_file.endswith('.gz') else []):
+        if os.path.isfile(filename):
+            os.remove(filename)
+
+
+def download_obs(client, job, journal=None, listing_cache=None, unzipper=None, budget=None):
+    """
+    Download the uvot/ and auxil/ folders of one observation (or the files
+    in job.selection)
+
+    Parameters
+    ----------
+    client : HTTPClient object
+        Client to download with
+
+    job : ObsJob object
+        The observation to download
+
+    journal : TransferJournal object (default=None)
+        Journal for the target.  If it says the observation was completely
+        downloaded (and the files are still there), the listings aren't
+        crawled at all.
+
+    listing_cache : ListingCache object (default=None)
+        Cache of archive directory listings
+
+    unzipper : Executor object (default=None)
+        If set, each .gz file is handed to this executor to be unzipped as
+        soon as it has been downloaded, while the next files download.  The
+        observation is only counted as complete once they're all unzipped.
+
+    budget : DownloadBudget object (default=None)
+        The downloaded bytes are counted against this budget
+
+    Returns
+    -------
+    result : ObsResult object
+
+    """
+
+    result = ObsResult(job.obsid)
+    unzip_jobs = []
+
+    def queue_unzip(local_file):
+        if (unzipper is not None) and local_file.endswith('.gz') and os.path.isfile(local_file):
+            unzip_jobs.append((local_file, unzipper.submit(gunzip_file, local_file)))
+
+    # (a download that breaks off part way is tried again as the client's
+    # retry policy allows, and picks up where it stopped if there's a
+    # journal)
+    def fetch(url, local_file, refresh=False):
+        nbytes = client.retry(download_file, client, url, local_file, journal=journal,
+                                  refresh=refresh)
+        if nbytes is None:
+            return False
+        result.nbytes += nbytes
+        if budget is not None:
+            budget.add(nbytes)
+        return True
+
+    selection_key = None if job.selection is None else job.selection.key
+
+    # files (with sizes and checksums) from earlier downloads
+    manifest = ObsManifest.for_obs(job.save_path, job.obsid)
+
+    # check the files from an earlier download, and only fetch the ones
+    # that are missing or corrupt
+    if job.verify and (len(manifest.files) > 0):
+        try:
+            for rel_path in manifest.verify(max_workers=HASH_WORKERS):
+                url = client.url(manifest.files[rel_path]['path'])
+                local_file = manifest.local_file(rel_path)
+                remove_local(local_file)
+                fetch(url, local_file)
+                manifest.add(rel_path, url)
+                result.files.append(local_file)
+                queue_unzip(local_file)
+        except (IOError, http.client.HTTPException, socket.error) as e:
+            result.error = str(e)
+        result.skipped = [manifest.local_file(rel_path) for rel_path in sorted(manifest.files)
+                              if manifest.local_file(rel_path) not in result.files]
+        unzip_error = wait_for_unzip(unzip_jobs)
+        if result.ok:
+            result.error = unzip_error
+        manifest.save()
+        return result
+
+    # already finished in an earlier run
+    if (not job.verify) and (not job.download_all) and (journal is not None) \
+      and journal.obs_complete(job.obsid, selection=selection_key):
+        done_files = [os.path.join(job.save_path, f) for f in journal.obs_files(job.obsid)]
+        if all([file_present(f) for f in done_files]) and (len(manifest.missing()) == 0):
+            result.skipped = done_files
+            for local_file in done_files:
+                queue_unzip(local_file)
+            result.error = wait_for_unzip(unzip_jobs)
+            return result
+
+    base_url = obs_url(client, job.start_month, job.obsid)
+    if journal is not None:
+        journal.start_obs(job.obsid)
+
+    subdir_list = OBS_SUBDIRS if job.selection is None else job.selection.subdirs
+
+    try:
+        for subdir in subdir_list:
+            for url in client.retry(crawl, client, obs_url(client, job.start_month, job.obsid, subdir),
+                                        cache=listing_cache, revalidate=job.download_all):
+                # same layout as `wget -nH --cut-dirs=5`: save_path/obsid/...
+                rel_path = urllib.parse.unquote(url[len(base_url):])
+                if (job.selection is not None) and not job.selection.match(rel_path):
+                    continue
+                local_file = os.path.join(job.save_path, job.obsid, *rel_path.split('/'))
+
+                # (files that don't match the size in the manifest are
+                # downloaded again)
+                if file_present(local_file) and not manifest.check(rel_path):
+                    remove_local(local_file)
+
+                # (with download_all, files that are already there are
+                # downloaded again if HEASARC has a newer version)
+                if file_present(local_file):
+                    if not (job.download_all and fetch(url, local_file, refresh=True)):
+                        result.skipped.append(local_file)
+                        if rel_path not in manifest.files:
+                            manifest.add(rel_path, url)
+                        queue_unzip(local_file)
+                        continue
+                else:
+                    fetch(url, local_file)
+                result.files.append(local_file)
+                # (checksums are taken before the file is unzipped)
+                manifest.add(rel_path, url)
+                queue_unzip(local_file)
+
+    except (IOError, http.client.HTTPException, socket.error) as e:
+        result.error = str(e)
+
+    unzip_error = wait_for_unzip(unzip_jobs)
+    if result.ok:
+        result.error = unzip_error
+
+    if len(manifest.files) > 0:
+        manifest.save()
+
+    if (journal is not None) and result.ok:
+        journal.finish_obs(job.obsid, [os.path.relpath(f, job.save_path)
+                                           for f in result.files + result.skipped],
+                               selection=selection_key)
+
+    return result
+
+
+def wait_for_unzip(unzip_jobs):
+    """
+    Wait for the files submitted for unzipping.  A .gz file that can't be
+    unzipped is corrupt, so it's deleted (and will be downloaded again next
+    time).
+
+    Parameters
+    ----------
+    unzip_jobs : list of tuples
+        (gz file, future) for each submitted file
+
+    Returns
+    -------
+    error : string or None
+        Description of the first failure, or None if everything unzipped
+
+    """
+
+    error = None
+    for gz_file, future in unzip_jobs:
+        try:
+            future.result()
+        except (IOError, EOFError, zlib.error) as e:
+            if os.path.isfile(gz_file):
+                os.remove(gz_file)
+            if error is None:
+                error = 'could not unzip '+gz_file+': '+str(e)
+    return error
+
+
+class ObsDownloader(object):
+    """
+    Pool of workers that download observations as they're submitted, so
+    downloads can start before the full list of observations is known
+    (e.g., while other targets are still being queried).  Use it as a
+    context manager, or call close() to wait for everything to finish.
+
+    An observation that's submitted again for the same folder (e.g., by two
+    targets that share it, see archive_store.ArchiveStore) isn't downloaded
+    twice: the second submit returns the first one's future.
+
+    Whenever a worker is free, it starts the queued observation with the
+    smallest ObsJob.priority (in the order they were submitted, for equal
+    priorities), so the most useful data arrive first even if they're
+    submitted late.
+
+    Parameters
+    ----------
+    max_workers : int (default=4)
+        Number of observations to download at once
+
+    max_connections : int (default=4)
+        Maximum number of connections open to HEASARC at once (only used if
+        client is None)
+
+    client : HTTPClient object (default=None)
+        Client to download with.  If None, one is created (and closed by
+        close()).
+
+    use_journal : boolean (default=True)
+        If True, keep a TransferJournal in each save_path, so interrupted
+        downloads can be resumed and finished observations skipped
+
+    journals : dict (default=None)
+        TransferJournals that are already loaded, keyed by save_path (any
+        others are loaded as needed)
+
+    listing_cache : ListingCache object (default=None)
+        Cache of archive directory listings, shared by all of the workers
+
+    unzip : boolean (default=False)
+        If True, unzip each .gz file as soon as it's downloaded, in a pool of
+        processes that runs alongside the downloads
+
+    unzip_workers : int (default=None)
+        Number of processes for unzipping (if None, the number of CPUs)
+
+    verbose : boolean (default=True)
+        If True, print a line as each observation finishes
+
+    budget : DownloadBudget object (default=None)
+        If set, observations that haven't started when it's used up aren't
+        downloaded (their results have deferred=True)
+
+    adaptive : boolean (default=False)
+        If True, the number of connections adjusts itself to how HEASARC is
+        responding, up to max_connections (see
+        heasarc_http.AdaptiveConcurrency; only used if client is None).
+        max_workers should be at least max_connections, so there are
+        enough downloads to fill the connections.
+
+    max_bandwidth : float (default=None)
+        If set, the most bytes/s to download, over all of the workers (only
+        used if client is None)
+
+    retry_policy : RetryPolicy object (default=None)
+        How to retry failed requests and downloads (see
+        heasarc_http.RetryPolicy; only used if client is None)
+
+    """
+
+    def __init__(self, max_workers=4, max_connections=4, client=None,
+                     use_journal=True, journals=None, listing_cache=None,
+                     unzip=False, unzip_workers=None, verbose=True, budget=None,
+                     adaptive=False, max_bandwidth=None, retry_policy=None):
+        if client is None:
+            self.client = HTTPClient(max_connections=max_connections, adaptive=adaptive,
+                                         max_bandwidth=max_bandwidth, retry_policy=retry_policy)
+            self._own_client = True
+        else:
+            self.client = client
+            self._own_client = False
+        self.use_journal = use_journal
+        self.journals = {} if journals is None else dict(journals)
+        self.listing_cache = listing_cache
+        self.verbose = verbose
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._queued = {}
+        # queued observations, as (priority, order submitted, job, journal, future)
+        self._pending = []
+        self._counter = itertools.count()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self._unzipper = ProcessPoolExecutor(max_workers=unzip_workers) if unzip else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def journal(self, save_path):
+        """
+        The TransferJournal for a folder (loaded the first time it's needed),
+        or None if use_journal is False
+        """
+        if not self.use_journal:
+            return None
+        with self._lock:
+            if save_path not in self.journals:
+                self.journals[save_path] = TransferJournal(os.path.join(save_path, JOURNAL_NAME))
+            return self.journals[save_path]
+
+    def submit(self, job):
+        """
+        Queue an observation to download
+
+        Parameters
+        ----------
+        job : ObsJob object
+            The observation to download
+
+        Returns
+        -------
+        future : Future object
+            Its result is the ObsResult for the observation
+
+        """
+        key = (job.save_path, job.obsid, None if job.selection is None else job.selection.key)
+        journal = self.journal(job.save_path)
+        with self._lock:
+            if key in self._queued:
+                return self._queued[key]
+            future = Future()
+            heapq.heappush(self._pending, (job.priority, next(self._counter), job, journal, future))
+            self._queued[key] = future
+        if self.verbose:
+            future.add_done_callback(report_result)
+        # each task runs whichever observation is first in line when it starts
+        self._executor.submit(self._run_next)
+        return future
+
+    def _run_next(self):
+        with self._lock:
+            priority, order, job, journal, future = heapq.heappop(self._pending)
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            if (self.budget is not None) and self.budget.exhausted():
+                result = ObsResult(job.obsid)
+                result.error = 'download budget used up'
+                result.deferred = True
+            else:
+                result = download_obs(self.client, job, journal, self.listing_cache,
+                                          self._unzipper, self.budget)
+            future.set_result(result)
+        except BaseException as e:
+            future.set_exception(e)
+
+    def close(self):
+        """
+        Wait for the queued observations to finish, and shut down the workers
+        """
+        self._executor.shutdown(wait=True)
+        if self._unzipper is not None:
+            self._unzipper.shutdown()
+        if self._own_client:
+            if self.client.adaptive and self.verbose:
+                print('* finished with '+str(self.client.connection_limit())+' connections to HEASARC')
+            self.client.close()
+
+
+def report_result(future):
+    """
+    Print how the download of an observation went
+    """
+    if future.exception() is not None:
+        return
+    result = future.result()
+    if result.ok:
+        print('  '+result.obsid+': downloaded '+str(len(result.files))+' files')
+    elif result.deferred:
+        print('  '+result.obsid+': left for a later run ('+result.error+')')
+    else:
+        print('  '+result.obsid+': FAILED ('+result.error+')')
+
+
+def download_observations(job_list, max_workers=4, max_connections=4,
+                              client=None, use_journal=True, journals=None,
+                              listing_cache=None, unzip=False, unzip_workers=None,
+                              verbose=True, budget=None, adaptive=False, max_bandwidth=None,
+                              retry_policy=None):
+    """
+    Download many observations at the same time
+
+    Parameters
+    ----------
+    job_list : list of ObsJob objects
+        Observations to download
+
+    max_workers, max_connections, client, use_journal, journals,
+    listing_cache, unzip, unzip_workers, verbose, budget, adaptive,
+    max_bandwidth, retry_policy
+        See ObsDownloader
+
+    Returns
+    -------
+    results : list of ObsResult objects
+        One for each job, in the same order as job_list
+
+    """
+
+    with ObsDownloader(max_workers=max_workers, max_connections=max_connections,
+                           client=client, use_journal=use_journal, journals=journals,
+                           listing_cache=listing_cache, unzip=unzip,
+                           unzip_workers=unzip_workers, verbose=verbose,
+                           budget=budget, adaptive=adaptive,
+                           max_bandwidth=max_bandwidth, retry_policy=retry_policy) as downloader:
+        # (submitted in order of priority, so the first workers to start
+        # don't pick up whatever happens to be first in job_list)
+        futures = {}
+        for i in sorted(range(len(job_list)), key=lambda i: job_list[i].priority):
+            futures[i] = downloader.submit(job_list[i])
+        results = [futures[i].result() for i in range(len(job_list))]
+
+    return results
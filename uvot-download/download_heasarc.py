@@ -1,17 +1,33 @@
 import numpy as np
 import os
-import glob
-import subprocess
-import pdb
-from astropy.io import ascii
+
+from download_engine import ObsJob, FileSelection, DownloadBudget, download_observations
+from transfer_journal import TransferJournal, JOURNAL_NAME
+from heasarc_cache import ListingCache
+from unzip_heasarc import unzip_heasarc
+from heasarc_table import read_batch_table
+from obs_manifest import ObsManifest
+from archive_store import ArchiveStore, link_tree
+from download_plan import estimate_jobs, report_plan, DEFAULT_BANDWIDTH
+
+# filters that can be used in download_filters
+UVOT_FILTERS = ['w2','m2','w1','uu','bb','vv','wh','gu','gv']
+
+# orders the observations can be downloaded in (see job_priorities)
+PRIORITIES = ['exposure','recent','offset']
 
 
 def download_heasarc(heasarc_files, unzip=True, download_all=False,
-                         download_filters=None, min_exp=0.0):
+                         download_filters=None, min_exp=0.0,
+                         max_workers=4, max_connections=4, cache_listings=True,
+                         products=None, verify=False, store=None, priority=None,
+                         max_bytes=None, max_time=None, dry_run=False,
+                         bandwidth=DEFAULT_BANDWIDTH, adaptive=False, max_bandwidth=None,
+                         retry_policy=None):
     """
-    Using the observation table from query_heasarc, create a download script,
-    download the data, and unzip everything.  All files will be saved into the
-    same directory as the HEASARC observation table.
+    Using the observation table from query_heasarc, download the data and
+    unzip everything.  All files will be saved into the same directory as
+    the HEASARC observation table.
 
     Parameters
     ----------
@@ -20,11 +36,18 @@ def download_heasarc(heasarc_files, unzip=True, download_all=False,
         query_heasarc.py
 
     unzip : boolean (default=True)
-        Choose whether to unzip all of the downloaded files
+        Choose whether to unzip all of the downloaded files.  New files are
+        unzipped as they arrive, in parallel with the remaining downloads.
 
     download_all : boolean (default=False)
-        If True, download all data.  If False, only download new data (as
-        determined by existence of a folder with the relevant obsid).
+        If True, check all of the observations for new data: files that
+        HEASARC has added are downloaded, and files that HEASARC has
+        reprocessed since they were downloaded are downloaded again (like
+        `wget -N`).  If False, only download new data (as determined by
+        existence of a folder with the relevant obsid) and finish any
+        observations whose download was interrupted.  Interrupted files are
+        resumed from where they stopped, and observations that the download
+        journal lists as complete are skipped without checking HEASARC.
 
     download_filters : list of strings (default=None)
         Only download data for a given obsid if one of these filters is
@@ -41,6 +64,90 @@ def download_heasarc(heasarc_files, unzip=True, download_all=False,
         will take an absurd amount of time to download/process (e.g., M81).
         This check is undertaken after the check for download_filters.
 
+    max_workers : int (default=4)
+        Number of observations to download at the same time
+
+    max_connections : int (default=4)
+        Maximum number of connections open to HEASARC at the same time
+
+    adaptive : boolean (default=False)
+        If True, find the number of connections that gets the most out of
+        HEASARC (up to max_connections) as the download runs: it goes up
+        while throughput improves, and drops when HEASARC slows down or
+        answers with 429/5xx errors (see heasarc_http.AdaptiveConcurrency).
+        Set max_workers and max_connections to the most you'd allow (e.g.,
+        16).
+
+    max_bandwidth : float (default=None)
+        If set, the most bytes/s to download, over all connections
+
+    retry_policy : RetryPolicy object (default=None)
+        How to retry failed requests and downloads: exponential backoff
+        with jitter, a retry budget, and a circuit breaker that pauses the
+        downloads while HEASARC is down (see heasarc_http.RetryPolicy).  A
+        file whose download breaks off is resumed from where it stopped.
+        If None, the default policy is used.
+
+    cache_listings : boolean (default=True)
+        Keep a local cache of the HEASARC archive's directory listings (see
+        heasarc_cache.ListingCache), so that repeat runs and targets with
+        overlapping observations only check whether listings have changed
+
+    products : list of strings (default=None)
+        If set, only download these types of files (see
+        download_engine.PRODUCT_TYPES), and only for the filters in
+        download_filters (or all filters, if that's None).  For instance,
+        products=['sky','exposure','attitude'] with download_filters=['w2']
+        gets the w2 sky images and exposure maps and the attitude files,
+        and skips the event files, hk/, and the other filters.  If None,
+        all of the uvot/ and auxil/ files are downloaded.
+
+    verify : boolean (default=False)
+        If True, check the checksums of the files from earlier downloads
+        (in each observation's manifest, see obs_manifest.ObsManifest), and
+        download any that are missing or corrupt.  Even without verify,
+        observations with files missing from their manifest are finished.
+
+    store : string or ArchiveStore object (default=None)
+        If set, download the observations into this shared store (see
+        archive_store.ArchiveStore) and link them into each target's folder,
+        so observations that belong to several targets are only downloaded
+        and stored once
+
+    priority : string (default=None)
+        Order to download the observations in (across all of the targets):
+          exposure : longest total exposure first (in download_filters, if
+                     set, otherwise all filters)
+          recent : newest first
+          offset : closest to the target first
+        If None, they're downloaded in the order of the tables.  Along with
+        max_bytes/max_time, this is an alternative to min_exp for objects
+        like M81: the most useful data arrive first, and the run can be
+        stopped early (or cut off by the budget) with a useful subset.
+
+    max_bytes : int (default=None)
+        Don't start any more observations once this many bytes have been
+        downloaded.  The rest are left for a later run.
+
+    max_time : float (default=None)
+        Don't start any more observations after this many seconds
+
+    dry_run : boolean (default=False)
+        If True, don't download anything.  Instead, make the full plan
+        (listing the archive folders and getting the file sizes with HEAD
+        requests, several at a time), and print the number of files, bytes,
+        and estimated time for each target (see download_plan).
+
+    bandwidth : float (default=5e6)
+        Download speed (bytes/s) assumed for the dry_run time estimates
+
+    Returns
+    -------
+    results : dict
+        For each file in heasarc_files, a list of ObsResult objects (see
+        download_engine) with the files downloaded and any errors for each
+        observation (or with dry_run, ObsEstimate objects, see download_plan)
+
     """
 
     # check if input is string or list
@@ -52,148 +159,489 @@ def download_heasarc(heasarc_files, unzip=True, download_all=False,
     # check that download_filters is set properly
     if download_filters is not None:
         for item in download_filters:
-            if item not in ['w2','m2','w1','uu','bb','vv','wh','gu','gv']:
+            if item not in UVOT_FILTERS:
                 print(item, ' is not allowed in download_filters')
                 return
+
+    # check that priority is set properly
+    if (priority is not None) and (priority not in PRIORITIES):
+        print(priority, ' is not allowed for priority')
+        return
     
+    # which files to download from each observation
+    selection = None if products is None else FileSelection(filters=download_filters, products=products)
+
+    # shared store that the observations are downloaded into
+    if (store is not None) and not isinstance(store, ArchiveStore):
+        store = ArchiveStore(store)
+
+    results = {}
+
+    # cache of the archive's directory listings
+    listing_cache = ListingCache() if cache_listings else None
+
+    # plan the downloads for all of the targets first, so observations that
+    # several of them share are only downloaded once
+    target_plans = []
+    journals = {}
 
     for filename in file_list:
 
+        results[filename] = []
+
         # galaxy name
         gal_name = os.path.realpath(filename).split('/')[-2]
     
         # read in the query output
-        with open(filename, 'r') as fh:
-            rows_list = fh.readlines()
+        heasarc_table = read_batch_table(filename)
 
-        # the file has 2 lines if there aren't any observations
-        if len(rows_list) == 2:
+        # no table rows if there aren't any observations
+        if len(heasarc_table) == 0:
             print("No observations of " + gal_name + " were found in HEASARC.")
-            dir_path = os.path.dirname(filename)
-            r = glob.glob(dir_path)
-            #for i in r:
-            #    os.remove(i)
             continue
 
-        # read heasarc table with astropy table!
-        heasarc_table = ascii.read(filename, format='fixed_width_two_line', comment='B', delimiter='+',
-                                       converters={'obsid':[ascii.convert_numpy(np.str)]})
-
-
         # path where things will get saved
         save_path = '/'.join( os.path.realpath(filename).split('/')[:-1] )
 
-        # prefix for all of the wget commands
-        wget_prefix = "wget -q -nH --no-check-certificate --cut-dirs=5 -r -l0 -c -N -np -R 'index*' -erobots=off --directory-prefix="+save_path+" --retr-symlinks https://heasarc.gsfc.nasa.gov/FTP/swift/data/obs/"
-
-        # path+name for download file
-        download_file = save_path + '/download.scr'
-        
-        # make sure download script doesn't exist
-        if os.path.isfile(download_file):
-            os.remove(download_file)
-                       
-
-        for i in range(len(heasarc_table)):
-           
-            # if user only wants to download some filters, do corresponding checks
-            if download_filters is not None:
-                filter_check = download_filter_check(heasarc_table[i], download_filters)
-                if filter_check == False:
-                    continue
-
-            # check for minimum exposure time
-            exp_check = min_exp_check(heasarc_table[i], min_exp)
-            if exp_check == False:
-                continue
-            
-            
-            obsid = heasarc_table['obsid'][i]
-            starttime = heasarc_table['start_time'][i]
-        
-            start_month = starttime[0:7]
-            start_month = start_month.replace('-','_')
-        
-            #    string addition to make wget commands for data download
-            wget_uvot = wget_prefix + start_month + '//' + obsid + "/uvot/"
-            wget_auxil = wget_prefix + start_month + '//' + obsid + "/auxil/"
-
-            # only add this observation to the script if:
-            # - folder for this obsid doesn't exist
-            # - folder does exist, but download_all is True
-            if (not os.path.isdir(save_path+'/'+obsid)) or (os.path.isdir(save_path+'/'+obsid) and download_all==True):
-                with open(download_file, 'a') as download_scr:
-                    download_scr.write(wget_uvot + '\n')
-                    download_scr.write(wget_auxil + '\n')
-
-        #run the download script here and put the results in the directories created at the beginning of the list
-
-
-        # run download script
-        # (but only if there are items to download)
-        if os.path.isfile(download_file):
-            print("* running download script for "+gal_name)
-            os.system('sh '+download_file)
+        # where the observations are downloaded (the target's folder, or the
+        # shared store), and the record of earlier downloads there
+        if store is None:
+            download_path = save_path
+            if download_path not in journals:
+                journals[download_path] = TransferJournal(save_path + '/' + JOURNAL_NAME)
         else:
+            download_path = store.obs_root
+            journals[download_path] = store.journal
+
+        # observations to download
+        job_list = plan_downloads(heasarc_table, download_path, journals[download_path],
+                                      download_filters=download_filters,
+                                      min_exp=min_exp, download_all=download_all,
+                                      selection=selection, verify=verify, priority=priority)
+
+        target_plans.append((filename, gal_name, save_path, download_path, heasarc_table, job_list))
+
+    # each observation is downloaded by the first target that needs it
+    unique_jobs = dedupe_jobs([plan[-1] for plan in target_plans])
+
+    # only report what would be downloaded
+    if dry_run:
+        estimates = report_dry_run([(plan[1], plan[-1]) for plan in target_plans], unique_jobs,
+                                       journals, listing_cache=listing_cache,
+                                       max_connections=max_connections, max_workers=max_workers,
+                                       bandwidth=bandwidth)
+        for plan, target_estimates in zip(target_plans, estimates):
+            results[plan[0]] = target_estimates
+        if listing_cache is not None:
+            listing_cache.close()
+        return results
+
+    for filename, gal_name, save_path, download_path, heasarc_table, job_list in target_plans:
+        n_shared = len([job for job in job_list if unique_jobs[job.obsid] is not job])
+        if len(job_list) == 0:
             print('* no new observations of '+gal_name+' to download')
-
-        #unzip all the downloaded data
-        if unzip:
-            print('* unzipping files')
-            for i in heasarc_table['obsid']:
-                gz_files = glob.glob(save_path+'/'+i+'/**/*.gz', recursive=True)
-                for gz in gz_files:
-                    # only unzip if the unzipped file doesn't exist
-                    if not os.path.isfile(gz[:-3]):
-                        subprocess.run('gunzip '+gz, shell=True)
+        elif n_shared > 0:
+            print("* downloading "+str(len(job_list))+" observations of "+gal_name
+                      +" ("+str(n_shared)+" shared with other targets)")
+        else:
+            print("* downloading "+str(len(job_list))+" observations of "+gal_name)
+
+    # download the observations
+    # (but only if there are items to download)
+    job_results = {}
+    budget = None
+    if (max_bytes is not None) or (max_time is not None):
+        budget = DownloadBudget(max_bytes=max_bytes, max_time=max_time)
+    if len(unique_jobs) > 0:
+        job_list = list(unique_jobs.values())
+        for job, result in zip(job_list, download_observations(job_list, max_workers=max_workers,
+                                                                   max_connections=max_connections,
+                                                                   journals=journals,
+                                                                   listing_cache=listing_cache,
+                                                                   unzip=unzip, budget=budget,
+                                                                   adaptive=adaptive,
+                                                                   max_bandwidth=max_bandwidth,
+                                                                   retry_policy=retry_policy)):
+            job_results[job.obsid] = result
+
+    for filename, gal_name, save_path, download_path, heasarc_table, job_list in target_plans:
+        results[filename] = [job_results[job.obsid] for job in job_list]
+        finish_target(gal_name, save_path, download_path, heasarc_table, job_list,
+                          results[filename], unique_jobs, journals, selection=selection,
+                          unzip=unzip, store=store, download_filters=download_filters,
+                          min_exp=min_exp)
+
+    if listing_cache is not None:
+        listing_cache.close()
+
+    return results
     
 
 
 
+def plan_downloads(heasarc_table, save_path, journal, download_filters=None,
+                       min_exp=0.0, download_all=False, selection=None, verify=False,
+                       priority=None):
+    """
+    Decide which observations in a table need to be downloaded
+
+    Parameters
+    ----------
+    heasarc_table : numpy structured array
+        Observation table from query_heasarc
+
+    save_path : string
+        Folder the observations are saved into
+
+    journal : TransferJournal object
+        Record of earlier downloads into save_path
+
+    download_filters, min_exp, download_all
+        See download_heasarc
+
+    selection : FileSelection object (default=None)
+        Which files to download from each observation (if None, all of them)
+
+    verify : boolean (default=False)
+        If True, also include every observation that was downloaded before,
+        so its files are checked against its manifest
+
+    priority : string (default=None)
+        How to order the jobs (see job_priorities)
+
+    Returns
+    -------
+    job_list : list of ObsJob objects
+        The observations to download, with their priorities set
+
+    """
+
+    job_list = []
+    selection_key = None if selection is None else selection.key
+
+    # only keep observations with the requested filters/exposure times
+    selected_table = select_observations(heasarc_table, download_filters=download_filters,
+                                             min_exp=min_exp)
+
+    priorities = job_priorities(selected_table, priority=priority, download_filters=download_filters)
+
+    for obsid, starttime, job_priority in zip(selected_table['obsid'].tolist(),
+                                                  selected_table['start_time'], priorities):
+
+        start_month = str(starttime)[0:7]
+        start_month = start_month.replace('-','_')
+
+        # only download this observation if:
+        # - folder for this obsid doesn't exist
+        # - folder does exist, but download_all is True
+        # - folder does exist, but the journal says the download was interrupted
+        #   (or was for a different selection of files)
+        # - folder does exist, but files in its manifest are missing
+        # - folder does exist, and its files are being verified
+        if (not os.path.isdir(save_path+'/'+obsid)) or (os.path.isdir(save_path+'/'+obsid) and download_all==True) \
+          or (journal.obs_started(obsid) and not journal.obs_complete(obsid, selection=selection_key)) \
+          or verify or (len(ObsManifest.for_obs(save_path, obsid).missing()) > 0):
+            job_list.append(ObsJob(obsid, start_month, save_path, selection=selection,
+                                       verify=verify, priority=job_priority,
+                                       download_all=download_all))
+
+    return job_list
+
+
+def job_priorities(heasarc_table, priority=None, download_filters=None):
+    """
+    Download priority for each observation in a table (smallest first)
+
+    Parameters
+    ----------
+    heasarc_table : numpy structured array
+        Observation table from query_heasarc
+
+    priority : string (default=None)
+        'exposure', 'recent', or 'offset' (see download_heasarc).  If None
+        (or the table doesn't have the column it needs), they're all 0.
+
+    download_filters : list of strings (default=None)
+        For priority='exposure', only add up the exposure times in these
+        filters
+
+    Returns
+    -------
+    priorities : list of floats
+        One for each row of heasarc_table
+
+    """
+
+    names = heasarc_table.dtype.names
+    priorities = np.zeros(len(heasarc_table))
+
+    # (blank entries are NaN/NaT, which would break the ordering, so they
+    # count as no exposure, or go last)
+    if priority == 'exposure':
+        exp_cols = [col for col in names
+                        if ('uvot_expo_' in col) and ((download_filters is None)
+                                                          or (col.replace('uvot_expo_','') in download_filters))]
+        if len(exp_cols) > 0:
+            priorities -= np.nansum([heasarc_table[col] for col in exp_cols], axis=0)
+
+    elif (priority == 'recent') and ('start_time' in names):
+        start_time = heasarc_table['start_time'].astype('datetime64[s]')
+        priorities = np.where(np.isnat(start_time), np.inf, -start_time.astype('int64').astype(float))
+
+    elif (priority == 'offset') and ('_offset' in names):
+        offset = heasarc_table['_offset'].astype(float)
+        priorities = np.where(np.isnan(offset), np.inf, offset)
+
+    return priorities.tolist()
+
+
+def dedupe_jobs(job_lists):
+    """
+    Combine the download plans for several targets, so that each
+    observation is only downloaded once, by the first target that needs it
+    (the others get it with share_obs)
+
+    Parameters
+    ----------
+    job_lists : list of lists of ObsJob objects
+        The plan for each target (from plan_downloads)
+
+    Returns
+    -------
+    unique_jobs : dict
+        For each obsid, the job that downloads it (in the order they were
+        planned)
+
+    """
+    unique_jobs = {}
+    for job_list in job_lists:
+        for job in job_list:
+            if job.obsid not in unique_jobs:
+                unique_jobs[job.obsid] = job
+    return unique_jobs
+
+
+def report_dry_run(target_plans, unique_jobs, journals, listing_cache=None,
+                       max_connections=4, max_workers=4, bandwidth=DEFAULT_BANDWIDTH):
+    """
+    Estimate the planned downloads (each observation only once, see
+    download_plan.estimate_jobs) and print them for each target
+
+    Parameters
+    ----------
+    target_plans : list of tuples
+        (name, list of ObsJob objects) for each target
+
+    unique_jobs : dict
+        For each obsid, the job that would download it (see dedupe_jobs)
+
+    journals : dict
+        TransferJournals keyed by the folders the jobs save into
+
+    listing_cache, max_connections, max_workers, bandwidth
+        See download_heasarc
+
+    Returns
+    -------
+    estimates : list of lists of ObsEstimate objects
+        For each target, the estimate for each of its jobs
+
+    """
+    estimates = dict(zip(unique_jobs.keys(),
+                             estimate_jobs(list(unique_jobs.values()), max_connections=max_connections,
+                                               journals=journals, listing_cache=listing_cache,
+                                               max_workers=max_workers)))
+    target_estimates = [(name, [estimates[job.obsid] for job in job_list])
+                            for name, job_list in target_plans]
+    report_plan(target_estimates, bandwidth=bandwidth, max_workers=max_workers)
+    return [plan_estimates for name, plan_estimates in target_estimates]
+
+
+def finish_target(name, save_path, download_path, heasarc_table, job_list, results,
+                      unique_jobs, journals, selection=None, unzip=True, store=None,
+                      download_filters=None, min_exp=0.0, verbose=True):
+    """
+    Wrap up a target once its observations have downloaded: report the ones
+    that failed or were left for a later run, give it the ones that other
+    targets downloaded (see share_obs), unzip anything that's still zipped,
+    and link its observations from the store (see link_observations)
+
+    Parameters
+    ----------
+    name : string
+        Name of the target (for the messages)
+
+    save_path : string
+        The target's folder
+
+    download_path : string
+        Folder its observations were downloaded into (save_path, or the
+        store's folder)
+
+    heasarc_table : numpy structured array
+        The target's observation table
+
+    job_list : list of ObsJob objects
+        The target's plan (from plan_downloads)
+
+    results : list of ObsResult objects
+        The outcome for each job in job_list
+
+    unique_jobs : dict
+        For each obsid, the job that downloaded it (see dedupe_jobs)
+
+    journals : dict
+        TransferJournals keyed by the folders the jobs saved into
+
+    selection, unzip, store, download_filters, min_exp
+        See download_heasarc
+
+    verbose : boolean (default=True)
+        If True, list the files that are unzipped
+
+    """
+
+    n_fail = len([r for r in results if not (r.ok or r.deferred)])
+    if n_fail > 0:
+        print('* '+str(n_fail)+' observations of '+name+' failed to download')
+    n_deferred = len([r for r in results if r.deferred])
+    if n_deferred > 0:
+        print('* '+str(n_deferred)+' observations of '+name+' were left for a later run')
+
+    # observations that were downloaded into another target's folder
+    for job, result in zip(job_list, results):
+        owner_job = unique_jobs[job.obsid]
+        if (owner_job.save_path != job.save_path) and result.ok:
+            share_obs(owner_job.save_path, job.save_path, job.obsid,
+                          journals[owner_job.save_path], journals[job.save_path],
+                          selection=selection)
+
+    #unzip any other zipped data (e.g., from earlier runs with unzip=False)
+    if unzip:
+        unzip_heasarc(download_path, obsids=heasarc_table['obsid'].tolist(), verbose=verbose)
+
+    # put the observations from the store into the target's folder
+    if store is not None:
+        link_observations(store, heasarc_table, save_path, download_filters=download_filters,
+                              min_exp=min_exp)
+
+
+def share_obs(src_path, dst_path, obsid, src_journal, dst_journal, selection=None):
+    """
+    Give a target an observation that was downloaded into another target's
+    folder, by hard linking its files (or copying them, if the folders are
+    on different filesystems), and record it as complete in the target's
+    journal
+
+    Parameters
+    ----------
+    src_path, dst_path : string
+        Folders of the target that downloaded the observation, and of the
+        target that needs it
+
+    obsid : string
+        Observation ID
+
+    src_journal, dst_journal : TransferJournal object
+        Journals for src_path and dst_path
+
+    selection : FileSelection object (default=None)
+        Which files of the observation were downloaded
+
+    """
+    link_tree(os.path.join(src_path, obsid), os.path.join(dst_path, obsid), relink=True,
+                  fallback='copy')
+    if (src_journal is not None) and (dst_journal is not None):
+        dst_journal.finish_obs(obsid, src_journal.obs_files(obsid),
+                                   selection=(None if selection is None else selection.key))
+
+
+def link_observations(store, heasarc_table, save_path, download_filters=None, min_exp=0.0):
+    """
+    Link the selected observations of a target from the shared store into
+    its folder (see archive_store.ArchiveStore.link_obs)
+
+    Returns
+    -------
+    n_linked : int
+        Number of files that were linked
+
+    """
+    selected_table = select_observations(heasarc_table, download_filters=download_filters,
+                                             min_exp=min_exp)
+    return sum([store.link_obs(obsid, save_path) for obsid in selected_table['obsid'].tolist()])
+
+
+def select_observations(heasarc_table, download_filters=None, min_exp=0.0):
+    """
+    Select the observations that pass the download_filters and min_exp
+    checks (see download_heasarc)
+
+    Parameters
+    ----------
+    heasarc_table : numpy structured array
+        Observation table from query_heasarc (see heasarc_table.read_batch_table)
+
+    download_filters : list of strings (default=None)
+        Keep observations with data in at least one of these filters
+
+    min_exp : float (default=0.0)
+        Keep observations with at least this much exposure time in at least
+        one filter
+
+    Returns
+    -------
+    selected_table : numpy structured array
+        The rows of heasarc_table that passed the checks
+
+    """
+
+    keep = min_exp_check(heasarc_table, min_exp)
+    if download_filters is not None:
+        keep &= download_filter_check(heasarc_table, download_filters)
+
+    return heasarc_table[keep]
+
+
 def download_filter_check(heasarc_table, download_filters):
     """
     Check if observations in the specified filters are present
+
+    Returns a boolean array with one element per row of heasarc_table
     """
 
-    download_data = [True] * len(download_filters)
+    download_data = np.zeros(len(heasarc_table), dtype=bool)
+
+    for filt in download_filters:
 
-    for f,filt in enumerate(download_filters):
+        # if there isn't info for this filter, assume it's there
+        if 'uvot_expo_'+filt not in heasarc_table.dtype.names:
+            return np.ones(len(heasarc_table), dtype=bool)
 
-        if 'uvot_expo_'+filt in heasarc_table.colnames:
-            if heasarc_table['uvot_expo_'+filt] < 1e-2:
-                download_data[f] = False
+        # (blank entries are NaN, which count as present, like the masked
+        # entries astropy used to give)
+        download_data |= ~(heasarc_table['uvot_expo_'+filt] < 1e-2)
 
-    if True in download_data:
-        return True
-    else:
-        return False
+    return download_data
 
 
 def min_exp_check(heasarc_table, min_exp):
     """
     Check if there are exposures above the min_exp threshold
-    """
 
-    exp_colnames = []
+    Returns a boolean array with one element per row of heasarc_table
+    """
 
     # figure out if there's exposure time info available
-    for col in heasarc_table.colnames:
-        if 'uvot_expo_' in col:
-            exp_colnames.append(col)
-    
+    exp_colnames = [col for col in heasarc_table.dtype.names if 'uvot_expo_' in col]
+
     # if there isn't info, return True
     if len(exp_colnames) == 0:
-        return True
+        return np.ones(len(heasarc_table), dtype=bool)
 
-
-    # if exposure time(s) are available, check if they're bigger than min_exp
+    # if exposure time(s) are available, check if any are bigger than min_exp
+    exp_check = np.zeros(len(heasarc_table), dtype=bool)
     for col in exp_colnames:
-        if heasarc_table[col] >= min_exp:
-            # if it is bigger, return True
-            return True
-
-    # if we get to this point, it's because none of the exposure times are long
-    # enough to trigger the "return True"
-    return False
+        exp_check |= heasarc_table[col] >= min_exp
 
-        
+    return exp_check
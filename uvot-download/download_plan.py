@@ -0,0 +1,308 @@
+import os
+import http.client
+import socket
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from heasarc_http import HTTPClient
+from archive_listing import obs_url, crawl
+from download_engine import OBS_SUBDIRS, file_present, local_last_modified
+from obs_manifest import ObsManifest
+
+# assumed sustained download speed (bytes/s) for the time estimates
+DEFAULT_BANDWIDTH = 5e6
+
+
+class ObsEstimate(object):
+    """
+    What downloading one observation would involve, without downloading it
+
+    Attributes
+    ----------
+    obsid : string
+        Observation ID
+
+    files : list of tuples
+        (local path, bytes to download) for each file that would be
+        downloaded
+
+    nbytes : int
+        Total bytes to download
+
+    head_time : float
+        Total time (s) spent on HEAD requests for the file sizes, and
+        head_count is how many there were (for the per-file overhead in
+        estimate_time)
+
+    error : string or None
+        Description of what went wrong, or None if it all worked
+
+    """
+
+    def __init__(self, obsid):
+        self.obsid = obsid
+        self.files = []
+        self.nbytes = 0
+        self.head_time = 0.0
+        self.head_count = 0
+        self.error = None
+        self._lock = threading.Lock()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def n_files(self):
+        return len(self.files)
+
+    def add(self, local_file, nbytes, head_time=None):
+        with self._lock:
+            self.files.append((local_file, nbytes))
+            self.nbytes += nbytes
+            if head_time is not None:
+                self.head_time += head_time
+                self.head_count += 1
+
+    def __repr__(self):
+        if self.ok:
+            return '<ObsEstimate '+self.obsid+': '+str(self.n_files)+' files, '+str(self.nbytes)+' bytes>'
+        return '<ObsEstimate '+self.obsid+': failed ('+self.error+')>'
+
+
+def remote_size(client, url, local_file, journal=None, refresh=False):
+    """
+    Number of bytes that downloading a file would transfer: its size from
+    the journal if an earlier download recorded it (less any partial
+    download that would be resumed), otherwise from a HEAD request.  With
+    refresh, the file is already there, and the HEAD request asks whether
+    HEASARC has a newer version (see download_engine.download_file).
+
+    Returns
+    -------
+    nbytes : int
+
+    head_time : float or None
+        How long the HEAD request took (s), or None if there wasn't one
+
+    """
+    entry = None if journal is None else journal.get_file(url)
+    headers = {}
+    if refresh:
+        headers['If-Modified-Since'] = local_last_modified(local_file, entry)
+    elif (entry is not None) and (entry.get('size') is not None):
+        nbytes = entry['size']
+        if os.path.isfile(local_file + '.part'):
+            nbytes -= os.path.getsize(local_file + '.part')
+        return max(nbytes, 0), None
+
+    start = time.monotonic()
+    response = client.head(url, headers=headers)
+    head_time = time.monotonic() - start
+    if refresh and (response.status == 304):
+        return 0, head_time
+    response.raise_for_status()
+    length = response.headers.get('Content-Length')
+    return (0 if length is None else int(length)), head_time
+
+
+def estimate_obs(client, job, journal=None, listing_cache=None, head_pool=None):
+    """
+    Work out which files of an observation would be downloaded (the same
+    way as download_engine.download_obs), and how big they are
+
+    Parameters
+    ----------
+    client : HTTPClient object
+        Client to query the archive with
+
+    job : ObsJob object
+        The observation
+
+    journal : TransferJournal object (default=None)
+        Journal for job.save_path
+
+    listing_cache : ListingCache object (default=None)
+        Cache of archive directory listings
+
+    head_pool : Executor object (default=None)
+        If set, the HEAD requests for the file sizes are sent through this
+        executor, several at a time
+
+    Returns
+    -------
+    estimate : ObsEstimate object
+
+    """
+
+    estimate = ObsEstimate(job.obsid)
+    selection_key = None if job.selection is None else job.selection.key
+    manifest = ObsManifest.for_obs(job.save_path, job.obsid)
+
+    # already finished in an earlier run
+    if (not job.verify) and (not job.download_all) and (journal is not None) \
+      and journal.obs_complete(job.obsid, selection=selection_key):
+        done_files = [os.path.join(job.save_path, f) for f in journal.obs_files(job.obsid)]
+        if all([file_present(f) for f in done_files]) and (len(manifest.missing()) == 0):
+            return estimate
+
+    base_url = obs_url(client, job.start_month, job.obsid)
+    subdir_list = OBS_SUBDIRS if job.selection is None else job.selection.subdirs
+
+    def size_file(url, local_file, refresh=False):
+        nbytes, head_time = remote_size(client, url, local_file, journal=journal, refresh=refresh)
+        if (nbytes > 0) or not refresh:
+            estimate.add(local_file, nbytes, head_time=head_time)
+
+    futures = []
+    try:
+        for subdir in subdir_list:
+            for url in crawl(client, obs_url(client, job.start_month, job.obsid, subdir),
+                                 cache=listing_cache, revalidate=job.download_all):
+                rel_path = urllib.parse.unquote(url[len(base_url):])
+                if (job.selection is not None) and not job.selection.match(rel_path):
+                    continue
+                local_file = os.path.join(job.save_path, job.obsid, *rel_path.split('/'))
+                # (with download_all, only if HEASARC has a newer version)
+                refresh = file_present(local_file) and manifest.check(rel_path)
+                if refresh and not job.download_all:
+                    continue
+                if head_pool is None:
+                    size_file(url, local_file, refresh)
+                else:
+                    futures.append(head_pool.submit(size_file, url, local_file, refresh))
+        for future in futures:
+            future.result()
+    except (IOError, http.client.HTTPException, socket.error) as e:
+        estimate.error = str(e)
+
+    return estimate
+
+
+def estimate_jobs(job_list, client=None, max_connections=8, journals=None,
+                      listing_cache=None, max_workers=4):
+    """
+    Estimate the downloads for many observations at the same time.  Nothing
+    is downloaded or written (other than to the listing cache).
+
+    Parameters
+    ----------
+    job_list : list of ObsJob objects
+        Observations to check
+
+    client : HTTPClient object (default=None)
+        Client to query the archive with.  If None, one is created with
+        max_connections.
+
+    max_connections : int (default=8)
+        Maximum number of connections open to HEASARC at once
+
+    journals : dict (default=None)
+        TransferJournals keyed by save_path
+
+    listing_cache : ListingCache object (default=None)
+        Cache of archive directory listings
+
+    max_workers : int (default=4)
+        Number of observations to crawl at the same time
+
+    Returns
+    -------
+    estimates : list of ObsEstimate objects
+        One for each job, in the same order as job_list
+
+    """
+
+    own_client = client is None
+    if own_client:
+        client = HTTPClient(max_connections=max_connections)
+    if journals is None:
+        journals = {}
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_connections)) as head_pool:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                futures = [executor.submit(estimate_obs, client, job, journals.get(job.save_path),
+                                               listing_cache, head_pool)
+                               for job in job_list]
+                estimates = [future.result() for future in futures]
+    finally:
+        if own_client:
+            client.close()
+
+    return estimates
+
+
+def estimate_time(estimates, bandwidth=DEFAULT_BANDWIDTH, max_workers=4):
+    """
+    Rough time (s) to download a set of observations: the bytes at the
+    given bandwidth, plus a per-file overhead (the average round trip of
+    the HEAD requests) shared between the download workers
+    """
+    nbytes = sum([e.nbytes for e in estimates])
+    n_files = sum([e.n_files for e in estimates])
+    head_count = sum([e.head_count for e in estimates])
+    per_file = 0.0 if head_count == 0 else sum([e.head_time for e in estimates])/head_count
+    return nbytes/bandwidth + n_files*per_file/max(1, max_workers)
+
+
+def report_plan(target_estimates, bandwidth=DEFAULT_BANDWIDTH, max_workers=4):
+    """
+    Print the size of the planned downloads for each target and in total
+
+    Parameters
+    ----------
+    target_estimates : list of tuples
+        (target name, list of ObsEstimate objects) for each target.  An
+        observation shared by several targets is listed under each of them,
+        but only counted once in the total.
+
+    bandwidth, max_workers
+        See estimate_time
+
+    """
+
+    unique = {}
+    for name, estimates in target_estimates:
+        n_obs = len([e for e in estimates if e.n_files > 0])
+        print('* '+name+': '+str(n_obs)+' observations, '
+                  +str(sum([e.n_files for e in estimates]))+' files, '
+                  +format_bytes(sum([e.nbytes for e in estimates]))+' (~'
+                  +format_duration(estimate_time(estimates, bandwidth=bandwidth,
+                                                     max_workers=max_workers))+')')
+        for e in estimates:
+            if not e.ok:
+                print('  '+e.obsid+': FAILED ('+e.error+')')
+            unique[e.obsid] = e
+
+    estimates = list(unique.values())
+    print('* total: '+str(len([e for e in estimates if e.n_files > 0]))+' observations, '
+              +str(sum([e.n_files for e in estimates]))+' files, '
+              +format_bytes(sum([e.nbytes for e in estimates]))+' (~'
+              +format_duration(estimate_time(estimates, bandwidth=bandwidth,
+                                                 max_workers=max_workers))
+              +' at '+format_bytes(bandwidth)+'/s)')
+
+
+def format_bytes(nbytes):
+    """
+    Number of bytes as a string like '1.2 GB'
+    """
+    for unit in ['B','kB','MB','GB']:
+        if abs(nbytes) < 1000:
+            return '{:.1f} {}'.format(nbytes, unit) if unit != 'B' else '{:d} B'.format(int(nbytes))
+        nbytes /= 1000
+    return '{:.1f} TB'.format(nbytes)
+
+
+def format_duration(seconds):
+    """
+    Time as a string like '3 min' or '2.5 hr'
+    """
+    if seconds < 60:
+        return '{:.0f} s'.format(seconds)
+    if seconds < 3600:
+        return '{:.0f} min'.format(seconds/60)
+    return '{:.1f} hr'.format(seconds/3600)
@@ -0,0 +1,271 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+
+
+def cache_dir():
+    """
+    Folder for the local caches: $UVOT_DOWNLOAD_CACHE if it's set, otherwise
+    ~/.cache/uvot-download
+    """
+    path = os.environ.get('UVOT_DOWNLOAD_CACHE',
+                              os.path.join(os.path.expanduser('~'), '.cache', 'uvot-download'))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class SQLiteCache(object):
+    """
+    Base for the caches that live in a SQLite file.  Keeps one connection
+    that is shared (behind a lock) by all threads, and evicts the least
+    recently used rows once there are more than max_entries.
+
+    Subclasses set `table` and `schema` (the column definitions, which must
+    include a `last_used` column).
+    """
+
+    table = None
+    schema = None
+
+    # how often (in number of writes) to check the size of the cache
+    evict_every = 500
+
+    def __init__(self, filename, max_entries=100000):
+        self.filename = filename
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._n_writes = 0
+        self._db = sqlite3.connect(filename, check_same_thread=False,
+                                       isolation_level=None, timeout=60)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS '+self.table+' ('+self.schema+')')
+        self._db.execute('CREATE INDEX IF NOT EXISTS '+self.table+'_last_used ON '+self.table+' (last_used)')
+        self.evict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _write(self, sql, params=()):
+        with self._lock:
+            self._db.execute(sql, params)
+            self._n_writes += 1
+            check_size = (self._n_writes % self.evict_every == 0)
+        if check_size:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used rows beyond max_entries
+        """
+        if self.max_entries is None:
+            return
+        with self._lock:
+            n_rows = self._db.execute('SELECT COUNT(*) FROM '+self.table).fetchone()[0]
+            if n_rows > self.max_entries:
+                self._db.execute('DELETE FROM '+self.table+' WHERE rowid IN '
+                                     + '(SELECT rowid FROM '+self.table+' ORDER BY last_used LIMIT ?)',
+                                     (n_rows - self.max_entries,))
+
+    def clear(self):
+        """
+        Remove everything from the cache
+        """
+        with self._lock:
+            self._db.execute('DELETE FROM '+self.table)
+
+
+class ListingCache(SQLiteCache):
+    """
+    Cache of archive directory listings, keyed by URL.  Listings younger
+    than `ttl` are used as-is; older ones are revalidated with a conditional
+    request (If-None-Match/If-Modified-Since), so an unchanged directory
+    costs a 304 rather than a new listing.
+
+    Parameters
+    ----------
+    filename : string (default=None)
+        SQLite file for the cache.  If None, listings.sqlite in cache_dir().
+
+    ttl : float (default=86400)
+        Seconds for which a cached listing is trusted without asking HEASARC
+
+    max_entries : int (default=100000)
+        Maximum number of listings to keep
+
+    """
+
+    table = 'listings'
+    schema = 'url TEXT PRIMARY KEY, entries TEXT, etag TEXT, last_modified TEXT, ' + \
+      'checked REAL, last_used REAL'
+
+    def __init__(self, filename=None, ttl=86400, max_entries=100000):
+        if filename is None:
+            filename = os.path.join(cache_dir(), 'listings.sqlite')
+        self.ttl = ttl
+        SQLiteCache.__init__(self, filename, max_entries=max_entries)
+
+    def get(self, url):
+        """
+        Cached listing for a URL
+
+        Returns
+        -------
+        entry : dict or None
+            None if the URL isn't cached.  Otherwise, a dict with the
+            'entries', 'etag', 'last_modified', and whether it's 'fresh'
+            (checked within the last ttl seconds).
+
+        """
+        rows = self._query('SELECT entries, etag, last_modified, checked FROM listings WHERE url=?', (url,))
+        if len(rows) == 0:
+            return None
+        now = time.time()
+        self._write('UPDATE listings SET last_used=? WHERE url=?', (now, url))
+        entries, etag, last_modified, checked = rows[0]
+        return {'entries':json.loads(entries), 'etag':etag, 'last_modified':last_modified,
+                    'fresh':(now - checked) < self.ttl}
+
+    def put(self, url, entries, etag=None, last_modified=None):
+        """
+        Save the listing for a URL
+        """
+        now = time.time()
+        self._write('INSERT OR REPLACE INTO listings VALUES (?,?,?,?,?,?)',
+                        (url, json.dumps(entries), etag, last_modified, now, now))
+
+    def touch(self, url):
+        """
+        Mark a cached listing as just revalidated
+        """
+        now = time.time()
+        self._write('UPDATE listings SET checked=?, last_used=? WHERE url=?', (now, now, url))
+
+
+class QueryCache(SQLiteCache):
+    """
+    Cache of HEASARC query results, keyed by the queried entry, name
+    resolver, search radius, and fields.  Results older than `ttl` are
+    ignored (and replaced when the query is rerun).
+
+    Parameters
+    ----------
+    filename : string (default=None)
+        SQLite file for the cache.  If None, queries.sqlite in cache_dir().
+
+    ttl : float (default=3600)
+        Seconds for which a cached result is used
+
+    max_entries : int (default=100000)
+        Maximum number of results to keep
+
+    """
+
+    table = 'queries'
+    schema = 'key TEXT PRIMARY KEY, result TEXT, created REAL, last_used REAL'
+
+    def __init__(self, filename=None, ttl=3600, max_entries=100000):
+        if filename is None:
+            filename = os.path.join(cache_dir(), 'queries.sqlite')
+        self.ttl = ttl
+        SQLiteCache.__init__(self, filename, max_entries=max_entries)
+
+    @staticmethod
+    def make_key(entry, resolver, radius, fields):
+        return '|'.join([entry, resolver, str(float(radius)), ','.join(fields)])
+
+    def get(self, entry, resolver, radius, fields):
+        """
+        Cached result of a query, or None if it isn't cached (or has expired)
+        """
+        key = self.make_key(entry, resolver, radius, fields)
+        rows = self._query('SELECT result, created FROM queries WHERE key=?', (key,))
+        if (len(rows) == 0) or (time.time() - rows[0][1] >= self.ttl):
+            return None
+        self._write('UPDATE queries SET last_used=? WHERE key=?', (time.time(), key))
+        return rows[0][0]
+
+    def put(self, entry, resolver, radius, fields, result):
+        """
+        Save the result of a query
+        """
+        key = self.make_key(entry, resolver, radius, fields)
+        now = time.time()
+        self._write('INSERT OR REPLACE INTO queries VALUES (?,?,?,?)', (key, result, now, now))
+
+
+class ResolverCache(SQLiteCache):
+    """
+    Cache of object name -> coordinates lookups.  Names that couldn't be
+    resolved are saved too (for `negative_ttl` seconds), so a bad name only
+    costs the lookups once.
+
+    Parameters
+    ----------
+    filename : string (default=None)
+        SQLite file for the cache.  If None, resolver.sqlite in cache_dir().
+
+    negative_ttl : float (default=2592000)
+        Seconds for which a failed lookup is remembered (default is 30 days)
+
+    max_entries : int (default=100000)
+        Maximum number of names to keep
+
+    """
+
+    table = 'resolver'
+    schema = 'name TEXT PRIMARY KEY, ra REAL, dec REAL, resolver TEXT, created REAL, last_used REAL'
+
+    def __init__(self, filename=None, negative_ttl=30*86400, max_entries=100000):
+        if filename is None:
+            filename = os.path.join(cache_dir(), 'resolver.sqlite')
+        self.negative_ttl = negative_ttl
+        SQLiteCache.__init__(self, filename, max_entries=max_entries)
+
+    def get(self, name):
+        """
+        Cached lookup for a name
+
+        Returns
+        -------
+        entry : dict or None
+            None if the name isn't cached (or a failed lookup has expired).
+            Otherwise, a dict with 'ra' and 'dec' (degrees, both None if the
+            name couldn't be resolved), the 'resolver' that worked, and the
+            time it was 'created'.
+
+        """
+        rows = self._query('SELECT ra, dec, resolver, created FROM resolver WHERE name=?', (name,))
+        if len(rows) == 0:
+            return None
+        ra, dec, resolver, created = rows[0]
+        if (resolver is None) and (time.time() - created >= self.negative_ttl):
+            return None
+        self._write('UPDATE resolver SET last_used=? WHERE name=?', (time.time(), name))
+        return {'ra':ra, 'dec':dec, 'resolver':resolver, 'created':created}
+
+    def put(self, name, ra, dec, resolver):
+        """
+        Save the coordinates (degrees) for a name
+        """
+        now = time.time()
+        self._write('INSERT OR REPLACE INTO resolver VALUES (?,?,?,?,?,?)',
+                        (name, ra, dec, resolver, now, now))
+
+    def put_failure(self, name):
+        """
+        Save that a name couldn't be resolved
+        """
+        self.put(name, None, None, None)
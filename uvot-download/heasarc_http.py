@@ -0,0 +1,714 @@
+import http.client
+import random
+import socket
+import ssl
+import threading
+import time
+import urllib.parse
+
+HEASARC_URL = 'https://heasarc.gsfc.nasa.gov'
+
+# upper limit on the connections to one host when they're adjusted
+# automatically and max_connections isn't set
+ADAPTIVE_MAX_CONNECTIONS = 16
+
+
+class HTTPError(IOError):
+    """
+    Raised when HEASARC answers with an HTTP error status
+    """
+
+    def __init__(self, url, status, reason=''):
+        IOError.__init__(self, 'HTTP '+str(status)+' '+reason+' for '+url)
+        self.url = url
+        self.status = status
+
+
+class CircuitOpenError(IOError):
+    """
+    Raised instead of sending a request to a host that has failed so many
+    times in a row that the retry policy has given up on it
+    """
+
+
+class ResponseError(IOError):
+    """
+    Raised when a response can't be used even though its status was fine
+    (e.g., HEASARC sent an empty page, or a download was cut off)
+    """
+
+
+# errors from reusing a kept-alive connection that the server has closed
+# while it was idle
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError,
+                               ConnectionAbortedError, BrokenPipeError)
+
+# errors from talking to a server, as opposed to local ones (like a folder
+# that can't be written to) that would only happen again on a retry
+NETWORK_ERRORS = (HTTPError, CircuitOpenError, ResponseError, ConnectionError,
+                      socket.timeout, socket.gaierror, ssl.SSLError,
+                      http.client.HTTPException)
+
+
+class RetryPolicy(object):
+    """
+    When to retry failed requests and how long to wait.  Every request an
+    HTTPClient sends goes through its policy (queries, name lookups,
+    archive listings, and downloads), and clients can share one policy so
+    they see the same budget and circuit breakers:
+
+      * A failed request (connection error, 429, or 5xx) is retried up to
+        `retries` times.  Before retry n, it waits a random time between 0
+        and backoff*2**n seconds (capped at max_backoff), so threads that
+        failed together don't all retry together.  A Retry-After header
+        from the server is respected.
+      * Retries come out of a budget: there are `budget` to start with,
+        and each successful request earns back `budget_ratio` of one.  When
+        most requests are failing, the retries dry up instead of piling
+        more load onto the server.
+      * After `failure_threshold` failures in a row from one host, its
+        circuit breaker opens: requests to it wait for `cooldown` seconds,
+        then a single request goes through to test the host.  If that
+        works, everything carries on; if not, the wait doubles (up to
+        max_cooldown).  Once the breaker has opened `max_trips` times in a
+        row, requests to the host fail straight away with
+        CircuitOpenError.
+
+    Parameters
+    ----------
+    retries : int (default=3)
+        Most times to retry one request
+
+    backoff : float (default=1.0)
+        Longest wait (s) before the first retry; doubled for each later one
+
+    max_backoff : float (default=60.0)
+        Longest wait (s) before any retry
+
+    budget : int (default=100)
+        Most retries that can be banked
+
+    budget_ratio : float (default=0.1)
+        Retries earned back by each successful request
+
+    failure_threshold : int (default=10)
+        Failures in a row (from any of the threads) that open the breaker
+
+    cooldown : float (default=30.0)
+        Time (s) the breaker stays open the first time
+
+    max_cooldown : float (default=600.0)
+        Longest time (s) the breaker stays open
+
+    max_trips : int (default=5)
+        Times in a row the breaker can open before giving up on the host
+
+    """
+
+    def __init__(self, retries=3, backoff=1.0, max_backoff=60.0, budget=100,
+                     budget_ratio=0.1, failure_threshold=10, cooldown=30.0,
+                     max_cooldown=600.0, max_trips=5):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.budget_ratio = budget_ratio
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_trips = max_trips
+        self.tokens = float(budget)
+        self._cond = threading.Condition()
+        # breaker for each host with recent failures: number of failures in
+        # a row, when it closes again (None if it's not open), number of
+        # times it's opened in a row, and whether a test request is out
+        self._hosts = {}
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Time (s) to wait before retrying after the given attempt (0 for the
+        first try), with a server's Retry-After value (in seconds) if it
+        sent one
+        """
+        wait = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        if retry_after is not None:
+            try:
+                wait = max(wait, min(self.max_backoff, float(retry_after)))
+            except ValueError:
+                pass
+        return wait
+
+    def should_retry(self, attempt):
+        """
+        True if a request that failed on the given attempt (0 for the first
+        try) should be tried again, which uses up one retry from the budget
+        """
+        if attempt >= self.retries:
+            return False
+        with self._cond:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def retryable(self, error):
+        """
+        True if an operation that raised this error is worth trying again
+        (see HTTPClient.retry): errors like a dropped connection part way
+        through a response, but not HTTP errors (the request was already
+        retried if the status allowed it), errors the client already
+        retried, or an open circuit breaker
+        """
+        if isinstance(error, (HTTPError, CircuitOpenError)):
+            return False
+        return not getattr(error, 'retried', False)
+
+    def before_request(self, host):
+        """
+        Wait until the host's circuit breaker lets a request through, or
+        raise CircuitOpenError if it's given up on the host
+        """
+        with self._cond:
+            while True:
+                state = self._hosts.get(host)
+                if (state is None) or (state['open_until'] is None):
+                    return
+                if state['trips'] >= self.max_trips:
+                    raise CircuitOpenError('giving up on '+host+' after '+str(state['failures'])
+                                               +' failed requests in a row')
+                now = time.monotonic()
+                if (now >= state['open_until']) and not state['testing']:
+                    state['testing'] = True
+                    return
+                self._cond.wait(max(0.01, state['open_until'] - now) if now < state['open_until'] else None)
+
+    def record_success(self, host):
+        """
+        Record a request that worked (which closes the host's breaker)
+        """
+        with self._cond:
+            self.tokens = min(self.budget, self.tokens + self.budget_ratio)
+            if host in self._hosts:
+                del self._hosts[host]
+                self._cond.notify_all()
+
+    def record_failure(self, host):
+        """
+        Record a request that failed, opening the host's breaker if there
+        have been too many in a row (or the test request failed)
+        """
+        with self._cond:
+            state = self._hosts.setdefault(host, {'failures':0, 'open_until':None,
+                                                      'trips':0, 'testing':False})
+            state['failures'] += 1
+            if state['testing'] or ((state['open_until'] is None) and
+                                        (state['failures'] >= self.failure_threshold)):
+                state['trips'] += 1
+                state['open_until'] = time.monotonic() + min(self.max_cooldown,
+                                                                  self.cooldown * 2**(state['trips']-1))
+                state['testing'] = False
+                self._cond.notify_all()
+
+
+class RateLimiter(object):
+    """
+    Space out requests so that each host sees at most `rate` requests per
+    second, no matter how many threads are making them.  Setting rate to
+    None (or 0) turns off the limiting.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next_time = {}
+
+    def wait(self, host):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_time.get(host, now))
+            self._next_time[host] = slot + 1.0/self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class AdaptiveConcurrency(object):
+    """
+    Limit on the number of requests in flight to one host that adjusts
+    itself to what the host can handle (additive increase, multiplicative
+    decrease, as in TCP congestion control):
+
+      * It starts at one request and doubles the limit after each window
+        (as many successful responses as the limit) until the first sign of
+        trouble, and after that adds one per window.
+      * A 429 or 5xx response or a connection error halves the limit (only
+        once per round trip, since a burst of errors is one event), and the
+        limit doesn't go up again until a window passes without errors.
+      * If the time to the first byte climbs to latency_factor times the
+        quickest seen, requests are queueing at the server, so the limit
+        goes down by one.
+      * If raising the limit didn't raise the throughput of the window by
+        at least 5%, it goes back down (e.g., once the bandwidth is used
+        up, more connections only add load).
+
+    Parameters
+    ----------
+    max_limit : int
+        Most requests to allow at once
+
+    min_limit : int (default=1)
+        Fewest requests to allow at once
+
+    decrease : float (default=0.5)
+        Factor the limit is multiplied by after an error
+
+    latency_factor : float (default=3.0)
+        How much slower than the quickest response counts as congested
+
+    """
+
+    def __init__(self, max_limit, min_limit=1, decrease=0.5, latency_factor=3.0):
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.limit = float(min_limit)
+        self.in_use = 0
+        self._cond = threading.Condition()
+        self._slow_start = True
+        self._min_latency = None
+        self._latency = None
+        self._last_decrease = 0.0
+        self._prev = None
+        self._reset_window(time.monotonic())
+
+    def acquire(self):
+        with self._cond:
+            while self.in_use >= int(self.limit):
+                self._cond.wait()
+            self.in_use += 1
+
+    def release(self):
+        with self._cond:
+            self.in_use -= 1
+            self._cond.notify_all()
+
+    def on_error(self):
+        """
+        Record a throttled/failed request (429, 5xx, or a connection error)
+        """
+        with self._cond:
+            now = time.monotonic()
+            self._window_errors += 1
+            if now - self._last_decrease < 2*(self._latency or 0.0):
+                return
+            self._last_decrease = now
+            self._slow_start = False
+            self.limit = max(self.min_limit, self.limit*self.decrease)
+            self._prev = None
+            self._reset_window(now)
+            self._window_errors = 1
+
+    def on_success(self, latency, nbytes):
+        """
+        Record a finished request: the time (s) to its first byte and the
+        size of its body
+        """
+        with self._cond:
+            self._min_latency = latency if self._min_latency is None else min(self._min_latency, latency)
+            self._latency = latency if self._latency is None else 0.8*self._latency + 0.2*latency
+            self._window_count += 1
+            self._window_bytes += nbytes
+            if self._window_count < int(self.limit):
+                return
+
+            now = time.monotonic()
+            throughput = self._window_bytes / max(now - self._window_start, 1e-6)
+            limit = self.limit
+
+            if self._window_errors > 0:
+                pass
+            elif self._latency > self.latency_factor * max(self._min_latency, 1e-3):
+                self._slow_start = False
+                self.limit = max(self.min_limit, self.limit - 1)
+            elif (self._prev is not None) and (limit > self._prev[0]) and (throughput < 1.05*self._prev[1]):
+                self._slow_start = False
+                self.limit = self._prev[0]
+            elif self._slow_start:
+                self.limit = min(self.max_limit, self.limit*2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1)
+
+            self._prev = (limit, throughput)
+            self._reset_window(now)
+            self._cond.notify_all()
+
+    def _reset_window(self, now):
+        self._window_start = now
+        self._window_count = 0
+        self._window_bytes = 0
+        self._window_errors = 0
+
+
+class BandwidthLimiter(object):
+    """
+    Cap on the combined download rate (bytes/s) of all of the threads
+    sharing a client.  Each thread waits after reading a chunk until the
+    chunk's share of the time has passed (so the server is slowed down by
+    TCP flow control).  Setting rate to None (or 0) turns off the limiting.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next_time = None
+
+    def consume(self, nbytes):
+        if (not self.rate) or (nbytes == 0):
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = now if self._next_time is None else max(now, self._next_time)
+            self._next_time = start + nbytes/self.rate
+            wait = self._next_time - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+class HTTPClient(object):
+    """
+    Minimal HTTP client that keeps connections to each host open between
+    requests, so a run with many queries/downloads only pays for the TCP and
+    TLS handshakes once per connection rather than once per request.
+
+    The client is safe to share between threads: each request checks out an
+    idle connection for its host (or opens a new one), and the connection
+    goes back into the pool once the response has been read.
+
+    Parameters
+    ----------
+    base_url : string (default=HEASARC_URL)
+        Scheme and host that relative paths are resolved against.  Point
+        this at a local server for testing.
+
+    timeout : float (default=60)
+        Socket timeout (seconds) for connecting and for each read
+
+    retries : int (default=3)
+        Number of times to retry a request that failed with a connection
+        error or a 5xx/429 status (if retry_policy isn't given)
+
+    backoff : float (default=1.0)
+        Longest wait (s) before the first retry; doubled for each later
+        retry (if retry_policy isn't given)
+
+    retry_policy : RetryPolicy object (default=None)
+        Policy for retrying failed requests, which can be shared with other
+        clients.  If None, one is made with retries and backoff.
+
+    limiter : RateLimiter object (default=None)
+        If set, wait for the limiter before every request
+
+    max_connections : int (default=None)
+        Maximum number of connections open to any one host at once.  Once
+        the cap is reached, further requests wait for a response to finish.
+        If None, there is no cap.
+
+    adaptive : boolean (default=False)
+        If True, adjust the number of connections to each host to the
+        throughput, latency, and errors it sees (see AdaptiveConcurrency),
+        up to max_connections (or ADAPTIVE_MAX_CONNECTIONS)
+
+    max_bandwidth : float (default=None)
+        If set, the most bytes/s to download, over all connections
+
+    check_certificate : boolean (default=False)
+        Verify the server's TLS certificate.  Off by default to match the
+        `--no-check-certificate` flag that the wget commands used.
+
+    """
+
+    def __init__(self, base_url=HEASARC_URL, timeout=60, retries=3,
+                     backoff=1.0, limiter=None, max_connections=None,
+                     check_certificate=False, adaptive=False, max_bandwidth=None,
+                     retry_policy=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        if retry_policy is None:
+            retry_policy = RetryPolicy(retries=retries, backoff=backoff)
+        self.policy = retry_policy
+        self.limiter = limiter
+        self.adaptive = adaptive
+        if adaptive and (max_connections is None):
+            max_connections = ADAPTIVE_MAX_CONNECTIONS
+        self.max_connections = max_connections
+        self.bandwidth = BandwidthLimiter(max_bandwidth)
+        if check_certificate:
+            self._ssl_context = ssl.create_default_context()
+        else:
+            self._ssl_context = ssl._create_unverified_context()
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def url(self, path):
+        """
+        Turn a path (e.g., '/FTP/swift/data/obs/') into a full URL
+        """
+        if '://' in path:
+            return path
+        return self.base_url + '/' + path.lstrip('/')
+
+    def request(self, method, url, headers=None):
+        """
+        Send a request and return the (unread) Response.  Connection errors
+        and 5xx/429 statuses are retried as the retry policy allows; the
+        final response is returned whatever its status, so check `status`
+        or call `raise_for_status`.  The response must be read to the end or
+        closed so that its connection can be reused.
+        """
+
+        url = self.url(url)
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        all_headers = {'Connection':'keep-alive', 'User-Agent':'uvot-download'}
+        if headers is not None:
+            all_headers.update(headers)
+
+        attempt = 0
+        fresh = False
+        while True:
+
+            # (a retry on a fresh connection is still the same attempt, so it
+            # doesn't go through the rate limit and circuit breaker again:
+            # the breaker may be waiting on this very request as its test)
+            if not fresh:
+                if self.limiter is not None:
+                    self.limiter.wait(parts.netloc)
+                self.policy.before_request(parts.netloc)
+            self._acquire_slot(key)
+            conn, reused = self._get_conn(key, fresh=fresh)
+            fresh = False
+            start = time.monotonic()
+            try:
+                conn.request(method, path, headers=all_headers)
+                resp = conn.getresponse()
+            except (http.client.HTTPException, socket.error) as e:
+                conn.close()
+                # a pooled connection that the server closed while it was
+                # idle fails before any of the response arrives: that's not
+                # HEASARC's fault, so try again straight away on a new
+                # connection
+                if reused and isinstance(e, STALE_CONNECTION_ERRORS):
+                    self._release_slot(key)
+                    fresh = True
+                    continue
+                self._report_error(key)
+                self._release_slot(key)
+                self.policy.record_failure(parts.netloc)
+                if not self.policy.should_retry(attempt):
+                    # (so HTTPClient.retry doesn't retry it all over again)
+                    e.retried = True
+                    raise
+                time.sleep(self.policy.delay(attempt))
+                attempt += 1
+                continue
+
+            response = Response(self, key, conn, resp, url, latency=time.monotonic()-start)
+            if resp.status >= 500 or resp.status == 429:
+                self._report_error(key)
+                self.policy.record_failure(parts.netloc)
+                if self.policy.should_retry(attempt):
+                    response.close()
+                    time.sleep(self.policy.delay(attempt, resp.getheader('Retry-After')))
+                    attempt += 1
+                    continue
+            else:
+                self.policy.record_success(parts.netloc)
+            return response
+
+    def retry(self, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs), and if it fails with an error that
+        request() couldn't retry (e.g., the connection dropped while the
+        response was being read, or HEASARC sent an empty page), call it
+        again as the retry policy allows (see RetryPolicy.retryable)
+        """
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except (IOError, http.client.HTTPException) as e:
+                if not (self.policy.retryable(e) and self.policy.should_retry(attempt)):
+                    raise
+                time.sleep(self.policy.delay(attempt))
+                attempt += 1
+
+    def get(self, url, headers=None):
+        """
+        GET a URL and read the whole body into `response.content`
+        """
+        response = self.request('GET', url, headers=headers)
+        with response:
+            response.content = response.read()
+        return response
+
+    def head(self, url, headers=None):
+        """
+        HEAD request; the response has no body to read
+        """
+        response = self.request('HEAD', url, headers=headers)
+        response.close()
+        return response
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def connection_limit(self, url=None):
+        """
+        Current limit on the connections to a host (the one in base_url by
+        default), or None if there isn't one
+        """
+        parts = urllib.parse.urlsplit(self.url(url or '/'))
+        slot = self._slots.get((parts.scheme, parts.netloc))
+        if isinstance(slot, AdaptiveConcurrency):
+            return int(slot.limit)
+        return self.max_connections
+
+    def _acquire_slot(self, key):
+        if self.max_connections is None:
+            return
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                if self.adaptive:
+                    slot = AdaptiveConcurrency(self.max_connections)
+                else:
+                    slot = threading.BoundedSemaphore(self.max_connections)
+                self._slots[key] = slot
+        slot.acquire()
+
+    def _release_slot(self, key):
+        if self.max_connections is None:
+            return
+        self._slots[key].release()
+
+    def _report_error(self, key):
+        if self.adaptive:
+            self._slots[key].on_error()
+
+    def _report_success(self, key, latency, nbytes):
+        if self.adaptive:
+            self._slots[key].on_success(latency, nbytes)
+
+    def _get_conn(self, key, fresh=False):
+        # (returns the connection, and whether it was reused from the pool)
+        if not fresh:
+            with self._lock:
+                conns = self._idle.get(key)
+                if conns:
+                    return conns.pop(), True
+        scheme, netloc = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout,
+                                                   context=self._ssl_context), False
+        return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def _put_conn(self, key, conn):
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+
+class Response(object):
+    """
+    Response from HTTPClient.request.  Read the body with `read` or
+    `iter_content`; the connection is handed back to the client once the
+    body is finished (or closed if it can't be reused).
+    """
+
+    def __init__(self, client, key, conn, resp, url, latency=None):
+        self._client = client
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self._nbytes = 0
+        self.url = url
+        self.latency = latency
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.msg
+        self.content = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, amt=None):
+        data = self._resp.read(amt)
+        self._nbytes += len(data)
+        self._client.bandwidth.consume(len(data))
+        if self._resp.isclosed():
+            self._release()
+        return data
+
+    def iter_content(self, chunk_size=1024*1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise HTTPError(self.url, self.status, self.reason)
+
+    def close(self):
+        if self._conn is None:
+            return
+        # nothing left to read for HEAD/304/empty responses
+        if self._resp.length == 0:
+            self._resp.read()
+        # a body that wasn't read to the end leaves the connection in an
+        # unusable state, so only recycle connections that are finished
+        if self._resp.isclosed():
+            self._release()
+        else:
+            self._resp.close()
+            self._conn.close()
+            self._conn = None
+            self._client._release_slot(self._key)
+
+    def _release(self):
+        if self._conn is None:
+            return
+        if (self.status < 500) and (self.status != 429) and (self.latency is not None):
+            self._client._report_success(self._key, self.latency, self._nbytes)
+        if self._resp.will_close:
+            self._conn.close()
+        else:
+            self._client._put_conn(self._key, self._conn)
+        self._conn = None
+        self._client._release_slot(self._key)
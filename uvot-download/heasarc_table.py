@@ -0,0 +1,217 @@
+import os
+import numpy as np
+
+# types for the columns we know about (anything else is kept as a string)
+COLUMN_DTYPES = {'obsid':'U11',
+                     'start_time':'datetime64[s]',
+                     'ra':'f8',
+                     'dec':'f8',
+                     '_offset':'f4'}
+for _filt in ['w2','m2','w1','uu','bb','vv','wh','gu','gv']:
+    COLUMN_DTYPES['uvot_expo_'+_filt] = 'f4'
+
+# how each type is written out (same as HEASARC's batch display)
+COLUMN_FORMATS = {'f8':'{:.5f}', 'f4':'{:.5f}'}
+OFFSET_FORMAT = '{:.4f}'
+
+
+def column_dtype(name):
+    """
+    NumPy type for a column of a HEASARC table
+    """
+    return COLUMN_DTYPES.get(name, 'U64')
+
+
+def parse_batch_table(text):
+    """
+    Read the table from HEASARC's pipe-delimited batch display, e.g.,
+
+        |obsid      |start_time         |uvot_expo_w2|_offset|
+        +-----------+-------------------+------------+-------+
+        |00084312006|2018-01-23T16:47:57|   108.76300| 0.4555|
+
+    Lines that aren't part of the table are ignored.
+
+    Parameters
+    ----------
+    text : string
+        Output from a HEASARC query
+
+    Returns
+    -------
+    data : numpy structured array
+        One element per row, with typed columns (see COLUMN_DTYPES).  Empty
+        (with no columns) if there isn't a table.
+
+    """
+
+    lines = [line for line in text.split('\n') if line.startswith('|')]
+
+    if len(lines) == 0:
+        return np.zeros(0, dtype=[])
+
+    header = lines[0]
+    rows = lines[1:]
+    col_names = [cell.strip() for cell in header.split('|')[1:-1]]
+
+    data = np.zeros(len(rows), dtype=[(name, column_dtype(name)) for name in col_names])
+    if len(rows) == 0:
+        return data
+
+    # the rows are normally fixed-width, with the same layout as the header,
+    # so each column can be cut out of all of the rows at once
+    width = len(header)
+    if all([len(row) == width for row in rows]):
+        chars = np.array(rows).view('U1').reshape(len(rows), width)
+        bars = [i for i, char in enumerate(header) if char == '|']
+        if np.all(chars[:, bars] == '|'):
+            columns = [np.ascontiguousarray(chars[:, bars[c]+1:bars[c+1]]).view('U'+str(bars[c+1]-bars[c]-1)).ravel()
+                           for c in range(len(col_names))]
+        else:
+            columns = None
+    else:
+        columns = None
+
+    # otherwise, split each row
+    if columns is None:
+        columns = [np.array(col) for col in zip(*[row.split('|')[1:-1] for row in rows])]
+
+    for c, name in enumerate(col_names):
+        values = np.char.strip(columns[c])
+        dtype = np.dtype(column_dtype(name))
+        if dtype.kind == 'f':
+            # blank entries become NaN
+            values = np.where(values == '', 'nan', values)
+        data[name] = values.astype(dtype)
+
+    return data
+
+
+def read_batch_table(filename):
+    """
+    Read a table file saved by query_heasarc (see parse_batch_table)
+    """
+    with open(filename, 'r') as f:
+        return parse_batch_table(f.read())
+
+
+def format_batch_table(data, columns=None):
+    """
+    Write a table in HEASARC's batch display format (so it can be read the
+    same way as a table from a HEASARC query)
+
+    Parameters
+    ----------
+    data : numpy structured array
+        Table to write
+
+    columns : list of strings (default=None)
+        Columns to write (if None, all of them)
+
+    Returns
+    -------
+    text : string
+        The formatted table
+
+    """
+
+    if columns is None:
+        columns = list(data.dtype.names)
+
+    if len(data) == 0:
+        return '\nno observations found\n'
+
+    text_cols = []
+    for name in columns:
+        values = data[name]
+        if name == '_offset':
+            strings = [OFFSET_FORMAT.format(v) for v in values]
+        elif values.dtype.kind == 'f':
+            strings = [COLUMN_FORMATS['f8'].format(v) for v in values]
+        elif values.dtype.kind == 'M':
+            strings = [str(v) for v in values.astype('datetime64[s]')]
+        else:
+            strings = [str(v) for v in values]
+        width = max([len(name)] + [len(v) for v in strings])
+        if values.dtype.kind in 'fiu':
+            strings = [v.rjust(width) for v in strings]
+        else:
+            strings = [v.ljust(width) for v in strings]
+        text_cols.append((name.ljust(width), strings))
+
+    lines = ['',
+             '|' + '|'.join([header for header, strings in text_cols]) + '|',
+             '+' + '+'.join(['-'*len(header) for header, strings in text_cols]) + '+']
+    for i in range(len(data)):
+        lines.append('|' + '|'.join([strings[i] for header, strings in text_cols]) + '|')
+    lines.append('Bye')
+
+    return '\n'.join(lines) + '\n'
+
+
+def table_row_lines(text):
+    """
+    The header and data rows of a table in the batch display format, as
+    they're written in the text (so they can be copied without reformatting)
+
+    Returns
+    -------
+    header : string or None
+        The header line (None if there isn't a table)
+
+    rows : list of strings
+        The data lines
+
+    """
+    header = None
+    rows = []
+    for line in text.split('\n'):
+        if not line.startswith('|'):
+            continue
+        if header is None:
+            header = line
+        else:
+            rows.append(line)
+    return header, rows
+
+
+def append_batch_rows(filename, row_lines):
+    """
+    Add rows to a table file in the batch display format, in place.  The new
+    rows go after the last row of the table (before the trailer), and only
+    the end of the file is rewritten.
+
+    Parameters
+    ----------
+    filename : string
+        The table file (with at least one row already)
+
+    row_lines : list of strings
+        Rows to add, formatted the same way as the ones in the file
+
+    """
+
+    if len(row_lines) == 0:
+        return
+
+    with open(filename, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        # the trailer is only a few lines, so the end of the file is enough
+        tail_start = max(0, size - 65536)
+        f.seek(tail_start)
+        tail = f.read()
+
+        # end of the last line of the table
+        lines = tail.splitlines(True)
+        cut = len(tail)
+        for line in reversed(lines):
+            if line.startswith(b'|'):
+                break
+            cut -= len(line)
+        else:
+            raise ValueError('could not find the table rows in '+filename)
+
+        f.seek(tail_start + cut)
+        f.write(''.join([line+'\n' for line in row_lines]).encode() + tail[cut:])
+        f.truncate()
@@ -0,0 +1,154 @@
+import re
+import urllib.parse
+
+from heasarc_http import ResponseError
+
+# CDS name resolver, which can look names up in NED or SIMBAD
+SESAME_URL = 'https://cds.unistra.fr/cgi-bin/nph-sesame/-oI/'
+SESAME_CODES = {'NED':'N', 'SIMBAD':'S'}
+
+
+def looks_like_coordinates(entry):
+    """
+    True if an entry is already a position (e.g., '00h09m56.5s -24d57m47s',
+    '09:43:32.4 +33:26:58', or '148.89 69.07') rather than a name
+    """
+    if re.match(r'^[0-9\s:hmsd.,+\-\'"]+$', entry.lower()) is None:
+        return False
+    return len(re.findall(r'[0-9]+', entry)) >= 2
+
+
+def sesame_lookup(name, resolver, client):
+    """
+    Look up the coordinates of a name with the CDS Sesame service
+
+    Parameters
+    ----------
+    name : string
+        Object name
+
+    resolver : string
+        'NED' or 'SIMBAD'
+
+    client : HTTPClient object
+        Client to send the request with
+
+    Returns
+    -------
+    position : tuple of floats, or None
+        (RA, Dec) in degrees, or None if the name couldn't be resolved.  If
+        the lookup itself fails (even after retrying, see
+        HTTPClient.retry), an IOError is raised instead, so the name isn't
+        recorded as unresolvable.
+
+    """
+
+    def attempt():
+        response = client.get(SESAME_URL + SESAME_CODES[resolver] + '?' + urllib.parse.quote(name))
+        response.raise_for_status()
+        text = response.text()
+        if text.strip() == '':
+            raise ResponseError('empty response from Sesame')
+        return text
+
+    for line in client.retry(attempt).split('\n'):
+        if line.startswith('%J '):
+            coords = line[3:].split('=')[0].split()
+            return float(coords[0]), float(coords[1])
+
+    return None
+
+
+def resolve_name(name, client, cache, refresh=False, resolvers=['NED','SIMBAD']):
+    """
+    Find the position of an object, using the resolver cache if possible.
+    Names are looked up with each resolver in turn, and the outcome
+    (including a failure) is saved in the cache.
+
+    Parameters
+    ----------
+    name : string
+        Object name (or coordinates, which are passed through as-is)
+
+    client : HTTPClient object
+        Client to send any lookups with
+
+    cache : ResolverCache object
+        Cache of earlier lookups
+
+    refresh : boolean (default=False)
+        If True, ignore the cache and look the name up again
+
+    resolvers : list of strings (default=['NED','SIMBAD'])
+        Resolvers to try, in order
+
+    Returns
+    -------
+    entry : string or None
+        What to send to HEASARC: the position as 'RA Dec' in degrees, the
+        input if it's already a position, or None if the name couldn't be
+        resolved
+
+    messages : list of strings
+        Lines to print about the lookup
+
+    """
+
+    if looks_like_coordinates(name):
+        return name, []
+
+    messages = []
+
+    cached = None if refresh else cache.get(name)
+    if cached is not None:
+        if cached['resolver'] is None:
+            messages.append('failed to resolve '+name+' (saved from an earlier lookup; refresh to try again)')
+            return None, messages
+        return position_entry(cached['ra'], cached['dec']), messages
+
+    for resolver in resolvers:
+        position = sesame_lookup(name, resolver, client)
+        if position is not None:
+            cache.put(name, position[0], position[1], resolver)
+            return position_entry(*position), messages
+        if resolver != resolvers[-1]:
+            messages.append('could not resolve '+name+' with '+resolver+', trying next name resolver')
+        else:
+            messages.append('could not resolve '+name+' with '+resolver)
+
+    messages.append('failed to resolve '+name)
+    cache.put_failure(name)
+    return None, messages
+
+
+def position_entry(ra, dec):
+    """
+    Format a position (degrees) for a HEASARC query
+    """
+    return '{:.6f} {:+.6f}'.format(ra, dec)
+
+
+def entry_degrees(entry):
+    """
+    Convert a position entry (from resolve_name) to RA and Dec in degrees
+
+    Parameters
+    ----------
+    entry : string
+        Position, either as 'RA Dec' in degrees or in sexagesimal form
+        (e.g., '00h09m56.5s -24d57m47s' or '00:09:56.5 -24:57:47')
+
+    Returns
+    -------
+    ra, dec : float
+        Position (degrees)
+
+    """
+    try:
+        ra, dec = [float(x) for x in entry.replace(',',' ').split()]
+        return ra, dec
+    except ValueError:
+        from astropy.coordinates import SkyCoord
+        import astropy.units as u
+        coord = SkyCoord(entry.replace(',',' '), unit=(u.hourangle, u.deg))
+        return coord.ra.deg, coord.dec.deg
@@ -0,0 +1,204 @@
+import os
+import urllib.parse
+import hashlib
+import json
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# name of the manifest file within each observation's folder
+MANIFEST_NAME = 'uvot_download_manifest.json'
+
+
+class ObsManifest(object):
+    """
+    List of the files downloaded for one observation, saved in the
+    observation's folder.  For each file (keyed by its path within the
+    observation, as in the archive), it keeps:
+
+      * path : where it was downloaded from (the path on the server, so the
+        manifest still works with a different mirror)
+      * size, sha256 : size and checksum of the file as downloaded
+      * data_size, crc32 : size and CRC-32 of the unzipped data (for .gz
+        files, these come from the gzip trailer, so a file that has since
+        been unzipped can still be checked)
+
+    HEASARC doesn't publish checksums for the archive files, so they're
+    computed when the files are downloaded.
+
+    Parameters
+    ----------
+    filename : string
+        Path of the manifest file.  If it exists, it's loaded.
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.files = {}
+        if os.path.isfile(filename):
+            try:
+                with open(filename, 'r') as fh:
+                    self.files = json.load(fh).get('files', {})
+            except ValueError:
+                self.files = {}
+
+    @classmethod
+    def for_obs(cls, save_path, obsid):
+        """
+        The manifest for an observation saved in save_path/obsid
+        """
+        return cls(os.path.join(save_path, obsid, MANIFEST_NAME))
+
+    @property
+    def obs_path(self):
+        return os.path.dirname(self.filename)
+
+    def local_file(self, rel_path):
+        """
+        Local path of a file (the .gz name, whether or not it's been
+        unzipped)
+        """
+        return os.path.join(self.obs_path, *rel_path.split('/'))
+
+    def add(self, rel_path, url):
+        """
+        Describe a downloaded file (see describe_file) and add it to the
+        manifest
+        """
+        entry = describe_file(self.local_file(rel_path))
+        if entry is not None:
+            entry['path'] = urllib.parse.urlsplit(url).path
+            self.files[rel_path] = entry
+
+    def check(self, rel_path, deep=False):
+        """
+        Check a file against its manifest entry (see check_file).  Files
+        that aren't in the manifest can't be checked, so they pass.
+        """
+        if rel_path not in self.files:
+            return True
+        return check_file(self.local_file(rel_path), self.files[rel_path], deep=deep)
+
+    def save(self):
+        """
+        Save the manifest (via a temporary file, so it's never half written)
+        """
+        os.makedirs(self.obs_path, exist_ok=True)
+        tmp_file = self.filename + '.tmp'
+        with open(tmp_file, 'w') as fh:
+            json.dump({'files':self.files}, fh, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.filename)
+
+    def missing(self):
+        """
+        Files in the manifest that aren't on disk (or are the wrong size);
+        cheap, since it only looks at the file sizes
+        """
+        return [rel_path for rel_path in sorted(self.files) if not self.check(rel_path)]
+
+    def verify(self, max_workers=4):
+        """
+        Check the checksums of all of the files in the manifest, several at
+        a time
+
+        Parameters
+        ----------
+        max_workers : int (default=4)
+            Number of files to hash at the same time
+
+        Returns
+        -------
+        bad_files : list of strings
+            Files (keys of self.files) that are missing or don't match
+
+        """
+        rel_paths = sorted(self.files)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            good = list(executor.map(lambda rel_path: self.check(rel_path, deep=True), rel_paths))
+        return [rel_path for rel_path, ok in zip(rel_paths, good) if not ok]
+
+
+def file_checksums(filename, chunk_size=1024*1024):
+    """
+    SHA-256 (hex string) and CRC-32 of a file, computed in one pass
+    """
+    sha256 = hashlib.sha256()
+    crc32 = 0
+    with open(filename, 'rb') as fh:
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            crc32 = zlib.crc32(chunk, crc32)
+    return sha256.hexdigest(), crc32 & 0xffffffff
+
+
+def gzip_trailer(gz_file):
+    """
+    CRC-32 and size (modulo 2**32) of the unzipped data, from the end of a
+    .gz file
+    """
+    with open(gz_file, 'rb') as fh:
+        fh.seek(-8, os.SEEK_END)
+        return struct.unpack('<II', fh.read(8))
+
+
+def describe_file(local_file):
+    """
+    Manifest entry for a file (see ObsManifest).  If only the unzipped
+    version of a .gz file is on disk, only data_size and crc32 are filled
+    in.  None if neither is there.
+    """
+    if os.path.isfile(local_file):
+        sha256, crc32 = file_checksums(local_file)
+        entry = {'size':os.path.getsize(local_file), 'sha256':sha256}
+        if local_file.endswith('.gz'):
+            entry['crc32'], entry['data_size'] = gzip_trailer(local_file)
+        else:
+            entry['crc32'], entry['data_size'] = crc32, entry['size']
+        return entry
+    if local_file.endswith('.gz') and os.path.isfile(local_file[:-3]):
+        sha256, crc32 = file_checksums(local_file[:-3])
+        return {'data_size':os.path.getsize(local_file[:-3]) % 2**32, 'crc32':crc32}
+    return None
+
+
+def check_file(local_file, entry, deep=False):
+    """
+    Check a file against its manifest entry.  Looks at the file as
+    downloaded if it's there, otherwise its unzipped version.
+
+    Parameters
+    ----------
+    local_file : string
+        Local path of the file (the .gz name for gzipped files)
+
+    entry : dict
+        The file's manifest entry
+
+    deep : boolean (default=False)
+        If True, compare checksums; otherwise, only the sizes
+
+    Returns
+    -------
+    ok : boolean
+
+    """
+    if os.path.isfile(local_file) and ('size' in entry):
+        if os.path.getsize(local_file) != entry['size']:
+            return False
+        return (not deep) or (file_checksums(local_file)[0] == entry['sha256'])
+
+    if os.path.isfile(local_file) and local_file.endswith('.gz') and ('data_size' in entry):
+        # only the unzipped data were recorded
+        return list(gzip_trailer(local_file)) == [entry['crc32'], entry['data_size']]
+
+    unzipped_file = local_file[:-3] if local_file.endswith('.gz') else None
+    if (unzipped_file is not None) and os.path.isfile(unzipped_file) and ('data_size' in entry):
+        if os.path.getsize(unzipped_file) % 2**32 != entry['data_size']:
+            return False
+        return (not deep) or (file_checksums(unzipped_file)[1] == entry['crc32'])
+
+    return False
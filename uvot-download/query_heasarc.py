@@ -1,16 +1,46 @@
-import numpy as np
 import os
+import json
 import argparse
 import sys
-import urllib.request
-import subprocess
+import urllib.parse
+
+from heasarc_http import HTTPClient, RateLimiter, ResponseError, NETWORK_ERRORS
+from heasarc_cache import QueryCache, ResolverCache
+from name_resolver import resolve_name, entry_degrees, looks_like_coordinates
+
+# numpy (and the modules that need it: swift_catalog and heasarc_table) are
+# only imported by the functions that use them, so that a plain query
+# starts quickly (see benchmark_startup.py)
+
+# how far (in days) before the latest start_time incremental queries look,
+# to catch observations that are added to HEASARC a while after they were
+# taken
+WATERMARK_LOOKBACK_DAYS = 14
+
+# table for an object without any observations (three lines, so that
+# report_output says there aren't any)
+NO_OBSERVATIONS_OUTPUT = '\nno observations found\nBye\n'
+
+
+class QueryFailed(IOError):
+    """
+    Raised by query_batch when some of its objects couldn't be queried, with
+    the objects that failed and the messages for the whole batch
+    """
+
+    def __init__(self, objects, messages):
+        IOError.__init__(self, 'could not query '+', '.join(objects))
+        self.objects = objects
+        self.messages = messages
 
-import pdb
 
 def query_heasarc(input_obj, list_opt=False, search_radius=7.0,
                       create_folder=True,
                       table_params=['obsid','start_time','uvot_expo_w2','uvot_expo_m2','uvot_expo_w1'],
-                      display_table=False):
+                      display_table=False, max_workers=1, rate_limit=None,
+                      client=None, use_cache=True, cache_ttl=3600, refresh=False,
+                      batch_size=None, resolve_names=True, local_catalog=False,
+                      incremental=False, on_table=None, retry_policy=None):
     """
     Find observations of a target in HEASARC
 
@@ -39,11 +69,84 @@ def query_heasarc(input_obj, list_opt=False, search_radius=7.0,
         If True, instead of saving the table to a file, display it in the
         terminal window.  Useful for quick checks of observations.
 
+    max_workers : int (default=1)
+        Number of objects to query at the same time.  Each object still tries
+        the name resolvers (NED, then SIMBAD) in order.  Useful for long lists
+        of objects, where the run time is dominated by waiting on HEASARC.
+
+    rate_limit : float (default=None)
+        Maximum number of requests per second sent to HEASARC (across all
+        workers).  If None, requests are sent as fast as the workers allow.
+
+    client : HTTPClient object (default=None)
+        Client to send the queries with.  If None, a client is created for
+        this call, so that all of the objects share its open connections
+        to HEASARC (rate_limit only applies to this internal client).
+
+    use_cache : boolean (default=True)
+        If True, keep the query results in a local cache (see
+        heasarc_cache.QueryCache), so rerunning the same query within
+        cache_ttl seconds doesn't contact HEASARC
+
+    cache_ttl : float (default=3600)
+        Seconds for which cached query results are used
+
+    refresh : boolean (default=False)
+        If True, ignore any cached results and query HEASARC again (the new
+        results are still saved to the cache)
+
+    batch_size : int (default=None)
+        If set, query HEASARC for up to this many objects in each request
+        and split the results back into the usual table for each object.
+        This turns a long list of objects into a handful of requests.
+        Objects without results in the combined query are queried
+        individually (see query_batch).
+
+    resolve_names : boolean (default=True)
+        If True, look up the coordinates of each object name once (with NED,
+        then SIMBAD), save them in a local cache (see
+        heasarc_cache.ResolverCache), and send HEASARC the coordinates.
+        Names that can't be resolved are remembered too, so they aren't
+        looked up again on every run (unless refresh is set).
+
+    local_catalog : boolean or string (default=False)
+        If set, search a local copy of swiftmastr (made with swift_catalog.py)
+        instead of querying HEASARC.  Set to True to use the default file,
+        or to the name of the catalog file.  Object names are still resolved
+        (and cached) as with resolve_names.
+
+    incremental : boolean (default=False)
+        If True, objects that already have a table only get the observations
+        that are newer than the latest start_time in it (see
+        query_new_observations), and the new rows are added to the end of
+        the table instead of rewriting it.  Useful for targets that are
+        monitored and queried regularly.
+
+    on_table : function (default=None)
+        If set, called as on_table(obj, output_file, query_output) as soon
+        as each object's table is saved (with only the new rows, for an
+        incremental update), so the table can be used right away without
+        reading it back from disk (see uvot_download.py).  With max_workers
+        > 1, it's called from the worker threads.
+
+    retry_policy : RetryPolicy object (default=None)
+        How to retry failed requests (see heasarc_http.RetryPolicy; only
+        used if client is None).  Objects that still can't be queried are
+        listed at the end, and the rest of the list carries on.
+
+    Returns
+    -------
+    failed : list of strings
+        Objects that couldn't be queried (e.g., because HEASARC was down),
+        which can be queried again later
+
     """
 
     #condition that handles either a list of entries from a file that needs to be loaded or a single object put into a list
     if list_opt is not False:
-        obj_list = np.loadtxt(input_obj, dtype = 'str').tolist()
+        with open(input_obj, 'r') as f:
+            obj_list = [line.strip() for line in f
+                            if line.strip() and not line.startswith('#')]
         #print('expect a list and do list things')
     else:
         if type(input_obj) == str:
@@ -52,95 +155,825 @@ def query_heasarc(input_obj, list_opt=False, search_radius=7.0,
             obj_list = input_obj
 
     # ensure defaults are in table_params
+    # (copy it so the default list doesn't grow between calls)
+    table_params = list(table_params)
     for col in ['obsid','start_time','uvot_expo_w2','uvot_expo_m2','uvot_expo_w1']:
         if col not in table_params:
             table_params.append(col)    
     
-    for obj in obj_list:
+    # one client (and rate limiter) shared by all of the workers
+    if client is None:
+        run_client = HTTPClient(limiter=RateLimiter(rate_limit), retry_policy=retry_policy)
+    else:
+        run_client = client
+
+    # local cache of query results
+    cache = QueryCache(ttl=cache_ttl) if use_cache else None
+
+    # local cache of name lookups
+    # (always needed for the local catalog, which only works with positions)
+    resolver_cache = ResolverCache() if (resolve_names or local_catalog) else None
+
+    # local copy of swiftmastr
+    catalog = None
+    if local_catalog is not False:
+        from swift_catalog import SwiftCatalog
+        catalog = SwiftCatalog.load(None if local_catalog is True else local_catalog)
+        batch_size = None
+
+    # the work is split up by object, or by chunk of objects in batch mode
+    if (batch_size is not None) and (batch_size > 1):
+        query_func = query_batch
+        work_list = [obj_list[i:i+batch_size] for i in range(0, len(obj_list), batch_size)]
+    else:
+        query_func = query_object
+        work_list = obj_list
 
-        # replace any spaces with underscores for saving things
-        obj_nospace = obj.replace(' ','_')
+    # objects that couldn't be queried
+    failed = []
 
-        #make new folders for each of the objects
-        if (create_folder == True) and (display_table == False):
-            if not os.path.exists(obj_nospace):
-                os.mkdir(obj_nospace)
+    def query_one(work):
+        # (one object's failure doesn't stop the rest of the list)
+        try:
+            return query_func(work, search_radius=search_radius,
+                                  create_folder=create_folder,
+                                  table_params=table_params,
+                                  display_table=display_table,
+                                  client=run_client, cache=cache, refresh=refresh,
+                                  resolver_cache=resolver_cache, catalog=catalog,
+                                  incremental=incremental, on_table=on_table)
+        except QueryFailed as e:
+            failed.extend(e.objects)
+            return e.messages
+        except NETWORK_ERRORS as e:
+            # (in batch mode, the work is a list of objects)
+            objects = work if isinstance(work, list) else [work]
+            failed.extend(objects)
+            return ['could not query '+', '.join(objects)+' ('+str(e)+')']
 
-        # file name to save the table
-        if create_folder:
-            output_file = obj_nospace + '/heasarc_obs.dat'
+    # query the objects, with up to max_workers requests in flight at once
+    # (messages are printed in the same order as obj_list)
+    if max_workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for messages in executor.map(query_one, work_list):
+                for line in messages:
+                    print(line)
+    else:
+        for work in work_list:
+            for line in query_one(work):
+                print(line)
+
+    if len(failed) > 0:
+        print('* could not query '+str(len(failed))+' objects (run again to retry them): '
+                  +', '.join(failed))
+
+    if client is None:
+        run_client.close()
+    if cache is not None:
+        cache.close()
+    if resolver_cache is not None:
+        resolver_cache.close()
+
+    return failed
+
+
+def query_positions(names, ra, dec, search_radius=7.0, create_folder=True,
+                        table_params=['obsid','start_time','uvot_expo_w2','uvot_expo_m2','uvot_expo_w1'],
+                        display_table=False, local_catalog=True, on_table=None):
+    """
+    Find observations around many positions at once in the local copy of
+    swiftmastr (see swift_catalog.py).  All of the positions are matched
+    against the catalog in one vectorized step, and the results are saved
+    the same way as query_heasarc.
+
+    Parameters
+    ----------
+    names : list of strings
+        Name of each target (used for the folder/file names)
+
+    ra, dec : arrays of floats
+        Position of each target (degrees)
+
+    search_radius : float or array of floats (default=7.0)
+        Search radius (arcmin), either for all targets or for each one
+
+    create_folder, table_params, display_table, on_table
+        See query_heasarc
+
+    local_catalog : boolean or string (default=True)
+        Catalog file to use (True for the default file)
+
+    """
+
+    import numpy as np
+    from swift_catalog import SwiftCatalog, add_offset
+    from heasarc_table import format_batch_table
+
+    table_params = list(table_params)
+    for col in ['obsid','start_time','uvot_expo_w2','uvot_expo_m2','uvot_expo_w1']:
+        if col not in table_params:
+            table_params.append(col)
+
+    catalog = SwiftCatalog.load(None if local_catalog is True else local_catalog)
+    target_index, row_index, offset = catalog.cross_match(ra, dec, search_radius)
+
+    columns = [col for col in table_params if col in catalog.data.dtype.names] + ['_offset']
+
+    # the matches are sorted by target, so each target's rows are one slice
+    bounds = np.searchsorted(target_index, np.arange(len(names)+1))
+
+    for t, obj in enumerate(names):
+        rows = slice(bounds[t], bounds[t+1])
+        matches = add_offset(catalog.data[row_index[rows]], offset[rows])
+        query_output = format_batch_table(matches, columns=columns)
+        output_file = output_filename(obj, create_folder=create_folder,
+                                          display_table=display_table)
+        rows_list = save_output(query_output, output_file, display_table)
+        for line in report_output(obj, rows_list, display_table):
+            print(line)
+        if on_table is not None:
+            on_table(obj, output_file, query_output)
+
+
+def read_target_list(filename):
+    """
+    Read a table of targets (any format astropy can read, like FITS or CSV)
+    with columns for the name, RA, and Dec (degrees), and optionally the
+    search radius (arcmin).  Column names are matched without regard to
+    case: name/object/target, ra, dec, and radius.
+
+    Returns
+    -------
+    names : list of strings
+
+    ra, dec : arrays of floats
+
+    radius : array of floats, or None if there isn't a radius column
+
+    """
+
+    import numpy as np
+    from astropy.table import Table
+
+    if filename.lower().endswith('.csv'):
+        target_table = Table.read(filename, format='ascii.csv')
+    else:
+        target_table = Table.read(filename)
+
+    colnames = {col.lower():col for col in target_table.colnames}
+
+    def find_col(options):
+        for option in options:
+            if option in colnames:
+                return target_table[colnames[option]]
+        return None
+
+    name_col = find_col(['name','object','target'])
+    ra = np.asarray(find_col(['ra','ra_deg','raj2000']), dtype=float)
+    dec = np.asarray(find_col(['dec','dec_deg','dej2000','decj2000']), dtype=float)
+    radius = find_col(['radius','search_radius'])
+
+    if name_col is None:
+        names = ['{:.5f}_{:+.5f}'.format(r, d) for r, d in zip(ra, dec)]
+    else:
+        names = [str(name).strip() for name in name_col]
+
+    return names, ra, dec, (None if radius is None else np.asarray(radius, dtype=float))
+
+
+def query_object(obj, search_radius=7.0, create_folder=True,
+                     table_params=['obsid','start_time','uvot_expo_w2','uvot_expo_m2','uvot_expo_w1'],
+                     display_table=False, client=None, cache=None, refresh=False,
+                     resolver_cache=None, catalog=None, incremental=False,
+                     on_table=None):
+    """
+    Query HEASARC for a single object, trying each name resolver in turn
+
+    Parameters
+    ----------
+    obj : string
+        Name of the object to search for
+
+    search_radius, create_folder, table_params, display_table
+        See query_heasarc
+
+    client : HTTPClient object (default=None)
+        Client to send the queries with (if None, a new one is created)
+
+    cache : QueryCache object (default=None)
+        If set, use results from the cache and save new ones to it
+
+    refresh : boolean (default=False)
+        If True, ignore results in the cache
+
+    resolver_cache : ResolverCache object (default=None)
+        If set, look up the object's coordinates (see
+        name_resolver.resolve_name) and query HEASARC with those instead of
+        the name
+
+    catalog : SwiftCatalog object (default=None)
+        If set, search this local catalog instead of querying HEASARC
+        (requires resolver_cache)
+
+    incremental : boolean (default=False)
+        If True and the object already has a table, only query HEASARC for
+        newer observations and add them to the table
+
+    on_table : function (default=None)
+        If set, called with (obj, output_file, query_output) once the table
+        is saved
+
+    Returns
+    -------
+    messages : list of strings
+        Lines to print for this object (returned rather than printed so
+        that concurrent queries don't interleave their output)
+
+    """
+
+    messages = []
+
+    output_file = output_filename(obj, create_folder=create_folder,
+                                      display_table=display_table)
+
+    if client is None:
+        client = HTTPClient()
+
+    # command to generate HEASARC query
+    #cmd = 'browse_extract_wget.pl table=swiftmastr position=' \
+    #              + obj + ' radius='+str(search_radius) \
+    #              +' fields=obsid,start_time outfile=data.dat'
+
+    NR_list = ['NED','SIMBAD']
+
+    # find the coordinates, so HEASARC doesn't have to resolve the name
+    query_entry = obj
+    if resolver_cache is not None:
+        query_entry, resolve_messages = resolve_name(obj, client, resolver_cache, refresh=refresh)
+        messages += resolve_messages
+        if query_entry is None:
+            return messages
+        # HEASARC doesn't use the name resolvers for coordinates
+        if query_entry != obj:
+            NR_list = ['NED']
+
+    # only ask for observations newer than the ones already in the table
+    # (falls through to a full query if that isn't possible)
+    if incremental and (catalog is None) and (display_table == False):
+        watermark = read_watermark(output_file)
+        if watermark is not None:
+            new_messages = query_new_observations(obj, query_entry, NR_list, output_file, watermark,
+                                                      search_radius, table_params, client,
+                                                      on_table=on_table)
+            if new_messages is not None:
+                return messages + new_messages
+
+    # search the local catalog
+    if catalog is not None:
+        from swift_catalog import catalog_query_output
+        ra, dec = entry_degrees(query_entry)
+        query_output = catalog_query_output(catalog, ra, dec, search_radius, table_params)
+        rows_list = save_output(query_output, output_file, display_table)
+        messages += report_output(obj, rows_list, display_table)
+        if on_table is not None:
+            on_table(obj, output_file, query_output)
+        return messages
+
+    for NR in NR_list:
+
+        # run the query (or get it from the cache)
+        query_output = None
+        if (cache is not None) and (refresh == False):
+            query_output = cache.get(query_entry, NR, search_radius, table_params)
+        if query_output is None:
+            query_output = run_query(client, build_query_url(query_entry, NR, search_radius, table_params))
+            # only successful queries are cached, so errors are retried
+            if (cache is not None) and not is_error_output(query_output):
+                cache.put(query_entry, NR, search_radius, table_params, query_output)
+
+        # save the query output and check to make sure it worked
+        rows_list = save_output(query_output, output_file, display_table)
+
+        # error -> try other name resolver
+        if is_error_output(query_output) and (NR != NR_list[-1]):
+            messages.append('could not resolve '+obj+' with '+NR+', trying next name resolver')
+            continue
+        # error, but already tried all name resolvers
+        elif is_error_output(query_output) and (NR == NR_list[-1]):
+            messages.append('could not resolve '+obj+' with '+NR)
+            messages.append('failed to resolve '+obj)
+            continue
+        # no error -> finish
         else:
-            output_file = obj_nospace+'_heasarc_obs.dat'
+            messages += report_output(obj, rows_list, display_table)
+            if incremental and (display_table == False):
+                write_watermark(output_file, make_watermark(query_output, NR))
+            if on_table is not None:
+                on_table(obj, output_file, query_output)
+            break
+
+    return messages
+
+
+def query_batch(obj_chunk, search_radius=7.0, create_folder=True,
+                    table_params=['obsid','start_time','uvot_expo_w2','uvot_expo_m2','uvot_expo_w1'],
+                    display_table=False, client=None, cache=None, refresh=False,
+                    resolver_cache=None, catalog=None, incremental=False,
+                    on_table=None):
+    """
+    Query HEASARC for several objects with a single request, and split the
+    results back into one table per object (saved the same way as
+    query_object does).
+
+    With a resolver_cache, each name is resolved first (once, see
+    name_resolver.resolve_name), and names that can't be resolved are left
+    out.  Objects sent as coordinates that don't show up in the combined results
+    have no observations, so their (empty) tables are saved straight away.
+    Objects sent by name that don't show up (no observations, or a name
+    that couldn't be resolved), and all of the objects if the combined
+    query fails, are queried one at a time with query_object, so they still
+    get the NED -> SIMBAD fallback and the usual messages.
 
-        # but if it's going to be displayed, the end of the command needs modifying
-        if display_table == False:
-            save_cmd = ' > ' + output_file
+    Parameters
+    ----------
+    obj_chunk : list of strings
+        Names of the objects to search for
+
+    search_radius, create_folder, table_params, display_table, client, cache,
+    refresh, resolver_cache, catalog, incremental, on_table
+        See query_object (catalog is ignored, since a local search doesn't
+        need batching, and objects that can be updated incrementally are
+        queried individually)
+
+    Returns
+    -------
+    messages : list of strings
+        Lines to print for these objects
+
+    """
+
+    messages = []
+
+    if client is None:
+        client = HTTPClient()
+
+    failed = []
+
+    # what to send HEASARC for each object: its coordinates, if names are
+    # being resolved (names that can't be are left out, as in query_object)
+    entries = {}
+    for obj in obj_chunk:
+        if resolver_cache is None:
+            entries[obj] = obj
+            continue
+        try:
+            entry, resolve_messages = resolve_name(obj, client, resolver_cache, refresh=refresh)
+        except NETWORK_ERRORS as e:
+            messages.append('could not query '+obj+' ('+str(e)+')')
+            failed.append(obj)
+            continue
+        messages += resolve_messages
+        if entry is not None:
+            entries[obj] = entry
+    obj_chunk = [obj for obj in obj_chunk if obj in entries]
+
+    # objects with cached results don't need to be in the combined query
+    batch_list = [obj for obj in obj_chunk
+                      if (cache is None) or refresh or (cache.get(entries[obj], 'NED', search_radius, table_params) is None)]
+
+    # so do objects that only need the observations since their last query
+    if incremental and (display_table == False):
+        batch_list = [obj for obj in batch_list
+                          if read_watermark(output_filename(obj, create_folder=create_folder)) is None]
+
+    split_output = {}
+    batch_worked = False
+    if len(batch_list) > 1:
+        from heasarc_table import table_row_lines
+        try:
+            query_output = run_query(client, build_query_url('; '.join([entries[obj] for obj in batch_list]),
+                                                                 'NED', search_radius, table_params))
+            split_output = split_batch_output(query_output, [entries[obj] for obj in batch_list])
+            # (either the rows were matched to the objects, or there weren't any)
+            batch_worked = (len(split_output) > 0) or \
+              (not is_error_output(query_output) and (len(table_row_lines(query_output)[1]) == 0))
+        except NETWORK_ERRORS as e:
+            messages.append('combined query failed ('+str(e)+'), querying the objects one at a time')
+
+    # HEASARC doesn't need to resolve coordinates, so an object sent as
+    # coordinates that's missing from the results has no observations
+    for obj in batch_list:
+        if batch_worked and (entries[obj] not in split_output) and looks_like_coordinates(entries[obj]):
+            split_output[entries[obj]] = NO_OBSERVATIONS_OUTPUT
+
+    for obj in obj_chunk:
+        if entries[obj] in split_output:
+            if cache is not None:
+                cache.put(entries[obj], 'NED', search_radius, table_params, split_output[entries[obj]])
+            output_file = output_filename(obj, create_folder=create_folder,
+                                              display_table=display_table)
+            rows_list = save_output(split_output[entries[obj]], output_file, display_table)
+            messages += report_output(obj, rows_list, display_table)
+            if incremental and (display_table == False):
+                write_watermark(output_file, make_watermark(split_output[entries[obj]], 'NED'))
+            if on_table is not None:
+                on_table(obj, output_file, split_output[entries[obj]])
         else:
-            save_cmd = ''
-
-        # command to generate HEASARC query
-        #cmd = 'browse_extract_wget.pl table=swiftmastr position=' \
-        #              + obj + ' radius='+str(search_radius) \
-        #              +' fields=obsid,start_time outfile=data.dat'
-
-        NR_list = ['NED','SIMBAD']
-            
-        for NR in NR_list:
-            cmd = 'wget -O - -o /dev/null --no-check-certificate ' + "'" \
-              'https://heasarc.gsfc.nasa.gov/db-perl/W3Browse/w3query.pl?' + \
-              'tablehead='+urllib.request.quote('name=BATCHRETRIEVALCATALOG_2.0 swiftmastr') + \
-              '&Action=Query' + \
-              '&Coordinates='+urllib.request.quote("'Equatorial: R.A. Dec'") + \
-              '&Equinox=2000' + \
-              '&Radius='+str(search_radius) + \
-              '&NR='+NR + \
-              '&GIFsize=0' + \
-              '&Fields=&varon='+'&varon='.join(table_params) + \
-              '&Entry='+urllib.request.quote(obj) + \
-              '&displaymode=BatchDisplay' + "'" + save_cmd
-
-            # run the command
-            wget_output = subprocess.run(cmd + save_cmd, stdout=subprocess.PIPE, shell=True)
-              
-            # read in the query output to make sure it worked
-            if display_table == False:
-                with open(output_file, 'r') as hf:
-                    rows_list = hf.readlines()
-            else:
-                rows_list = wget_output.stdout.decode('utf-8').split('\n')
-
-            # error -> try other name resolver
-            if ('ERROR' in rows_list[0].upper()) and (NR != NR_list[-1]):
-                print('could not resolve '+obj+' with '+NR+', trying next name resolver')
-                continue
-            # error, but already tried all name resolvers
-            elif ('ERROR' in rows_list[0].upper()) and (NR == NR_list[-1]):
-                print('could not resolve '+obj+' with '+NR)
-                print('failed to resolve '+obj)
-                continue
-            # no error -> finish
-            else:
-                if len(rows_list) == 3:
-                    print('No observations of '+obj+' found in HEASARC (check Quick Look page for any recent observations)')
-                if (display_table == True) and (len(rows_list) > 3):
-                    print('\n'+obj+'\n')
-                    for row in rows_list[1:-2]:
-                        print(row)
-                    print('')
-                break
+            try:
+                messages += query_object(obj, search_radius=search_radius,
+                                             create_folder=create_folder,
+                                             table_params=table_params,
+                                             display_table=display_table,
+                                             client=client, cache=cache, refresh=refresh,
+                                             resolver_cache=resolver_cache,
+                                             incremental=incremental, on_table=on_table)
+            except NETWORK_ERRORS as e:
+                messages.append('could not query '+obj+' ('+str(e)+')')
+                failed.append(obj)
+
+    if len(failed) > 0:
+        raise QueryFailed(failed, messages)
+
+    return messages
+
+
+def split_batch_output(query_output, obj_list):
+    """
+    Split the output of a query for several positions into the output for
+    each position.  HEASARC marks which position each row belongs to in the
+    offset column (e.g., '0.4555 (DDO68)'); in the split tables, that column
+    only has the offset, like a query for a single object.
+
+    Parameters
+    ----------
+    query_output : string
+        Text returned by HEASARC
+
+    obj_list : list of strings
+        Objects that were queried
+
+    Returns
+    -------
+    split_output : dict
+        Query output for each entry in obj_list that has at least one row.  Empty if
+        the query failed or the rows can't be matched to objects.
+
+    """
+
+    lines = query_output.split('\n')
+    if (len(lines) == 0) or ('ERROR' in lines[0].upper()):
+        return {}
+
+    # find the table header and the position line under it
+    header_index = None
+    for l, line in enumerate(lines[:-1]):
+        if line.startswith('|') and lines[l+1].startswith('+'):
+            header_index = l
+            break
+    if header_index is None:
+        return {}
+
+    header = lines[header_index]
+    col_names = [name.strip() for name in header.split('|')[1:-1]]
+    offset_col = None
+    for c, name in enumerate(col_names):
+        if name.lower().lstrip('_') in ['search_offset','offset']:
+            offset_col = c
+    if offset_col is None:
+        return {}
+
+    # match names as HEASARC writes them back to the requested names
+    name_key = lambda name: name.replace(' ','').lower()
+    obj_lookup = {name_key(obj):obj for obj in obj_list}
+
+    # sort the rows by object
+    obj_rows = {}
+    data_end = header_index + 2
+    for line in lines[header_index+2:]:
+        if not line.startswith('|'):
+            break
+        data_end += 1
+        cells = line.split('|')
+        offset_cell = cells[offset_col+1]
+        if '(' not in offset_cell:
+            return {}
+        offset, name = offset_cell.split('(', 1)
+        obj = obj_lookup.get(name_key(name.rsplit(')', 1)[0]))
+        if obj is None:
+            return {}
+        cells[offset_col+1] = offset.strip().rjust(len(offset_cell))
+        obj_rows.setdefault(obj, []).append('|'.join(cells))
+
+    header_cells = header.split('|')
+    header_cells[offset_col+1] = '_offset'.ljust(len(header_cells[offset_col+1]))
+    new_header = '|'.join(header_cells)
+
+    split_output = {}
+    for obj in obj_rows:
+        split_output[obj] = '\n'.join(lines[:header_index] + [new_header, lines[header_index+1]]
+                                          + obj_rows[obj] + lines[data_end:])
+
+    return split_output
+
+
+def run_query(client, url):
+    """
+    Send a query to HEASARC and return its output (as text).  Besides the
+    retries for connection errors and 5xx/429 responses, an empty page
+    (which HEASARC sometimes sends when it's busy) is retried
+    according to the client's retry policy (see heasarc_http.RetryPolicy).
+    Raises an IOError if the query still doesn't work.
+    """
+
+    def attempt():
+        response = client.get(url)
+        response.raise_for_status()
+        query_output = response.text()
+        if query_output.strip() == '':
+            raise ResponseError('empty response from HEASARC')
+        return query_output
+
+    return client.retry(attempt)
+
+
+def is_error_output(query_output):
+    """
+    True if a query's output is an error message (e.g., because the name
+    resolver didn't know the object) rather than a table
+    """
+    return 'ERROR' in query_output.split('\n')[0].upper()
+
+
+def build_query_url(entry, NR, search_radius, table_params, since=None):
+    """
+    Path of the HEASARC query for an entry (object name(s) or coordinates),
+    optionally only for observations that started at or after `since` (a
+    string like '2018-01-23T16:47:57')
+    """
+    query_url = '/db-perl/W3Browse/w3query.pl?' + \
+      'tablehead='+urllib.parse.quote('name=BATCHRETRIEVALCATALOG_2.0 swiftmastr') + \
+      '&Action=Query' + \
+      '&Coordinates='+urllib.parse.quote("'Equatorial: R.A. Dec'") + \
+      '&Equinox=2000' + \
+      '&Radius='+str(search_radius) + \
+      '&NR='+NR + \
+      '&GIFsize=0' + \
+      '&Fields=&varon='+'&varon='.join(table_params) + \
+      '&Entry='+urllib.parse.quote(entry) + \
+      '&displaymode=BatchDisplay'
+    if since is not None:
+        query_url += '&bparam_start_time='+urllib.parse.quote('>='+since)
+    return query_url
+
+
+def query_new_observations(obj, query_entry, NR_list, output_file, watermark,
+                               search_radius, table_params, client, on_table=None):
+    """
+    Query HEASARC for the observations of an object since its watermark (the
+    latest start_time in its table), and add the new ones to the end of the
+    table.
+
+    The query goes back WATERMARK_LOOKBACK_DAYS before the latest start_time, and
+    skips the obsids that are already in the table, so observations that
+    show up in HEASARC a little after they were taken aren't missed.
+
+    Parameters
+    ----------
+    obj : string
+        Name of the object
+
+    query_entry : string
+        What to send HEASARC (the name or coordinates)
+
+    NR_list : list of strings
+        Name resolvers to try
+
+    output_file : string
+        The object's table
+
+    watermark : dict
+        From read_watermark
+
+    search_radius, table_params, client, on_table
+        See query_object (on_table gets a table with only the new rows)
+
+    Returns
+    -------
+    messages : list of strings or None
+        Lines to print for this object, or None if the table can't be
+        updated in place (e.g., it has different columns than the new query)
+        and needs a full query instead
+
+    """
+
+    import numpy as np
+    from heasarc_table import table_row_lines, append_batch_rows, read_batch_table
+
+    messages = []
+
+    # the obsids in the table itself, in case the watermark is out of date
+    table = read_batch_table(output_file)
+    if (len(table) == 0) or ('obsid' not in table.dtype.names):
+        return None
+    table_obsids = set(table['obsid'].tolist())
+
+    lookback = np.timedelta64(WATERMARK_LOOKBACK_DAYS, 'D')
+    since = np.datetime64(watermark['start_time'], 's') - lookback
+
+    # the resolver that worked last time goes first
+    if watermark.get('resolver') in NR_list:
+        NR_list = [watermark['resolver']] + [NR for NR in NR_list if NR != watermark['resolver']]
+
+    for NR in NR_list:
+        query_output = run_query(client, build_query_url(query_entry, NR, search_radius, table_params,
+                                                             since=str(since)))
+        if not is_error_output(query_output):
+            break
+        messages.append('could not resolve '+obj+' with '+NR)
+    else:
+        messages.append('failed to resolve '+obj)
+        return messages
+
+    header, row_lines = table_row_lines(query_output)
+    if (header is not None) and (header != watermark['header']):
+        return None
+
+    # rows that aren't in the table yet
+    known = set(watermark['obsids']) | table_obsids
+    new_rows = [line for line in row_lines
+                    if line.split('|')[1].strip() not in known]
+
+    if len(new_rows) == 0:
+        messages.append('No new observations of '+obj+' since '+watermark['start_time'])
+        return messages
+
+    append_batch_rows(output_file, new_rows)
+    messages.append('Added '+str(len(new_rows))+' new observations of '+obj+' to '+output_file)
+    if on_table is not None:
+        separator = '+' + '+'.join(['-'*len(cell) for cell in header.split('|')[1:-1]]) + '+'
+        on_table(obj, output_file, '\n'.join(['', header, separator] + new_rows + ['Bye', '']))
+
+    # move the watermark up (the start times are all formatted the same, so
+    # they can be compared as strings)
+    new_watermark = make_watermark('\n'.join([header] + new_rows), NR)
+    if new_watermark is None:
+        new_watermark = dict(watermark, resolver=NR)
+    else:
+        new_watermark['start_time'] = max(watermark['start_time'], new_watermark['start_time'])
+        oldest = str(np.datetime64(new_watermark['start_time'], 's') - lookback)
+        obsids = dict(watermark['obsids'])
+        obsids.update(new_watermark['obsids'])
+        new_watermark['obsids'] = {obsid:start for obsid, start in obsids.items() if start >= oldest}
+    write_watermark(output_file, new_watermark)
+
+    return messages
+
+
+def watermark_filename(output_file):
+    """
+    File with the watermark for a table (e.g., heasarc_obs_watermark.json
+    next to heasarc_obs.dat)
+    """
+    return os.path.splitext(output_file)[0] + '_watermark.json'
+
+
+def make_watermark(query_output, resolver=None):
+    """
+    Watermark for a table: the latest start_time, the obsids (and start
+    times) of the rows within WATERMARK_LOOKBACK_DAYS of it, the table
+    header (to check that new rows fit), and the name resolver that worked.
+    None if the table doesn't have any observations.
+    """
+    import numpy as np
+    from heasarc_table import parse_batch_table, table_row_lines
+
+    data = parse_batch_table(query_output)
+    header, row_lines = table_row_lines(query_output)
+    if (len(data) == 0) or ('start_time' not in data.dtype.names) or ('obsid' not in data.dtype.names):
+        return None
+    start_time = data['start_time']
+    if np.all(np.isnat(start_time)):
+        return None
+    latest = start_time[~np.isnat(start_time)].max()
+    recent = ~np.isnat(start_time) & (start_time >= latest - np.timedelta64(WATERMARK_LOOKBACK_DAYS, 'D'))
+    return {'start_time':str(latest),
+                'obsids':{str(obsid):str(start) for obsid, start in zip(data['obsid'][recent], start_time[recent])},
+                'header':header,
+                'resolver':resolver}
+
+
+def read_watermark(output_file):
+    """
+    Watermark for a table, from its watermark file, or (the first time) from
+    the table itself.  None if there isn't a table with observations.
+    """
+    # (a watermark left behind by a table that's been deleted doesn't count)
+    if not os.path.isfile(output_file):
+        return None
+    wm_file = watermark_filename(output_file)
+    if os.path.isfile(wm_file):
+        with open(wm_file) as f:
+            return json.load(f)
+    with open(output_file) as f:
+        return make_watermark(f.read())
+
+
+def write_watermark(output_file, watermark):
+    """
+    Save the watermark for a table (or remove it if it's None)
+    """
+    wm_file = watermark_filename(output_file)
+    if watermark is None:
+        if os.path.isfile(wm_file):
+            os.remove(wm_file)
+        return
+    with open(wm_file+'.tmp', 'w') as f:
+        json.dump(watermark, f)
+    os.replace(wm_file+'.tmp', wm_file)
+
+
+def output_filename(obj, create_folder=True, display_table=False):
+    """
+    Name of the file to save an object's table into (creating the folder for
+    the object if needed)
+    """
+
+    # replace any spaces with underscores for saving things
+    obj_nospace = obj.replace(' ','_')
+
+    #make new folders for each of the objects
+    if (create_folder == True) and (display_table == False):
+        if not os.path.exists(obj_nospace):
+            os.mkdir(obj_nospace)
+
+    # file name to save the table
+    if create_folder:
+        output_file = obj_nospace + '/heasarc_obs.dat'
+    else:
+        output_file = obj_nospace+'_heasarc_obs.dat'
+
+    return output_file
+
+
+def save_output(query_output, output_file, display_table=False):
+    """
+    Save the query output to a file (unless it's going to be displayed), and
+    return it split into rows.  Any watermark for the old table is removed,
+    since it no longer matches (incremental queries write a new one).
+    """
+    if display_table == False:
+        with open(output_file, 'w') as hf:
+            hf.write(query_output)
+        write_watermark(output_file, None)
+        return query_output.splitlines(True)
+    else:
+        return query_output.split('\n')
+
+
+def report_output(obj, rows_list, display_table=False):
+    """
+    Messages for a successful query: a note if there aren't any observations,
+    and the table itself if it's being displayed
+    """
+    messages = []
+    if len(rows_list) == 3:
+        messages.append('No observations of '+obj+' found in HEASARC (check Quick Look page for any recent observations)')
+    if (display_table == True) and (len(rows_list) > 3):
+        messages.append('\n'+obj+'\n')
+        for row in rows_list[1:-2]:
+            messages.append(row)
+        messages.append('')
+    return messages
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('input_obj', nargs="?", help="Accepts either the object name as a string or a text file with a list of object names", default='')
     parser.add_argument('-l','--list', help="query_heasarc will expect the name of a text file that contains a list of objects.", action='store_true', default=False)
+    parser.add_argument('-w','--max_workers', help="Number of objects to query at the same time", type=int, default=1)
+    parser.add_argument('--rate_limit', help="Maximum number of requests per second sent to HEASARC", type=float, default=None)
+    parser.add_argument('--refresh', help="Ignore cached query results and query HEASARC again", action='store_true', default=False)
+    parser.add_argument('-b','--batch_size', help="Number of objects to include in each request to HEASARC", type=int, default=None)
+    parser.add_argument('--local', help="Search the local copy of swiftmastr (see swift_catalog.py) instead of HEASARC", action='store_true', default=False)
+    parser.add_argument('-t','--targets', help="Treat input_obj as a table (e.g., FITS or CSV) of target names and positions, and match them all at once against the local copy of swiftmastr", action='store_true', default=False)
+    parser.add_argument('-r','--radius', help="Search radius (arcmin)", type=float, default=7.0)
+    parser.add_argument('--incremental', help="Only query for observations newer than the ones already in each object's table, and add them to it", action='store_true', default=False)
     args = parser.parse_args()
 
     if not args.input_obj:
         print('Please specify an object or list of objects you would like to search for.') 
         sys.exit()
 
-    query_heasarc(args.input_obj, list_opt=args.list)
+    if args.targets:
+        names, ra, dec, radius = read_target_list(args.input_obj)
+        query_positions(names, ra, dec, search_radius=(args.radius if radius is None else radius))
+        return
+
+    query_heasarc(args.input_obj, list_opt=args.list, search_radius=args.radius,
+                      max_workers=args.max_workers, rate_limit=args.rate_limit,
+                      refresh=args.refresh, batch_size=args.batch_size,
+                      local_catalog=args.local, incremental=args.incremental)
 
 if __name__ =="__main__":
     main()
@@ -0,0 +1,388 @@
+import os
+import argparse
+import urllib.parse
+import numpy as np
+
+from heasarc_http import HTTPClient
+from heasarc_cache import cache_dir
+from heasarc_table import parse_batch_table, format_batch_table, column_dtype
+from query_heasarc import run_query, is_error_output, WATERMARK_LOOKBACK_DAYS
+
+# columns of swiftmastr that are kept in the local catalog
+CATALOG_FIELDS = ['obsid','ra','dec','start_time'] + \
+  ['uvot_expo_'+filt for filt in ['w2','m2','w1','uu','bb','vv','wh','gu','gv']]
+
+
+def default_catalog_file():
+    """
+    Default location of the local catalog (swiftmastr.npz in cache_dir())
+    """
+    return os.path.join(cache_dir(), 'swiftmastr.npz')
+
+
+class SwiftCatalog(object):
+    """
+    Local copy of the Swift master table (swiftmastr) for cone searches
+    without contacting HEASARC.
+
+    The rows are kept sorted by declination, which works as the spatial
+    index: a cone search only looks at the strip of rows within the search
+    radius in declination (found by binary search), and computes exact
+    separations for those from precomputed unit vectors.
+
+    Parameters
+    ----------
+    data : numpy structured array
+        Catalog rows, with at least obsid, ra, dec, and start_time
+
+    """
+
+    def __init__(self, data):
+        order = np.argsort(data['dec'], kind='stable')
+        self.data = data[order]
+        self._dec = self.data['dec']
+        self._xyz = unit_vectors(self.data['ra'], self.data['dec'])
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def latest_start(self):
+        """
+        Start time of the most recent observation in the catalog (None if
+        there aren't any with a start time)
+        """
+        start_time = self.data['start_time'][~np.isnat(self.data['start_time'])]
+        if len(start_time) == 0:
+            return None
+        return start_time.max()
+
+    @classmethod
+    def load(cls, filename=None):
+        """
+        Load a catalog saved with `save`
+        """
+        if filename is None:
+            filename = default_catalog_file()
+        with np.load(filename) as contents:
+            return cls(contents['data'])
+
+    def save(self, filename=None):
+        """
+        Save the catalog to a compressed .npz file
+        """
+        if filename is None:
+            filename = default_catalog_file()
+        tmp_file = filename + '.tmp.npz'
+        np.savez_compressed(tmp_file, data=self.data)
+        os.replace(tmp_file, filename)
+
+    def merge(self, new_data):
+        """
+        Return a catalog with new rows added (rows with an obsid that's
+        already in the catalog replace the old ones)
+        """
+        new_data = new_data[[name for name in self.data.dtype.names]].astype(self.data.dtype)
+        keep = ~np.isin(self.data['obsid'], new_data['obsid'])
+        return SwiftCatalog(np.concatenate([self.data[keep], new_data]))
+
+    def cone_search(self, ra, dec, radius):
+        """
+        Find the observations within a radius of a position
+
+        Parameters
+        ----------
+        ra, dec : float
+            Position (degrees)
+
+        radius : float
+            Search radius (arcmin)
+
+        Returns
+        -------
+        matches : numpy structured array
+            Catalog rows within the radius, plus an '_offset' column
+            (arcmin), sorted by offset
+
+        """
+
+        radius_deg = radius / 60.0
+
+        # strip of rows that could be close enough
+        start = np.searchsorted(self._dec, dec - radius_deg, side='left')
+        end = np.searchsorted(self._dec, dec + radius_deg, side='right')
+
+        # exact separations within the strip
+        target = unit_vectors(np.array([ra]), np.array([dec]))[0]
+        cos_sep = np.clip(self._xyz[start:end].dot(target), -1, 1)
+        offset = np.degrees(np.arccos(cos_sep)) * 60.0
+
+        close = np.where(offset <= radius)[0]
+        order = close[np.argsort(offset[close], kind='stable')]
+
+        return add_offset(self.data[start:end][order], offset[order])
+
+    def cross_match(self, ra, dec, radius, max_pairs=2000000):
+        """
+        Cone searches around many positions at once.
+
+        Rather than a declination strip for each position, this bins the
+        unit vectors of the catalog into a 3D grid with cells as big as the
+        largest search radius, so each position only needs to be compared
+        with the rows in the 27 cells around it.
+
+        Parameters
+        ----------
+        ra, dec : array of floats
+            Positions (degrees)
+
+        radius : float or array of floats
+            Search radius (arcmin) for all positions, or for each one
+
+        max_pairs : int (default=2000000)
+            Maximum number of (position, row) pairs to compare at once, to
+            keep the memory use bounded
+
+        Returns
+        -------
+        target_index : array of ints
+            Index of the position for each match
+
+        row_index : array of ints
+            Index into self.data for each match
+
+        offset : array of floats
+            Separation (arcmin) for each match
+
+        The matches are sorted by position, and then by offset.
+
+        """
+
+        ra = np.atleast_1d(np.asarray(ra, dtype=float))
+        dec = np.atleast_1d(np.asarray(dec, dtype=float))
+        radius = np.broadcast_to(np.asarray(radius, dtype=float), ra.shape)
+
+        if (len(ra) == 0) or (len(self.data) == 0):
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0)
+
+        # grid cells are the chord length of the largest radius
+        cell_size = max(2*np.sin(np.radians(radius.max()/60.0)/2), 1e-7)
+        n_cells = int(np.ceil(2/cell_size)) + 3
+
+        def cell_keys(cells):
+            cells = cells + 1
+            return (cells[...,0]*n_cells + cells[...,1])*n_cells + cells[...,2]
+
+        # sort the catalog by cell
+        cat_keys = cell_keys(np.floor((self._xyz + 1) / cell_size).astype(np.int64))
+        cat_order = np.argsort(cat_keys, kind='stable')
+        cat_keys = cat_keys[cat_order]
+
+        # rows in the 27 cells around each position
+        target_xyz = unit_vectors(ra, dec)
+        target_cells = np.floor((target_xyz + 1) / cell_size).astype(np.int64)
+        neighbors = np.array([[i,j,k] for i in [-1,0,1] for j in [-1,0,1] for k in [-1,0,1]])
+        neighbor_keys = cell_keys(target_cells[:,np.newaxis,:] + neighbors[np.newaxis,:,:]).ravel()
+        start = np.searchsorted(cat_keys, neighbor_keys, side='left')
+        end = np.searchsorted(cat_keys, neighbor_keys, side='right')
+        cell_target = np.repeat(np.arange(len(ra)), len(neighbors))
+        n_pairs = end - start
+
+        target_list = []
+        row_list = []
+        offset_list = []
+
+        # groups of cells with up to max_pairs pairs between them
+        cum_pairs = np.cumsum(n_pairs)
+        first = 0
+        while first < len(n_pairs):
+            last = max(first+1, np.searchsorted(cum_pairs, cum_pairs[first] - n_pairs[first] + max_pairs, side='right'))
+            counts = n_pairs[first:last]
+
+            # every (position, row) pair in this group
+            pair_target = np.repeat(cell_target[first:last], counts)
+            pair_start = np.repeat(np.cumsum(counts) - counts, counts)
+            pair_row = cat_order[np.repeat(start[first:last], counts) + np.arange(counts.sum()) - pair_start]
+
+            cos_sep = np.clip(np.einsum('ij,ij->i', self._xyz[pair_row], target_xyz[pair_target]), -1, 1)
+            offset = np.degrees(np.arccos(cos_sep)) * 60.0
+
+            close = offset <= radius[pair_target]
+            target_list.append(pair_target[close])
+            row_list.append(pair_row[close])
+            offset_list.append(offset[close])
+
+            first = last
+
+        target_index = np.concatenate(target_list)
+        row_index = np.concatenate(row_list)
+        offset = np.concatenate(offset_list)
+
+        order = np.lexsort((offset, target_index))
+        return target_index[order], row_index[order], offset[order]
+
+
+def unit_vectors(ra, dec):
+    """
+    Cartesian unit vectors for positions (degrees), shape (N,3)
+    """
+    ra_rad = np.radians(ra)
+    dec_rad = np.radians(dec)
+    return np.column_stack([np.cos(dec_rad)*np.cos(ra_rad),
+                                np.cos(dec_rad)*np.sin(ra_rad),
+                                np.sin(dec_rad)])
+
+
+def add_offset(rows, offset):
+    """
+    Copy of rows with an '_offset' column (arcmin) added at the end
+    """
+    dtype = rows.dtype.descr + [('_offset','f4')]
+    out = np.zeros(len(rows), dtype=dtype)
+    for name in rows.dtype.names:
+        out[name] = rows[name]
+    out['_offset'] = offset
+    return out
+
+
+def fetch_swiftmastr(client, since=None):
+    """
+    Download the catalog columns of swiftmastr from HEASARC
+
+    Parameters
+    ----------
+    client : HTTPClient object
+        Client to send the query with
+
+    since : numpy datetime64 (default=None)
+        If set, only get observations that started at or after this time
+
+    Returns
+    -------
+    data : numpy structured array
+        The rows from HEASARC
+
+    """
+
+    query_url = '/db-perl/W3Browse/w3query.pl?' + \
+      'tablehead='+urllib.parse.quote('name=BATCHRETRIEVALCATALOG_2.0 swiftmastr') + \
+      '&Action=Query' + \
+      '&ResultMax=0' + \
+      '&GIFsize=0' + \
+      '&Fields=&varon='+'&varon='.join(CATALOG_FIELDS) + \
+      '&displaymode=BatchDisplay'
+    if since is not None:
+        query_url += '&bparam_start_time='+urllib.parse.quote('>='+str(since.astype('datetime64[s]')))
+
+    # (an empty page would look like there aren't any observations, so
+    # it's retried)
+    text = run_query(client, query_url)
+    if is_error_output(text):
+        raise IOError('HEASARC could not return swiftmastr: '+text.split('\n')[0])
+
+    data = parse_batch_table(text)
+    if len(data.dtype.names or []) == 0:
+        return np.zeros(0, dtype=[(name, column_dtype(name)) for name in CATALOG_FIELDS])
+    return data
+
+
+def snapshot_catalog(filename=None, full=False, client=None, verbose=True):
+    """
+    Make or update the local copy of swiftmastr.  If a snapshot already
+    exists, only observations that started since the latest one in the
+    snapshot are downloaded and added.  The query goes back
+    WATERMARK_LOOKBACK_DAYS before that (the observations that are already
+    in the snapshot are replaced), so observations that show up in HEASARC
+    a while after they were taken aren't missed.
+
+    Parameters
+    ----------
+    filename : string (default=None)
+        File for the catalog (if None, swiftmastr.npz in the cache folder)
+
+    full : boolean (default=False)
+        If True, download the whole table even if there's a snapshot
+
+    client : HTTPClient object (default=None)
+        Client to send the query with (if None, a new one is created)
+
+    verbose : boolean (default=True)
+        If True, print what's happening
+
+    Returns
+    -------
+    catalog : SwiftCatalog object
+        The updated catalog
+
+    """
+
+    if filename is None:
+        filename = default_catalog_file()
+    if client is None:
+        client = HTTPClient()
+
+    if os.path.isfile(filename) and not full:
+        catalog = SwiftCatalog.load(filename)
+        since = catalog.latest_start
+        if since is not None:
+            since = since - np.timedelta64(WATERMARK_LOOKBACK_DAYS, 'D')
+        if verbose:
+            print('* getting '+('all of swiftmastr' if since is None else 'observations since '+str(since))
+                      +' from HEASARC')
+        new_data = fetch_swiftmastr(client, since=since)
+        n_before = len(catalog)
+        catalog = catalog.merge(new_data)
+        if verbose:
+            print('* added '+str(len(catalog) - n_before)+' new observations')
+    else:
+        if verbose:
+            print('* getting all of swiftmastr from HEASARC')
+        catalog = SwiftCatalog(fetch_swiftmastr(client))
+
+    catalog.save(filename)
+    if verbose:
+        print('* saved '+str(len(catalog))+' observations to '+filename)
+
+    return catalog
+
+
+def catalog_query_output(catalog, ra, dec, search_radius, table_params):
+    """
+    Do a cone search in the local catalog, and format the results like a
+    HEASARC query
+
+    Parameters
+    ----------
+    catalog : SwiftCatalog object
+        The local catalog
+
+    ra, dec : float
+        Position (degrees)
+
+    search_radius : float
+        Search radius (arcmin)
+
+    table_params : list of strings
+        Columns to include (columns that aren't in the catalog are left out)
+
+    Returns
+    -------
+    text : string
+        Table in HEASARC's batch display format
+
+    """
+    matches = catalog.cone_search(ra, dec, search_radius)
+    columns = [col for col in table_params if col in matches.dtype.names] + ['_offset']
+    return format_batch_table(matches, columns=columns)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f','--file', help="File for the local catalog (default is swiftmastr.npz in the cache folder)", default=None)
+    parser.add_argument('--full', help="Download the whole table instead of only observations newer than the current snapshot", action='store_true', default=False)
+    args = parser.parse_args()
+
+    snapshot_catalog(filename=args.file, full=args.full)
+
+if __name__ =="__main__":
+    main()
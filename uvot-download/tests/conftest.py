@@ -0,0 +1,205 @@
+import os
+import sys
+import gzip
+import hashlib
+import email.utils
+import http.server
+import socketserver
+import threading
+import urllib.parse
+
+import pytest
+
+# the modules import each other by name (they're run as scripts), so their
+# folder needs to be on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive_listing import SWIFT_OBS_PATH
+
+# date the archive's files were last changed (unless a test changes it)
+LAST_MODIFIED = 'Tue, 23 Jan 2018 16:47:57 GMT'
+
+
+class LocalServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    Stand-in for HEASARC.  Each request is passed to `respond(handler)`,
+    which returns (status, headers, body), or None if it wrote the response
+    itself.  Every request is logged as (method, path, headers, client port)
+    in `log`, so tests can see which connection it came in on.
+    """
+    daemon_threads = True
+
+    def __init__(self, respond, idle_timeout=None):
+        http.server.HTTPServer.__init__(self, ('127.0.0.1', 0), LocalHandler)
+        self.respond = respond
+        self.idle_timeout = idle_timeout
+        self.log = []
+        self.url = 'http://127.0.0.1:' + str(self.server_address[1])
+
+
+class LocalHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        # (how long a kept-alive connection can sit idle before the server
+        # closes it)
+        self.timeout = self.server.idle_timeout
+        http.server.BaseHTTPRequestHandler.setup(self)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.reply(send_body=True)
+
+    def do_HEAD(self):
+        self.reply(send_body=False)
+
+    def reply(self, send_body=True):
+        self.server.log.append((self.command, self.path, dict(self.headers), self.client_address[1]))
+        response = self.server.respond(self)
+        if response is None:
+            return
+        status, headers, body = response
+        self.send_response(status)
+        if 'Content-Length' not in headers:
+            self.send_header('Content-Length', str(len(body)))
+        for name in headers:
+            self.send_header(name, headers[name])
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+
+@pytest.fixture
+def serve():
+    """
+    Start a LocalServer with a respond function (and optionally an
+    idle_timeout), which is shut down after the test
+    """
+    servers = []
+
+    def start(respond, idle_timeout=None):
+        server = LocalServer(respond, idle_timeout=idle_timeout)
+        threading.Thread(target=server.serve_forever, kwargs={'poll_interval':0.05}, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+class FakeArchive(object):
+    """
+    Stand-in for the HEASARC archive tree.  Files (path -> bytes) are served
+    with ETags and Last-Modified dates, and directories with Apache-style
+    listings, and both answer conditional and Range requests the way
+    HEASARC does.  If cut_off[path] is set, the next full download of that
+    file stops after that many bytes.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.last_modified = {}
+        self.cut_off = {}
+        self.server = None
+
+    @property
+    def url(self):
+        return self.server.url
+
+    @property
+    def log(self):
+        return self.server.log
+
+    def add_file(self, path, data, last_modified=LAST_MODIFIED):
+        self.files[path] = data
+        self.last_modified[path] = last_modified
+
+    def add_obs(self, start_month, obsid, names, size=1000):
+        """
+        Add an observation with files at the given paths (within the
+        observation, e.g. 'uvot/image/sw00084312006uw2_sk.img.gz').  .gz files
+        hold gzipped data.  Returns the data of each file, unzipped.
+        """
+        contents = {}
+        for name in names:
+            data = ((obsid + name).encode() * size)[:size]
+            contents[name] = data
+            if name.endswith('.gz'):
+                data = gzip.compress(data, mtime=0)
+            self.add_file(self.obs_path(start_month, obsid, name), data)
+        return contents
+
+    def obs_path(self, start_month, obsid, name=''):
+        return SWIFT_OBS_PATH + start_month + '/' + obsid + '/' + name
+
+    def requests(self, method=None):
+        return [path for m, path, headers, port in self.log if (method is None) or (m == method)]
+
+    def respond(self, handler):
+        path = urllib.parse.unquote(urllib.parse.urlsplit(handler.path).path)
+        if path.endswith('/'):
+            return self.listing(handler, path)
+        if path not in self.files:
+            return 404, {}, b''
+
+        data = self.files[path]
+        etag = '"' + hashlib.md5(data).hexdigest()[:16] + '"'
+        last_modified = self.last_modified[path]
+        headers = {'ETag':etag, 'Last-Modified':last_modified}
+
+        since = handler.headers.get('If-Modified-Since')
+        if (since is not None) and (email.utils.parsedate_to_datetime(since)
+                                        >= email.utils.parsedate_to_datetime(last_modified)):
+            return 304, headers, b''
+
+        byte_range = handler.headers.get('Range')
+        if (byte_range is not None) and (handler.headers.get('If-Range') in [etag, last_modified]):
+            start = int(byte_range[len('bytes='):-1])
+            if start >= len(data):
+                return 416, {'Content-Range':'bytes */'+str(len(data))}, b''
+            headers['Content-Range'] = 'bytes '+str(start)+'-'+str(len(data)-1)+'/'+str(len(data))
+            return 206, headers, data[start:]
+
+        if (path in self.cut_off) and (handler.command == 'GET'):
+            handler.send_response(200)
+            handler.send_header('Content-Length', str(len(data)))
+            for name in headers:
+                handler.send_header(name, headers[name])
+            handler.end_headers()
+            handler.wfile.write(data[:self.cut_off.pop(path)])
+            handler.close_connection = True
+            return None
+
+        return 200, headers, data
+
+    def listing(self, handler, path):
+        entries = set()
+        for name in self.files:
+            if name.startswith(path):
+                rest = name[len(path):]
+                entries.add(rest.split('/')[0] + ('/' if '/' in rest else ''))
+        if len(entries) == 0:
+            return 404, {}, b''
+        html = '<html><body>\n<a href="?C=N;O=D">Name</a> <a href="/">Parent Directory</a>\n' + \
+          ''.join(['<a href="'+urllib.parse.quote(entry)+'">'+entry+'</a>\n' for entry in sorted(entries)]) + \
+          '</body></html>\n'
+        etag = '"' + hashlib.md5(html.encode()).hexdigest()[:16] + '"'
+        if handler.headers.get('If-None-Match') == etag:
+            return 304, {'ETag':etag}, b''
+        return 200, {'ETag':etag, 'Content-Type':'text/html'}, html.encode()
+
+
+@pytest.fixture
+def archive(serve):
+    """
+    A FakeArchive served by a LocalServer
+    """
+    fake = FakeArchive()
+    fake.server = serve(fake.respond)
+    return fake
@@ -0,0 +1,72 @@
+from heasarc_http import HTTPClient
+from heasarc_cache import ListingCache
+from archive_listing import parse_listing, list_directory, crawl
+
+LISTING = '''<html><body>
+<a href="?C=N;O=D">Name</a> <a href="/swift/data/obs/">Parent Directory</a>
+<a href="sw00032026001sat.fits.gz">sw00032026001sat.fits.gz</a>
+<a href="hk/">hk/</a> <a href="index.html">index.html</a>
+</body></html>'''
+
+
+def listing_server(serve, pages, etag='"listing-1"'):
+    """
+    Serve directory listings from `pages` (path -> html), answering
+    If-None-Match with a 304 when the ETag matches
+    """
+
+    def respond(handler):
+        if handler.headers.get('If-None-Match') == etag:
+            return 304, {'ETag':etag}, b''
+        if handler.path not in pages:
+            return 404, {}, b''
+        return 200, {'ETag':etag, 'Content-Type':'text/html'}, pages[handler.path].encode()
+
+    return serve(respond)
+
+
+def test_parse_listing():
+    assert parse_listing(LISTING) == ['sw00032026001sat.fits.gz', 'hk/']
+
+
+def test_fresh_listing_from_cache(serve, tmp_path):
+    server = listing_server(serve, {'/obs/':LISTING})
+    cache = ListingCache(filename=str(tmp_path / 'listings.sqlite'))
+    with HTTPClient(base_url=server.url) as client:
+        first = list_directory(client, server.url + '/obs/', cache=cache)
+        second = list_directory(client, server.url + '/obs/', cache=cache)
+    assert first == second == ['sw00032026001sat.fits.gz', 'hk/']
+    # the second listing didn't need a request
+    assert len(server.log) == 1
+
+
+def test_stale_listing_revalidated(serve, tmp_path):
+    server = listing_server(serve, {'/obs/':LISTING})
+    cache = ListingCache(filename=str(tmp_path / 'listings.sqlite'), ttl=0)
+    with HTTPClient(base_url=server.url) as client:
+        first = list_directory(client, server.url + '/obs/', cache=cache)
+        second = list_directory(client, server.url + '/obs/', cache=cache)
+    assert second == first
+    assert len(server.log) == 2
+    assert server.log[1][2]['If-None-Match'] == '"listing-1"'
+
+
+def test_revalidate_fresh_listing(serve, tmp_path):
+    server = listing_server(serve, {'/obs/':LISTING})
+    cache = ListingCache(filename=str(tmp_path / 'listings.sqlite'))
+    with HTTPClient(base_url=server.url) as client:
+        list_directory(client, server.url + '/obs/', cache=cache)
+        entries = list_directory(client, server.url + '/obs/', cache=cache, revalidate=True)
+    assert entries == ['sw00032026001sat.fits.gz', 'hk/']
+    assert len(server.log) == 2
+    assert server.log[1][2]['If-None-Match'] == '"listing-1"'
+
+
+def test_crawl(serve):
+    pages = {'/obs/':LISTING,
+             '/obs/hk/':'<a href="sw00032026001uat.hk.gz">x</a>'}
+    server = listing_server(serve, pages)
+    with HTTPClient(base_url=server.url) as client:
+        file_urls = crawl(client, server.url + '/obs/')
+    assert sorted(file_urls) == [server.url + '/obs/hk/sw00032026001uat.hk.gz',
+                                 server.url + '/obs/sw00032026001sat.fits.gz']
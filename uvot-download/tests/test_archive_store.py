@@ -0,0 +1,116 @@
+import os
+import shutil
+
+from archive_store import ArchiveStore, link_tree, folder_size
+
+
+def make_obs(store, obsid, files):
+    for rel_path, data in files.items():
+        local_file = os.path.join(store.obs_path(obsid), *rel_path.split('/'))
+        os.makedirs(os.path.dirname(local_file), exist_ok=True)
+        with open(local_file, 'wb') as f:
+            f.write(data)
+
+
+FILES = {'uvot/image/sw00084312006uw2_sk.img':b'x' * 100,
+         'auxil/sw00084312006sat.fits':b'y' * 50}
+
+
+def test_link_obs(tmp_path):
+    store = ArchiveStore(str(tmp_path / 'store'))
+    make_obs(store, '00084312006', FILES)
+    targets = [str(tmp_path / 'NGC4038'), str(tmp_path / 'NGC4039')]
+
+    for target in targets:
+        assert store.link_obs('00084312006', target) == len(FILES)
+        for rel_path in FILES:
+            store_file = os.path.join(store.obs_path('00084312006'), *rel_path.split('/'))
+            target_file = os.path.join(target, '00084312006', *rel_path.split('/'))
+            assert os.path.samefile(store_file, target_file)
+            assert not os.path.islink(target_file)
+        assert store.is_linked('00084312006', target)
+    # (linking again does nothing)
+    assert store.link_obs('00084312006', targets[0]) == 0
+    # (not in the store)
+    assert store.link_obs('00084312099', targets[0]) == 0
+
+    # the links are remembered
+    store = ArchiveStore(str(tmp_path / 'store'))
+    assert store.links['00084312006'] == set(targets)
+
+
+def test_symlink_obs(tmp_path):
+    store = ArchiveStore(str(tmp_path / 'store'), link_mode='symlink')
+    make_obs(store, '00084312006', FILES)
+    target = str(tmp_path / 'NGC4038')
+    store.link_obs('00084312006', target)
+    target_file = os.path.join(target, '00084312006', 'auxil', 'sw00084312006sat.fits')
+    assert os.path.islink(target_file)
+    assert store.is_linked('00084312006', target)
+
+
+def test_relink_replaced_files(tmp_path):
+    store = ArchiveStore(str(tmp_path / 'store'))
+    make_obs(store, '00084312006', FILES)
+    target = str(tmp_path / 'NGC4038')
+    store.link_obs('00084312006', target)
+
+    # a file downloaded again in the store (so it's a new file) gets a new
+    # link, but files in folders that weren't linked from the store aren't
+    # touched
+    rel_path = 'auxil/sw00084312006sat.fits'
+    store_file = os.path.join(store.obs_path('00084312006'), *rel_path.split('/'))
+    os.remove(store_file)
+    make_obs(store, '00084312006', {rel_path:b'z' * 50})
+    other = str(tmp_path / 'NGC4039')
+    os.makedirs(os.path.join(other, '00084312006', 'auxil'))
+    with open(os.path.join(other, '00084312006', *rel_path.split('/')), 'wb') as f:
+        f.write(b'w' * 50)
+
+    assert store.link_obs('00084312006', target) == 1
+    assert store.link_obs('00084312006', other) == 1
+    assert os.path.samefile(store_file, os.path.join(target, '00084312006', *rel_path.split('/')))
+    with open(os.path.join(other, '00084312006', *rel_path.split('/')), 'rb') as f:
+        assert f.read() == b'w' * 50
+
+
+def test_link_tree_skips_partial_files(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'done.fits').write_bytes(b'a')
+    (src / 'partial.fits.part').write_bytes(b'b')
+    assert link_tree(str(src), str(tmp_path / 'dst')) == 1
+    assert os.listdir(str(tmp_path / 'dst')) == ['done.fits']
+
+
+def test_gc(tmp_path, capsys):
+    store = ArchiveStore(str(tmp_path / 'store'))
+    for obsid in ['00084312006', '00084312007', '00084312008']:
+        make_obs(store, obsid, FILES)
+    targets = [str(tmp_path / 'NGC4038'), str(tmp_path / 'NGC4039')]
+    store.link_obs('00084312006', targets[0])
+    store.link_obs('00084312006', targets[1])
+    store.link_obs('00084312007', targets[0])
+    # (00084312008 was never linked)
+
+    # (00084312006 is still used by the other target)
+    shutil.rmtree(targets[0])
+
+    obs_size = folder_size(store.obs_path('00084312007'))
+    removed, nbytes = store.gc(dry_run=True)
+    assert removed == ['00084312007', '00084312008']
+    assert nbytes == 2 * obs_size
+    assert 'would remove 00084312007' in capsys.readouterr().out
+    assert all([store.has_obs(obsid) for obsid in removed])
+
+    removed, nbytes = store.gc(verbose=False)
+    assert removed == ['00084312007', '00084312008']
+    assert not any([store.has_obs(obsid) for obsid in removed])
+    assert store.has_obs('00084312006')
+    # the target's copies are unaffected
+    assert os.path.isfile(os.path.join(targets[1], '00084312006', 'auxil', 'sw00084312006sat.fits'))
+
+    # and the links file only lists the target that's left
+    store = ArchiveStore(str(tmp_path / 'store'))
+    assert store.links == {'00084312006':{targets[1]}}
+    assert store.gc(verbose=False) == ([], 0)
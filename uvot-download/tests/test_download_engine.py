@@ -0,0 +1,373 @@
+import os
+import gzip
+import email.utils
+import http.client
+
+import pytest
+
+from heasarc_http import HTTPClient, RetryPolicy
+from transfer_journal import TransferJournal, JOURNAL_NAME
+from download_engine import ObsJob, FileSelection, DownloadBudget, ObsDownloader, \
+     download_observations, download_file, download_obs
+
+# files of an observation in the archive (the xrt/ folder isn't downloaded)
+OBS_FILES = ['uvot/image/sw{obsid}uw2_sk.img.gz',
+             'uvot/image/sw{obsid}uw2_ex.img.gz',
+             'uvot/hk/sw{obsid}uac.hk.gz',
+             'auxil/sw{obsid}sat.fits.gz',
+             'xrt/event/sw{obsid}xpcw3po_cl.evt.gz']
+
+
+def add_obs(archive, obsid, start_month='2018_01'):
+    return archive.add_obs(start_month, obsid, [name.format(obsid=obsid) for name in OBS_FILES])
+
+
+def read_gz(filename):
+    with gzip.open(filename, 'rb') as f:
+        return f.read()
+
+
+def test_download_observations(archive, tmp_path):
+    obsids = ['00084312006', '00084312007', '00084312008']
+    contents = {obsid:add_obs(archive, obsid) for obsid in obsids}
+    save_path = str(tmp_path / 'DDO68')
+    job_list = [ObsJob(obsid, '2018_01', save_path) for obsid in obsids]
+
+    with HTTPClient(base_url=archive.url, max_connections=4) as client:
+        results = download_observations(job_list, max_workers=3, client=client, verbose=False)
+
+    assert [result.obsid for result in results] == obsids
+    for result in results:
+        assert result.ok
+        assert len(result.files) == 4
+        # same layout as wget: save_path/obsid/...
+        for name, data in contents[result.obsid].items():
+            local_file = os.path.join(save_path, result.obsid, *name.split('/'))
+            if name.startswith('xrt/'):
+                assert not os.path.exists(local_file)
+            else:
+                assert local_file in result.files
+                assert read_gz(local_file) == data
+    assert not any(['/xrt/' in path for path in archive.requests()])
+
+
+def test_failed_observation(archive, tmp_path):
+    add_obs(archive, '00084312006')
+    save_path = str(tmp_path / 'DDO68')
+    # (not in the archive)
+    job_list = [ObsJob('00084312099', '2018_01', save_path),
+                ObsJob('00084312006', '2018_01', save_path)]
+
+    with HTTPClient(base_url=archive.url, retries=0) as client:
+        results = download_observations(job_list, max_workers=2, client=client, verbose=False)
+
+    assert not results[0].ok
+    assert '404' in results[0].error
+    assert results[1].ok
+    assert len(results[1].files) == 4
+
+
+
+def test_unzip_while_downloading(archive, tmp_path):
+    obsids = ['00084312006', '00084312007']
+    contents = {obsid:add_obs(archive, obsid) for obsid in obsids}
+    # a file that arrives corrupted
+    bad_file = archive.obs_path('2018_01', '00084312007', 'auxil/sw00084312007sat.fits.gz')
+    archive.files[bad_file] = archive.files[bad_file][:-20]
+    save_path = str(tmp_path / 'DDO68')
+    job_list = [ObsJob(obsid, '2018_01', save_path) for obsid in obsids]
+
+    with HTTPClient(base_url=archive.url) as client:
+        results = download_observations(job_list, client=client, unzip=True, unzip_workers=2,
+                                            verbose=False)
+
+    assert results[0].ok
+    for name, data in contents['00084312006'].items():
+        if not name.startswith('xrt/'):
+            local_file = os.path.join(save_path, '00084312006', *name.split('/'))
+            assert not os.path.exists(local_file)
+            with open(local_file[:-3], 'rb') as f:
+                assert f.read() == data
+
+    # the corrupt file is deleted, so it's downloaded again next time
+    assert not results[1].ok
+    assert 'could not unzip' in results[1].error
+    assert not os.path.exists(os.path.join(save_path, '00084312007', 'auxil', 'sw00084312007sat.fits.gz'))
+
+
+# ---------------------------------------------------------------------------
+# resuming downloads
+
+DATA = bytes(range(256)) * 400
+FILE_PATH = '/FTP/swift/data/obs/2018_01/00084312006/uvot/image/sw00084312006uw2_sk.img.gz'
+
+
+def test_resume_after_cut_off(archive, tmp_path):
+    archive.add_file(FILE_PATH, DATA)
+    archive.cut_off[FILE_PATH] = 10000
+    journal = TransferJournal(str(tmp_path / 'journal.jsonl'))
+    local_file = str(tmp_path / 'obs' / 'file.img.gz')
+    url = archive.url + FILE_PATH
+
+    with HTTPClient(base_url=archive.url, retry_policy=RetryPolicy(retries=0)) as client:
+        with pytest.raises((IOError, http.client.HTTPException)):
+            download_file(client, url, local_file, journal=journal)
+        assert not os.path.exists(local_file)
+        assert os.path.getsize(local_file + '.part') == 10000
+        assert journal.get_file(url)['received'] == 10000
+        etag = journal.get_file(url)['etag']
+
+        # picks up where it stopped
+        nbytes = download_file(client, url, local_file, journal=journal)
+
+    headers = archive.log[-1][2]
+    assert headers['Range'] == 'bytes=10000-'
+    assert (etag is not None) and (headers['If-Range'] == etag)
+    assert nbytes == len(DATA) - 10000
+    with open(local_file, 'rb') as f:
+        assert f.read() == DATA
+    assert not os.path.exists(local_file + '.part')
+    assert journal.get_file(url)['complete']
+
+
+def test_changed_file_starts_over(archive, tmp_path):
+    archive.add_file(FILE_PATH, DATA)
+    archive.cut_off[FILE_PATH] = 10000
+    journal = TransferJournal(str(tmp_path / 'journal.jsonl'))
+    local_file = str(tmp_path / 'file.img.gz')
+    url = archive.url + FILE_PATH
+
+    with HTTPClient(base_url=archive.url, retry_policy=RetryPolicy(retries=0)) as client:
+        with pytest.raises((IOError, http.client.HTTPException)):
+            download_file(client, url, local_file, journal=journal)
+        # HEASARC has a new version, so If-Range doesn't match
+        archive.add_file(FILE_PATH, DATA[::-1])
+        assert download_file(client, url, local_file, journal=journal) == len(DATA)
+
+    with open(local_file, 'rb') as f:
+        assert f.read() == DATA[::-1]
+
+
+def test_part_file_already_complete(archive, tmp_path):
+    archive.add_file(FILE_PATH, DATA)
+    journal = TransferJournal(str(tmp_path / 'journal.jsonl'))
+    local_file = str(tmp_path / 'file.img.gz')
+    url = archive.url + FILE_PATH
+
+    with HTTPClient(base_url=archive.url) as client:
+        response = client.head(url)
+    # everything arrived, but the run stopped before the file was renamed
+    with open(local_file + '.part', 'wb') as f:
+        f.write(DATA)
+    journal.update_file(url, path=local_file, complete=False, size=len(DATA),
+                            etag=response.headers['ETag'],
+                            last_modified=response.headers['Last-Modified'])
+
+    with HTTPClient(base_url=archive.url, retry_policy=RetryPolicy(retries=0)) as client:
+        assert download_file(client, url, local_file, journal=journal) == 0
+
+    assert archive.log[-1][2]['Range'] == 'bytes='+str(len(DATA))+'-'
+    with open(local_file, 'rb') as f:
+        assert f.read() == DATA
+    assert os.path.getmtime(local_file) == \
+      email.utils.parsedate_to_datetime(response.headers['Last-Modified']).timestamp()
+
+
+def test_refresh_only_newer(archive, tmp_path):
+    archive.add_file(FILE_PATH, DATA)
+    journal = TransferJournal(str(tmp_path / 'journal.jsonl'))
+    local_file = str(tmp_path / 'file.img.gz')
+    url = archive.url + FILE_PATH
+
+    with HTTPClient(base_url=archive.url) as client:
+        download_file(client, url, local_file, journal=journal)
+
+        # not changed on the server
+        assert download_file(client, url, local_file, journal=journal, refresh=True) is None
+        assert archive.log[-1][2]['If-Modified-Since'] == archive.last_modified[FILE_PATH]
+
+        # reprocessed
+        archive.add_file(FILE_PATH, DATA[::-1], last_modified='Wed, 24 Jan 2018 16:47:57 GMT')
+        assert download_file(client, url, local_file, journal=journal, refresh=True) == len(DATA)
+
+    with open(local_file, 'rb') as f:
+        assert f.read() == DATA[::-1]
+
+
+def test_finished_obs_skipped(archive, tmp_path):
+    add_obs(archive, '00084312006')
+    save_path = str(tmp_path / 'DDO68')
+    journal = TransferJournal(str(tmp_path / 'journal.jsonl'))
+    job = ObsJob('00084312006', '2018_01', save_path)
+
+    with HTTPClient(base_url=archive.url) as client:
+        assert len(download_obs(client, job, journal=journal).files) == 4
+        n_requests = len(archive.log)
+
+        # the journal says it's done, so HEASARC isn't contacted
+        result = download_obs(client, job, journal=journal)
+        assert result.ok and (result.files == []) and (len(result.skipped) == 4)
+        assert len(archive.log) == n_requests
+
+        # unless a file has gone missing
+        missing = result.skipped[0]
+        os.remove(missing)
+        result = download_obs(client, job, journal=journal)
+        assert result.files == [missing]
+        assert len(result.skipped) == 3
+
+
+def test_download_all_checks_for_new_files(archive, tmp_path):
+    contents = add_obs(archive, '00084312006')
+    save_path = str(tmp_path / 'DDO68')
+    journal = TransferJournal(str(tmp_path / 'journal.jsonl'))
+
+    with HTTPClient(base_url=archive.url) as client:
+        download_obs(client, ObsJob('00084312006', '2018_01', save_path), journal=journal)
+
+        # HEASARC adds a file and reprocesses one
+        new_name = 'uvot/image/sw00084312006um2_sk.img.gz'
+        archive.add_obs('2018_01', '00084312006', [new_name])
+        changed = archive.obs_path('2018_01', '00084312006', 'auxil/sw00084312006sat.fits.gz')
+        archive.add_file(changed, gzip.compress(b'reprocessed', mtime=0),
+                             last_modified='Wed, 24 Jan 2018 16:47:57 GMT')
+
+        result = download_obs(client, ObsJob('00084312006', '2018_01', save_path, download_all=True),
+                                  journal=journal)
+
+    assert result.ok
+    assert sorted([os.path.relpath(f, save_path) for f in result.files]) == \
+      [os.path.join('00084312006', 'auxil', 'sw00084312006sat.fits.gz'),
+       os.path.join('00084312006', 'uvot', 'image', 'sw00084312006um2_sk.img.gz')]
+    assert len(result.skipped) == 3
+    assert read_gz(os.path.join(save_path, '00084312006', 'auxil', 'sw00084312006sat.fits.gz')) == b'reprocessed'
+
+
+# ---------------------------------------------------------------------------
+# picking files out of an observation
+
+def test_file_selection_match():
+    selection = FileSelection(filters=['w2', 'm2'], products=['sky', 'attitude'])
+    assert selection.subdirs == ['auxil', 'uvot/image']
+    assert selection.key == 'm2,w2:attitude,sky'
+    assert selection.match('uvot/image/sw00084312006uw2_sk.img.gz')
+    assert selection.match('uvot/image/sw00084312006um2_sk.img')
+    assert selection.match('auxil/sw00084312006sat.fits.gz')
+    assert selection.match('auxil/sw00084312006pat.fits.gz')
+    assert selection.match('auxil/sw00084312006uat.fits.gz')
+    # other filters and products
+    assert not selection.match('uvot/image/sw00084312006uw1_sk.img.gz')
+    assert not selection.match('uvot/image/sw00084312006uw2_ex.img.gz')
+    assert not selection.match('uvot/hk/sw00084312006uac.hk.gz')
+    assert not selection.match('auxil/sw00084312006x.mkf.gz')
+
+    everything = FileSelection(products=['sky', 'event', 'hk'])
+    assert everything.key == 'all:event,hk,sky'
+    assert everything.match('uvot/image/sw00084312006uvv_sk.img.gz')
+    assert everything.match('uvot/event/sw00084312006um2w1po_uf.evt.gz')
+    assert everything.match('uvot/hk/sw00084312006uac.hk.gz')
+
+    with pytest.raises(ValueError):
+        FileSelection(products=['spectra'])
+
+
+def test_download_selection(archive, tmp_path):
+    obsid = '00084312006'
+    archive.add_obs('2018_01', obsid, ['uvot/image/sw'+obsid+'uw2_sk.img.gz',
+                                       'uvot/image/sw'+obsid+'uw1_sk.img.gz',
+                                       'uvot/image/sw'+obsid+'uw2_ex.img.gz',
+                                       'uvot/event/sw'+obsid+'uw2w1po_uf.evt.gz',
+                                       'uvot/hk/sw'+obsid+'uac.hk.gz',
+                                       'auxil/sw'+obsid+'sat.fits.gz',
+                                       'auxil/sw'+obsid+'s.mkf.gz'])
+    save_path = str(tmp_path / 'DDO68')
+    journal = TransferJournal(str(tmp_path / 'journal.jsonl'))
+    selection = FileSelection(filters=['w2'], products=['sky', 'exposure', 'attitude'])
+
+    with HTTPClient(base_url=archive.url) as client:
+        result = download_obs(client, ObsJob(obsid, '2018_01', save_path, selection=selection),
+                                  journal=journal)
+        assert sorted([os.path.basename(f) for f in result.files]) == \
+          ['sw'+obsid+'sat.fits.gz', 'sw'+obsid+'uw2_ex.img.gz', 'sw'+obsid+'uw2_sk.img.gz']
+        # only the folders with selected files are listed
+        listed = [path for path in archive.requests() if path.endswith('/')]
+        assert not any(['/event/' in path or '/hk/' in path for path in listed])
+
+        # a different selection isn't covered by the journal
+        n_requests = len(archive.log)
+        result = download_obs(client, ObsJob(obsid, '2018_01', save_path, selection=selection), journal=journal)
+        assert len(archive.log) == n_requests
+        result = download_obs(client, ObsJob(obsid, '2018_01', save_path,
+                                                 selection=FileSelection(filters=['w1'], products=['sky'])),
+                                  journal=journal)
+        assert [os.path.basename(f) for f in result.files] == ['sw'+obsid+'uw1_sk.img.gz']
+
+
+def test_download_budget():
+    budget = DownloadBudget(max_bytes=1000)
+    assert not budget.exhausted()
+    budget.add(600)
+    assert not budget.exhausted()
+    budget.add(400)
+    assert budget.exhausted()
+    assert DownloadBudget(max_time=0).exhausted()
+    assert not DownloadBudget(max_time=60).exhausted()
+    assert not DownloadBudget().exhausted()
+
+
+def test_priority_order(archive, tmp_path):
+    obsids = ['00084312006', '00084312007', '00084312008']
+    for obsid in obsids:
+        add_obs(archive, obsid)
+    save_path = str(tmp_path / 'DDO68')
+    job_list = [ObsJob(obsid, '2018_01', save_path, priority=priority)
+                    for obsid, priority in zip(obsids, [2.0, 0.0, 1.0])]
+
+    with HTTPClient(base_url=archive.url) as client:
+        results = download_observations(job_list, max_workers=1, client=client, verbose=False)
+
+    assert all([result.ok for result in results])
+    # (one at a time, smallest priority first)
+    requests = archive.requests('GET')
+    first_request = {obsid:min([i for i, path in enumerate(requests)
+                                    if path.startswith(archive.obs_path('2018_01', obsid))])
+                         for obsid in obsids}
+    assert sorted(obsids, key=first_request.get) == ['00084312007', '00084312008', '00084312006']
+
+
+def test_budget_defers_observations(archive, tmp_path):
+    obsids = ['00084312006', '00084312007', '00084312008']
+    for obsid in obsids:
+        add_obs(archive, obsid)
+    save_path = str(tmp_path / 'DDO68')
+    job_list = [ObsJob(obsid, '2018_01', save_path, priority=priority)
+                    for obsid, priority in zip(obsids, [2.0, 0.0, 1.0])]
+    budget = DownloadBudget(max_bytes=1)
+
+    with HTTPClient(base_url=archive.url) as client:
+        results = download_observations(job_list, max_workers=1, client=client, verbose=False,
+                                            budget=budget)
+
+    # the first observation uses up the budget, and the rest are left
+    assert budget.nbytes == results[1].nbytes > 0
+    assert results[1].ok and not results[1].deferred
+    for result in [results[0], results[2]]:
+        assert result.deferred
+        assert result.error == 'download budget used up'
+        assert not os.path.exists(os.path.join(save_path, result.obsid))
+    journal = TransferJournal(os.path.join(save_path, JOURNAL_NAME))
+    assert journal.obs_complete('00084312007')
+    assert not journal.obs_started('00084312006')
+
+
+def test_submit_same_observation(archive, tmp_path):
+    add_obs(archive, '00084312006')
+    save_path = str(tmp_path / 'DDO68')
+
+    with HTTPClient(base_url=archive.url) as client:
+        with ObsDownloader(max_workers=2, client=client, verbose=False) as downloader:
+            first = downloader.submit(ObsJob('00084312006', '2018_01', save_path))
+            second = downloader.submit(ObsJob('00084312006', '2018_01', save_path))
+            assert second is first
+            assert first.result().ok
+    assert len([path for path in archive.requests('GET') if path.endswith('.gz')]) == 4
@@ -0,0 +1,148 @@
+import os
+
+import numpy as np
+
+from heasarc_http import HTTPClient
+from heasarc_table import parse_batch_table
+from transfer_journal import TransferJournal, JOURNAL_NAME
+from download_engine import ObsJob, download_observations
+from download_heasarc import select_observations, download_filter_check, min_exp_check, \
+     plan_downloads, dedupe_jobs, share_obs, finish_target, job_priorities
+
+TABLE = '''
+|obsid      |start_time         |uvot_expo_w2|uvot_expo_m2|uvot_expo_w1|_offset|
++-----------+-------------------+------------+------------+------------+-------+
+|00084312006|2018-01-23T16:47:57|            |   108.78500|   116.24300| 0.4555|
+|00084312007|2018-02-23T16:47:57|   200.00000|     0.00000|     0.00000| 0.5000|
+|00084312008|2018-03-23T16:47:57|     0.00000|    50.00000|     0.00000| 1.0000|
+|00084312009|2018-04-23T16:47:57|     0.00000|     0.00000|     0.00000| 2.0000|
+Bye
+'''
+
+
+def test_download_filter_check():
+    table = parse_batch_table(TABLE)
+    # a blank entry counts as present
+    assert list(download_filter_check(table, ['w2'])) == [True, True, False, False]
+    assert list(download_filter_check(table, ['w2', 'm2'])) == [True, True, True, False]
+    # no column for the filter, so it's assumed to be there
+    assert list(download_filter_check(table, ['uu'])) == [True, True, True, True]
+
+
+def test_min_exp_check():
+    table = parse_batch_table(TABLE)
+    assert list(min_exp_check(table, 100)) == [True, True, False, False]
+    assert list(min_exp_check(table, 0)) == [True, True, True, True]
+    # no exposure columns
+    assert list(min_exp_check(table[['obsid', 'start_time']], 100)) == [True, True, True, True]
+
+
+def test_select_observations():
+    table = parse_batch_table(TABLE)
+    assert list(select_observations(table)['obsid']) == list(table['obsid'])
+    selected = select_observations(table, download_filters=['w2', 'm2'], min_exp=10)
+    assert list(selected['obsid']) == ['00084312006', '00084312007', '00084312008']
+    assert len(select_observations(table[:0], download_filters=['w2'])) == 0
+
+
+def test_dedupe_jobs():
+    job_lists = [[ObsJob('00084312006', '2018_01', 'NGC4038'), ObsJob('00084312007', '2018_02', 'NGC4038')],
+                 [ObsJob('00084312008', '2018_03', 'NGC4039'), ObsJob('00084312006', '2018_01', 'NGC4039')],
+                 []]
+    unique_jobs = dedupe_jobs(job_lists)
+    assert list(unique_jobs) == ['00084312006', '00084312007', '00084312008']
+    # each observation goes to the first target that needs it
+    assert unique_jobs['00084312006'] is job_lists[0][0]
+    assert unique_jobs['00084312008'] is job_lists[1][0]
+
+
+def test_share_obs(tmp_path):
+    src_path = str(tmp_path / 'NGC4038')
+    dst_path = str(tmp_path / 'NGC4039')
+    rel_path = os.path.join('00084312006', 'uvot', 'image', 'sw00084312006uw2_sk.img.gz')
+    os.makedirs(os.path.dirname(os.path.join(src_path, rel_path)))
+    with open(os.path.join(src_path, rel_path), 'wb') as f:
+        f.write(b'x' * 100)
+    src_journal = TransferJournal(os.path.join(src_path, JOURNAL_NAME))
+    src_journal.finish_obs('00084312006', [rel_path])
+    dst_journal = TransferJournal(os.path.join(dst_path, JOURNAL_NAME))
+
+    share_obs(src_path, dst_path, '00084312006', src_journal, dst_journal)
+
+    assert os.path.samefile(os.path.join(src_path, rel_path), os.path.join(dst_path, rel_path))
+    assert dst_journal.obs_complete('00084312006')
+    assert dst_journal.obs_files('00084312006') == [rel_path]
+
+
+def test_shared_observations_download_once(archive, tmp_path):
+    names = ['uvot/image/sw{obsid}uw2_sk.img.gz', 'auxil/sw{obsid}sat.fits.gz']
+    for obsid in ['00084312006', '00084312007', '00084312008']:
+        archive.add_obs('2018_01', obsid, [name.format(obsid=obsid) for name in names])
+    table = parse_batch_table(TABLE)
+    # (two targets that overlap in one observation)
+    targets = [(str(tmp_path / 'NGC4038'), table[[0, 1]]), (str(tmp_path / 'NGC4039'), table[[0, 2]])]
+    for save_path, heasarc_table in targets:
+        heasarc_table['start_time'] = np.datetime64('2018-01-23T16:47:57')
+        os.makedirs(save_path)
+
+    journals = {save_path:TransferJournal(os.path.join(save_path, JOURNAL_NAME))
+                    for save_path, heasarc_table in targets}
+    job_lists = [plan_downloads(heasarc_table, save_path, journals[save_path])
+                     for save_path, heasarc_table in targets]
+    unique_jobs = dedupe_jobs(job_lists)
+    assert len(unique_jobs) == 3
+
+    with HTTPClient(base_url=archive.url) as client:
+        job_list = list(unique_jobs.values())
+        job_results = dict(zip([job.obsid for job in job_list],
+                               download_observations(job_list, client=client, journals=journals,
+                                                         verbose=False)))
+    # each file was only downloaded once
+    file_requests = [path for path in archive.requests('GET') if path.endswith('.gz')]
+    assert len(file_requests) == len(set(file_requests)) == 6
+
+    for (save_path, heasarc_table), job_list in zip(targets, job_lists):
+        finish_target(os.path.basename(save_path), save_path, save_path, heasarc_table, job_list,
+                          [job_results[job.obsid] for job in job_list], unique_jobs, journals,
+                          unzip=False)
+        for obsid in heasarc_table['obsid']:
+            assert journals[save_path].obs_complete(obsid)
+            for name in names:
+                assert os.path.isfile(os.path.join(save_path, obsid, *name.format(obsid=obsid).split('/')))
+
+    # the second target got its copy of the shared observation from the first
+    shared_file = os.path.join('00084312006', *names[0].format(obsid='00084312006').split('/'))
+    assert os.path.samefile(os.path.join(targets[0][0], shared_file), os.path.join(targets[1][0], shared_file))
+    assert not os.path.exists(os.path.join(targets[0][0], '00084312008'))
+
+
+def test_job_priorities():
+    table = parse_batch_table(TABLE)
+    assert job_priorities(table) == [0, 0, 0, 0]
+
+    # most exposure first (a blank entry counts as none)
+    assert np.allclose(job_priorities(table, priority='exposure'), [-225.028, -200, -50, 0])
+    assert job_priorities(table, priority='exposure', download_filters=['w2']) == [0, -200, 0, 0]
+
+    # most recent first, with blank start times last
+    table['start_time'][2] = np.datetime64('NaT')
+    priorities = job_priorities(table, priority='recent')
+    assert np.argsort(priorities, kind='stable').tolist() == [3, 1, 0, 2]
+
+    # closest first, with blank offsets last
+    table['_offset'][0] = np.nan
+    priorities = job_priorities(table, priority='offset')
+    assert np.argsort(priorities, kind='stable').tolist() == [1, 2, 3, 0]
+
+    # (no column to order by)
+    assert job_priorities(table[['obsid']], priority='recent') == [0, 0, 0, 0]
+
+
+def test_plan_downloads_priority(tmp_path):
+    table = parse_batch_table(TABLE)
+    save_path = str(tmp_path / 'NGC4038')
+    journal = TransferJournal(os.path.join(save_path, JOURNAL_NAME))
+    job_list = plan_downloads(table, save_path, journal, download_filters=['w2', 'm2'],
+                                  priority='offset')
+    assert [job.obsid for job in job_list] == ['00084312006', '00084312007', '00084312008']
+    assert [job.priority for job in job_list] == job_priorities(table[:3], priority='offset')
@@ -0,0 +1,118 @@
+import os
+
+from heasarc_http import HTTPClient
+from transfer_journal import TransferJournal, JOURNAL_NAME
+from download_engine import ObsJob, FileSelection, download_observations
+from download_plan import estimate_obs, estimate_jobs, estimate_time, format_bytes, format_duration
+
+OBS_FILES = ['uvot/image/sw{obsid}uw2_sk.img.gz',
+             'uvot/image/sw{obsid}uw2_ex.img.gz',
+             'uvot/hk/sw{obsid}uac.hk.gz',
+             'auxil/sw{obsid}sat.fits.gz',
+             'xrt/event/sw{obsid}xpcw3po_cl.evt.gz']
+
+NEWER = 'Wed, 24 Jan 2018 16:47:57 GMT'
+
+
+def add_obs(archive, obsid, start_month='2018_01'):
+    names = [name.format(obsid=obsid) for name in OBS_FILES]
+    archive.add_obs(start_month, obsid, names)
+    # (sizes of the files as served, without the xrt/ folder)
+    return {name:len(archive.files[archive.obs_path(start_month, obsid, name)])
+                for name in names if not name.startswith('xrt/')}
+
+
+def test_estimate_obs(archive, tmp_path):
+    sizes = add_obs(archive, '00084312006')
+    save_path = str(tmp_path / 'DDO68')
+
+    with HTTPClient(base_url=archive.url) as client:
+        estimate = estimate_obs(client, ObsJob('00084312006', '2018_01', save_path))
+
+    assert estimate.ok
+    assert sorted(estimate.files) == sorted([(os.path.join(save_path, '00084312006', *name.split('/')), size)
+                                                 for name, size in sizes.items()])
+    assert estimate.nbytes == sum(sizes.values())
+    assert estimate.head_count == len(archive.requests('HEAD')) == 4
+    # nothing is downloaded
+    assert not any([path.endswith('.gz') for path in archive.requests('GET')])
+    assert not os.path.exists(save_path)
+
+
+def test_estimate_selection(archive, tmp_path):
+    sizes = add_obs(archive, '00084312006')
+    save_path = str(tmp_path / 'DDO68')
+    job = ObsJob('00084312006', '2018_01', save_path,
+                     selection=FileSelection(filters=['w2'], products=['sky']))
+
+    with HTTPClient(base_url=archive.url) as client:
+        estimate = estimate_obs(client, job)
+
+    assert estimate.nbytes == sizes['uvot/image/sw00084312006uw2_sk.img.gz']
+    assert estimate.n_files == 1
+
+
+def test_estimate_after_download(archive, tmp_path):
+    sizes = add_obs(archive, '00084312006')
+    save_path = str(tmp_path / 'DDO68')
+    journal = TransferJournal(os.path.join(save_path, JOURNAL_NAME))
+    job = ObsJob('00084312006', '2018_01', save_path)
+
+    with HTTPClient(base_url=archive.url) as client:
+        download_observations([job], client=client, journals={save_path:journal}, verbose=False)
+
+        # a complete observation has nothing to download (without asking
+        # the archive)
+        n_requests = len(archive.log)
+        estimate = estimate_obs(client, job, journal=journal)
+        assert estimate.ok and (estimate.n_files == 0)
+        assert len(archive.log) == n_requests
+
+        # only the missing file, with its size from the journal
+        missing = 'uvot/image/sw00084312006uw2_ex.img.gz'
+        os.remove(os.path.join(save_path, '00084312006', *missing.split('/')))
+        estimate = estimate_obs(client, job, journal=journal)
+        assert estimate.files == [(os.path.join(save_path, '00084312006', *missing.split('/')), sizes[missing])]
+        assert estimate.head_count == 0
+
+        # with download_all, only the files that HEASARC has a newer version of
+        updated = archive.obs_path('2018_01', '00084312006', 'auxil/sw00084312006sat.fits.gz')
+        archive.add_file(updated, archive.files[updated] + b'more', last_modified=NEWER)
+        job = ObsJob('00084312006', '2018_01', save_path, download_all=True)
+        estimate = estimate_obs(client, job, journal=journal)
+
+    assert sorted(estimate.files) == sorted([
+        (os.path.join(save_path, '00084312006', *missing.split('/')), sizes[missing]),
+        (os.path.join(save_path, '00084312006', 'auxil', 'sw00084312006sat.fits.gz'),
+             sizes['auxil/sw00084312006sat.fits.gz'] + 4)])
+
+
+def test_estimate_jobs(archive, tmp_path):
+    sizes = {obsid:add_obs(archive, obsid) for obsid in ['00084312006', '00084312007']}
+    save_path = str(tmp_path / 'DDO68')
+    # (the last one isn't in the archive)
+    job_list = [ObsJob(obsid, '2018_01', save_path) for obsid in ['00084312007', '00084312006', '00084312099']]
+
+    with HTTPClient(base_url=archive.url, retries=0) as client:
+        estimates = estimate_jobs(job_list, client=client, max_connections=4)
+
+    assert [e.obsid for e in estimates] == ['00084312007', '00084312006', '00084312099']
+    for e in estimates[:2]:
+        assert e.ok
+        assert e.nbytes == sum(sizes[e.obsid].values())
+    assert not estimates[2].ok
+    assert not os.path.exists(save_path)
+
+    # the bytes at the bandwidth, plus the HEAD overhead for each file
+    per_file = sum([e.head_time for e in estimates]) / 8
+    assert abs(estimate_time(estimates, bandwidth=1000, max_workers=2)
+                   - (sum([e.nbytes for e in estimates]) / 1000 + 8 * per_file / 2)) < 1e-9
+
+
+def test_formatting():
+    assert format_bytes(999) == '999 B'
+    assert format_bytes(1234567) == '1.2 MB'
+    assert format_bytes(5e12) == '5.0 TB'
+    assert format_duration(42) == '42 s'
+    assert format_duration(600) == '10 min'
+    assert format_duration(9000) == '2.5 hr'
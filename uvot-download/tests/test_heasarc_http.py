@@ -0,0 +1,164 @@
+import time
+import threading
+
+import pytest
+
+from heasarc_http import HTTPClient, HTTPError, RetryPolicy, CircuitOpenError
+
+
+def ok(handler):
+    return 200, {}, b'ok'
+
+
+def test_keep_alive_reuse(serve):
+    server = serve(ok)
+    with HTTPClient(base_url=server.url) as client:
+        for i in range(5):
+            assert client.get('/x').content == b'ok'
+    # all of the requests came in on one connection
+    assert len(server.log) == 5
+    assert len(set([port for method, path, headers, port in server.log])) == 1
+
+
+def test_unread_response_not_reused(serve):
+    server = serve(lambda handler: (200, {}, b'x'*100000))
+    with HTTPClient(base_url=server.url) as client:
+        response = client.request('GET', '/big')
+        response.read(10)
+        # the rest of the body is still waiting, so the connection can't be
+        # used for another request
+        response.close()
+        assert client.get('/big').content == b'x'*100000
+    assert len(set([port for method, path, headers, port in server.log])) == 2
+
+
+def test_paths_and_headers(serve):
+    server = serve(ok)
+    with HTTPClient(base_url=server.url + '/') as client:
+        client.get('FTP/swift/data/obs/', headers={'If-None-Match':'"a"'})
+        client.get(server.url + '/db-perl/W3Browse/w3query.pl?Entry=M33')
+        assert client.head('/x').status == 200
+    assert [(method, path) for method, path, headers, port in server.log] == \
+      [('GET', '/FTP/swift/data/obs/'), ('GET', '/db-perl/W3Browse/w3query.pl?Entry=M33'), ('HEAD', '/x')]
+    assert server.log[0][2]['If-None-Match'] == '"a"'
+
+
+def test_raise_for_status(serve):
+    server = serve(lambda handler: (404, {}, b'not here'))
+    with HTTPClient(base_url=server.url) as client:
+        response = client.get('/missing')
+        assert response.status == 404
+        with pytest.raises(HTTPError):
+            response.raise_for_status()
+        # 4xx responses aren't retried
+        assert len(server.log) == 1
+
+
+def test_stale_connection_reconnects(serve):
+    # the server drops connections that are idle for more than 0.2 s
+    server = serve(ok, idle_timeout=0.2)
+    policy = RetryPolicy(backoff=1.0)
+    with HTTPClient(base_url=server.url, retry_policy=policy, adaptive=True) as client:
+        client.get('/x')
+        time.sleep(0.5)
+        start = time.monotonic()
+        assert client.get('/x').status == 200
+        elapsed = time.monotonic() - start
+        # no backoff, no retry spent, and no failure recorded
+        assert elapsed < 0.5
+        assert policy.tokens == policy.budget
+        assert policy._hosts == {}
+    assert len(set([port for method, path, headers, port in server.log])) == 2
+
+
+def test_stale_connection_breaker_test_request(serve):
+    statuses = [503, 200]
+    # (so the connection from the failed request goes stale during the
+    # cooldown)
+    server = serve(lambda handler: (statuses.pop(0), {}, b''), idle_timeout=0.1)
+    policy = RetryPolicy(retries=0, failure_threshold=1, cooldown=0.3)
+    responses = []
+    with HTTPClient(base_url=server.url, retry_policy=policy) as client:
+        assert client.get('/a').status == 503
+        time.sleep(0.5)
+        # the breaker's test request has to reconnect
+        thread = threading.Thread(target=lambda: responses.append(client.get('/b')))
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        assert not thread.is_alive()
+    assert [response.status for response in responses] == [200]
+    # (and the breaker is closed again)
+    assert policy._hosts == {}
+    assert len(set([port for method, path, headers, port in server.log])) == 2
+
+
+def test_retry_5xx_and_429(serve):
+    statuses = [503, 429, 200]
+
+    def respond(handler):
+        status = statuses.pop(0)
+        headers = {'Retry-After':'0'} if status == 429 else {}
+        return status, headers, (b'done' if status == 200 else b'')
+
+    server = serve(respond)
+    policy = RetryPolicy(backoff=0.01)
+    with HTTPClient(base_url=server.url, retry_policy=policy) as client:
+        response = client.get('/x')
+    assert response.status == 200
+    assert response.content == b'done'
+    assert len(server.log) == 3
+    # two retries spent, and a little earned back by the success
+    assert policy.tokens == pytest.approx(policy.budget - 2 + policy.budget_ratio)
+
+
+def test_retries_give_up(serve):
+    server = serve(lambda handler: (500, {}, b''))
+    with HTTPClient(base_url=server.url, retry_policy=RetryPolicy(retries=2, backoff=0.01)) as client:
+        response = client.get('/x')
+    # the last response is returned, whatever its status
+    assert response.status == 500
+    assert len(server.log) == 3
+
+
+def test_retry_budget(serve):
+    server = serve(lambda handler: (503, {}, b''))
+    policy = RetryPolicy(retries=5, backoff=0.01, budget=2, failure_threshold=100)
+    with HTTPClient(base_url=server.url, retry_policy=policy) as client:
+        assert client.get('/x').status == 503
+        # the budget is used up, so there aren't any more retries
+        assert client.get('/x').status == 503
+    assert len(server.log) == 4
+
+
+def test_circuit_breaker_gives_up(serve):
+    server = serve(lambda handler: (503, {}, b''))
+    policy = RetryPolicy(retries=0, failure_threshold=2, cooldown=0.2, max_trips=2)
+    with HTTPClient(base_url=server.url, retry_policy=policy) as client:
+        client.get('/x')
+        client.get('/x')
+        # the breaker is open: wait for the cooldown, then a test request
+        # (which fails, so it opens again)
+        start = time.monotonic()
+        client.get('/x')
+        assert time.monotonic() - start >= 0.15
+        # after max_trips, requests fail straight away
+        with pytest.raises(CircuitOpenError):
+            client.get('/x')
+    assert len(server.log) == 3
+
+
+def test_circuit_breaker_closes(serve):
+    statuses = [503, 503, 200, 200]
+    server = serve(lambda handler: (statuses.pop(0), {}, b''))
+    policy = RetryPolicy(retries=0, failure_threshold=2, cooldown=0.2)
+    with HTTPClient(base_url=server.url, retry_policy=policy) as client:
+        client.get('/x')
+        client.get('/x')
+        start = time.monotonic()
+        assert client.get('/x').status == 200
+        assert time.monotonic() - start >= 0.15
+        # the test request worked, so the breaker is closed again
+        start = time.monotonic()
+        assert client.get('/x').status == 200
+        assert time.monotonic() - start < 0.15
@@ -0,0 +1,60 @@
+import numpy as np
+
+from heasarc_table import parse_batch_table, format_batch_table, append_batch_rows, read_batch_table
+
+TABLE = '''
+|obsid      |start_time         |uvot_expo_w2|_offset|
++-----------+-------------------+------------+-------+
+|00084312006|2018-01-23T16:47:57|   108.76300| 0.4555|
+|00084312007|                   |            | 1.2000|
+Bye
+'''
+
+
+def test_parse_batch_table():
+    data = parse_batch_table(TABLE)
+    assert data.dtype.names == ('obsid', 'start_time', 'uvot_expo_w2', '_offset')
+    assert list(data['obsid']) == ['00084312006', '00084312007']
+    assert data['start_time'][0] == np.datetime64('2018-01-23T16:47:57')
+    assert data['uvot_expo_w2'][0] == np.float32(108.763)
+    assert data['_offset'][1] == np.float32(1.2)
+    # blank entries
+    assert np.isnat(data['start_time'][1])
+    assert np.isnan(data['uvot_expo_w2'][1])
+
+
+def test_parse_ragged_rows():
+    # rows that don't line up with the header are split one at a time
+    text = '|obsid|uvot_expo_w2|\n+-----+------------+\n|00084312006|108.763|\n|00084312007| 5 |\n'
+    data = parse_batch_table(text)
+    assert list(data['obsid']) == ['00084312006', '00084312007']
+    assert np.allclose(data['uvot_expo_w2'], [108.763, 5])
+
+
+def test_parse_no_table():
+    assert len(parse_batch_table('\nno observations found\n')) == 0
+    data = parse_batch_table('|obsid      |\n+-----------+\nBye\n')
+    assert len(data) == 0
+    assert data.dtype.names == ('obsid',)
+
+
+def test_format_roundtrip():
+    data = parse_batch_table(TABLE)
+    text = format_batch_table(data)
+    again = parse_batch_table(text)
+    assert again.dtype == data.dtype
+    assert np.array_equal(again['obsid'], data['obsid'])
+    assert np.array_equal(again['start_time'], data['start_time'], equal_nan=True)
+    assert np.allclose(again['uvot_expo_w2'], data['uvot_expo_w2'], equal_nan=True)
+    assert np.allclose(again['_offset'], data['_offset'])
+
+
+def test_append_batch_rows(tmp_path):
+    filename = str(tmp_path / 'heasarc_obs.dat')
+    with open(filename, 'w') as f:
+        f.write(TABLE)
+    append_batch_rows(filename, ['|00084312008|2018-02-01T00:00:00|    50.00000| 0.1000|'])
+    data = read_batch_table(filename)
+    assert list(data['obsid']) == ['00084312006', '00084312007', '00084312008']
+    with open(filename) as f:
+        assert f.read().rstrip().endswith('Bye')
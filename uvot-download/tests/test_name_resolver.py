@@ -0,0 +1,94 @@
+import urllib.parse
+
+import pytest
+
+import name_resolver
+from heasarc_http import HTTPClient
+from heasarc_cache import ResolverCache
+from name_resolver import resolve_name, looks_like_coordinates, entry_degrees
+
+# names each resolver knows (RA, Dec in degrees)
+KNOWN = {'N':{'M33':(23.462042, 30.660222)},
+         'S':{'M33':(23.462042, 30.660222), 'DDO 68':(149.196250, 28.825556)}}
+
+
+@pytest.fixture
+def sesame(serve, monkeypatch):
+    """
+    Stand-in for the Sesame name resolver
+    """
+
+    def respond(handler):
+        code = urllib.parse.urlsplit(handler.path).path.rstrip('/').split('/')[-1]
+        name = urllib.parse.unquote(urllib.parse.urlsplit(handler.path).query)
+        if name not in KNOWN[code]:
+            return 200, {}, ('# ' + name + '\n#! *** Nothing found *** \n').encode()
+        ra, dec = KNOWN[code][name]
+        return 200, {}, ('# ' + name + '\n%J ' + str(ra) + ' ' + str(dec) + ' = 01:33:50.89 +30:39:36.8\n').encode()
+
+    server = serve(respond)
+    monkeypatch.setattr(name_resolver, 'SESAME_URL', server.url + '/sesame/')
+    return server
+
+
+def test_resolve_name(sesame, tmp_path):
+    cache = ResolverCache(filename=str(tmp_path / 'resolver.sqlite'))
+    with HTTPClient(base_url=sesame.url) as client:
+        entry, messages = resolve_name('M33', client, cache)
+        assert entry == '23.462042 +30.660222'
+        assert messages == []
+        # SIMBAD is tried if NED doesn't know the name
+        entry, messages = resolve_name('DDO 68', client, cache)
+        assert entry == '149.196250 +28.825556'
+        assert len(sesame.log) == 3
+
+        # both are cached now
+        assert resolve_name('M33', client, cache)[0] == '23.462042 +30.660222'
+        assert resolve_name('DDO 68', client, cache)[0] == '149.196250 +28.825556'
+        assert len(sesame.log) == 3
+    assert cache.get('DDO 68')['resolver'] == 'SIMBAD'
+
+
+def test_unresolvable_name_cached(sesame, tmp_path):
+    cache = ResolverCache(filename=str(tmp_path / 'resolver.sqlite'))
+    with HTTPClient(base_url=sesame.url) as client:
+        entry, messages = resolve_name('NotAGalaxy', client, cache)
+        assert entry is None
+        assert messages[-1] == 'failed to resolve NotAGalaxy'
+        assert len(sesame.log) == 2
+
+        # the failure is remembered, so it costs nothing the next time
+        entry, messages = resolve_name('NotAGalaxy', client, cache)
+        assert entry is None
+        assert 'earlier lookup' in messages[0]
+        assert len(sesame.log) == 2
+
+        # unless it's refreshed
+        resolve_name('NotAGalaxy', client, cache, refresh=True)
+        assert len(sesame.log) == 4
+
+
+def test_failure_expires(sesame, tmp_path):
+    cache = ResolverCache(filename=str(tmp_path / 'resolver.sqlite'), negative_ttl=0)
+    with HTTPClient(base_url=sesame.url) as client:
+        resolve_name('NotAGalaxy', client, cache)
+        resolve_name('NotAGalaxy', client, cache)
+    assert len(sesame.log) == 4
+
+
+def test_coordinates_not_looked_up(sesame, tmp_path):
+    cache = ResolverCache(filename=str(tmp_path / 'resolver.sqlite'))
+    with HTTPClient(base_url=sesame.url) as client:
+        for entry in ['00h09m56.5s -24d57m47s', '09:43:32.4 +33:26:58', '148.89 69.07']:
+            assert resolve_name(entry, client, cache) == (entry, [])
+    assert len(sesame.log) == 0
+
+
+def test_coordinate_formats():
+    assert looks_like_coordinates('148.89 69.07')
+    assert not looks_like_coordinates('M33')
+    assert not looks_like_coordinates('NGC 300')
+    assert entry_degrees('148.890000 +69.070000') == pytest.approx((148.89, 69.07))
+    ra, dec = entry_degrees('00:09:56.5 -24:57:47')
+    assert ra == pytest.approx(2.485417, abs=1e-5)
+    assert dec == pytest.approx(-24.963056, abs=1e-5)
@@ -0,0 +1,103 @@
+import os
+import gzip
+
+from heasarc_http import HTTPClient
+from obs_manifest import ObsManifest, describe_file, check_file
+from download_engine import ObsJob, download_observations
+
+
+def write_gz(filename, data):
+    with gzip.open(filename, 'wb') as f:
+        f.write(data)
+
+
+def flip_byte(filename, offset):
+    """
+    Corrupt a file without changing its size
+    """
+    with open(filename, 'r+b') as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0xff]))
+
+
+def test_check_file(tmp_path):
+    data = os.urandom(5000)
+    local_file = str(tmp_path / 'sw00084312006uw2_sk.img.gz')
+    write_gz(local_file, data)
+    entry = describe_file(local_file)
+    assert entry['size'] == os.path.getsize(local_file)
+    assert entry['data_size'] == len(data)
+    assert check_file(local_file, entry, deep=True)
+
+    # the same size, but different contents: only the checksum catches it
+    flip_byte(local_file, 100)
+    assert check_file(local_file, entry)
+    assert not check_file(local_file, entry, deep=True)
+
+    # a truncated file
+    write_gz(local_file, data)
+    with open(local_file, 'r+b') as f:
+        f.truncate(entry['size'] - 10)
+    assert not check_file(local_file, entry)
+
+
+def test_check_unzipped_file(tmp_path):
+    data = os.urandom(5000)
+    local_file = str(tmp_path / 'sw00084312006uw2_sk.img.gz')
+    write_gz(local_file, data)
+    entry = describe_file(local_file)
+
+    # after unzipping, the data are checked against the gzip trailer
+    os.remove(local_file)
+    with open(local_file[:-3], 'wb') as f:
+        f.write(data)
+    assert describe_file(local_file) == {'data_size':entry['data_size'], 'crc32':entry['crc32']}
+    assert check_file(local_file, entry, deep=True)
+    flip_byte(local_file[:-3], 100)
+    assert check_file(local_file, entry)
+    assert not check_file(local_file, entry, deep=True)
+
+    os.remove(local_file[:-3])
+    assert not check_file(local_file, entry)
+    assert describe_file(local_file) is None
+
+
+def test_verify_redownloads_bad_files(archive, tmp_path):
+    obsid = '00084312006'
+    names = ['uvot/image/sw{}uw2_sk.img.gz'.format(obsid),
+             'uvot/image/sw{}uw2_ex.img.gz'.format(obsid),
+             'auxil/sw{}sat.fits.gz'.format(obsid)]
+    contents = archive.add_obs('2018_01', obsid, names)
+    save_path = str(tmp_path / 'DDO68')
+
+    with HTTPClient(base_url=archive.url) as client:
+        result = download_observations([ObsJob(obsid, '2018_01', save_path)],
+                                           client=client, verbose=False)[0]
+        assert result.ok
+
+        manifest = ObsManifest.for_obs(save_path, obsid)
+        assert sorted(manifest.files) == sorted(names)
+        assert manifest.files[names[0]]['path'] == archive.obs_path('2018_01', obsid, names[0])
+        assert manifest.verify() == []
+
+        # one file corrupted, one deleted
+        flip_byte(manifest.local_file(names[0]), 50)
+        os.remove(manifest.local_file(names[2]))
+        assert manifest.missing() == [names[2]]
+        assert manifest.verify(max_workers=2) == sorted([names[0], names[2]])
+
+        n_requests = len(archive.requests('GET'))
+        result = download_observations([ObsJob(obsid, '2018_01', save_path, verify=True)],
+                                           client=client, verbose=False)[0]
+
+    assert result.ok
+    assert sorted(result.files) == sorted([manifest.local_file(names[0]), manifest.local_file(names[2])])
+    assert result.skipped == [manifest.local_file(names[1])]
+    # (only the bad files, with no listings)
+    assert len(archive.requests('GET')) == n_requests + 2
+    for name in names:
+        with gzip.open(manifest.local_file(name), 'rb') as f:
+            assert f.read() == contents[name]
+    assert ObsManifest.for_obs(save_path, obsid).verify() == []
@@ -0,0 +1,303 @@
+import os
+import sys
+import json
+import urllib.parse
+
+import pytest
+
+import name_resolver
+import query_heasarc
+from heasarc_http import HTTPClient
+from heasarc_table import read_batch_table
+from name_resolver import looks_like_coordinates
+from query_heasarc import query_heasarc as run_query_heasarc, split_batch_output
+
+COLUMNS = ['obsid', 'start_time', 'uvot_expo_w2', 'uvot_expo_m2', 'uvot_expo_w1', '_offset']
+
+# observations of M33 (without the offset)
+M33_ROWS = [['00084312006', '2018-01-23T16:47:57', '108.76300', '108.78500', '116.24300'],
+            ['00084312010', '2018-10-07T15:48:57', '0.00000', '240.78200', '241.77500']]
+M33_POSITION = (23.462042, 30.660222)
+
+
+class FakeHEASARC(object):
+    """
+    Stand-in for HEASARC's swiftmastr query (and the Sesame name resolver).
+    `observations` has the rows for each entry HEASARC knows about (names,
+    or positions as sent by name_resolver.resolve_name); other names can't
+    be resolved, and other positions have no observations.  A query for
+    several entries marks each row with its entry in the offset column, as
+    HEASARC does, and a start_time limit (from an incremental query) is
+    honoured.  `positions` has the names Sesame knows.
+    """
+
+    def __init__(self):
+        self.observations = {}
+        self.positions = {}
+        self.server = None
+
+    def add_object(self, name, rows, position=None):
+        self.observations[name] = rows
+        if position is not None:
+            self.positions[name] = position
+            self.observations[name_resolver.position_entry(*position)] = rows
+
+    def queries(self):
+        return [path for method, path, headers, port in self.server.log if 'w3query' in path]
+
+    def lookups(self):
+        return [path for method, path, headers, port in self.server.log if path.startswith('/sesame/')]
+
+    def respond(self, handler):
+        path = urllib.parse.urlsplit(handler.path)
+        if path.path.startswith('/sesame/'):
+            return self.sesame(urllib.parse.unquote(path.query))
+
+        query = urllib.parse.parse_qs(path.query)
+        entries = [entry.strip() for entry in query['Entry'][0].split(';')]
+        since = query['bparam_start_time'][0][len('>='):] if 'bparam_start_time' in query else ''
+        rows = []
+        for entry in entries:
+            if (entry not in self.observations) and not looks_like_coordinates(entry):
+                return 200, {}, ('ERROR: unable to resolve '+entry+'\n').encode()
+            for r, row in enumerate(self.observations.get(entry, [])):
+                if row[1] < since:
+                    continue
+                offset = '{:.4f}'.format(0.1*(r+1))
+                if len(entries) > 1:
+                    offset += ' (' + entry + ')'
+                rows.append(row + [offset])
+        return 200, {}, format_table(rows).encode()
+
+    def sesame(self, name):
+        if name not in self.positions:
+            return 200, {}, ('# ' + name + '\n#! *** Nothing found *** \n').encode()
+        ra, dec = self.positions[name]
+        return 200, {}, ('# ' + name + '\n%J ' + str(ra) + ' ' + str(dec) + ' = 01:33:50.89 +30:39:36.8\n').encode()
+
+
+def format_table(rows):
+    """
+    Rows (lists of cells) in HEASARC's batch display format
+    """
+    widths = [max([len(name)] + [len(row[c]) for row in rows]) for c, name in enumerate(COLUMNS)]
+    lines = ['',
+             '|' + '|'.join([name.ljust(w) for name, w in zip(COLUMNS, widths)]) + '|',
+             '+' + '+'.join(['-'*w for w in widths]) + '+']
+    for row in rows:
+        lines.append('|' + '|'.join([cell.rjust(w) for cell, w in zip(row, widths)]) + '|')
+    lines.append('Bye')
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.fixture
+def heasarc(serve, tmp_path, monkeypatch):
+    """
+    A FakeHEASARC served by a LocalServer, with the tables (and the local
+    caches) going into tmp_path
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('UVOT_DOWNLOAD_CACHE', str(tmp_path / 'cache'))
+    fake = FakeHEASARC()
+    fake.server = serve(fake.respond)
+    monkeypatch.setattr(name_resolver, 'SESAME_URL', fake.server.url + '/sesame/')
+    fake.add_object('M33', M33_ROWS, position=M33_POSITION)
+    return fake
+
+
+def table_obsids(obj='M33'):
+    return list(read_batch_table(os.path.join(obj, 'heasarc_obs.dat'))['obsid'])
+
+
+# ---------------------------------------------------------------------------
+# query cache
+
+def test_query_cache(heasarc):
+    with HTTPClient(base_url=heasarc.server.url) as client:
+        run_query_heasarc('M33', client=client, resolve_names=False)
+        assert table_obsids() == ['00084312006', '00084312010']
+        os.remove(os.path.join('M33', 'heasarc_obs.dat'))
+
+        # within the TTL, the table comes from the cache
+        run_query_heasarc('M33', client=client, resolve_names=False)
+        assert len(heasarc.queries()) == 1
+        assert table_obsids() == ['00084312006', '00084312010']
+
+        # unless it's refreshed
+        run_query_heasarc('M33', client=client, resolve_names=False, refresh=True)
+        assert len(heasarc.queries()) == 2
+
+        # or has expired
+        run_query_heasarc('M33', client=client, resolve_names=False, cache_ttl=0)
+        assert len(heasarc.queries()) == 3
+
+        # a different search radius is a different query
+        run_query_heasarc('M33', client=client, resolve_names=False, search_radius=3.0)
+        assert len(heasarc.queries()) == 4
+
+
+def test_errors_not_cached(heasarc):
+    with HTTPClient(base_url=heasarc.server.url) as client:
+        run_query_heasarc('NotAGalaxy', client=client, resolve_names=False)
+        run_query_heasarc('NotAGalaxy', client=client, resolve_names=False)
+    # NED and SIMBAD both times
+    assert len(heasarc.queries()) == 4
+
+
+def test_refresh_option(monkeypatch):
+    calls = []
+    monkeypatch.setattr(query_heasarc, 'query_heasarc', lambda *args, **kwargs: calls.append(kwargs))
+    monkeypatch.setattr(sys, 'argv', ['query_heasarc.py', 'M33', '--refresh'])
+    query_heasarc.main()
+    monkeypatch.setattr(sys, 'argv', ['query_heasarc.py', 'M33'])
+    query_heasarc.main()
+    assert [kwargs['refresh'] for kwargs in calls] == [True, False]
+
+
+# ---------------------------------------------------------------------------
+# batch queries
+
+BATCH_HEADER = ('|obsid      |start_time         |uvot_expo_w2|uvot_expo_m2|uvot_expo_w1|_offset        |\n'
+                '+-----------+-------------------+------------+------------+------------+---------------+\n')
+
+BATCH_OUTPUT = ('\n' + BATCH_HEADER +
+                '|00084312006|2018-01-23T16:47:57|   108.76300|   108.78500|   116.24300| 0.4555 (DDO68)|\n'
+                '|00035865001|2006-11-10T00:10:01|  1200.00000|     0.00000|     0.00000| 2.1000 (M 33) |\n'
+                '|00084312010|2018-10-07T15:48:57|     0.00000|   240.78200|   241.77500| 0.7567 (DDO68)|\n'
+                'Bye\n')
+
+
+def test_split_batch_output():
+    split = split_batch_output(BATCH_OUTPUT, ['DDO68', 'M33', 'NGC 300'])
+    # no rows for NGC 300
+    assert sorted(split) == ['DDO68', 'M33']
+
+    lines = split['DDO68'].split('\n')
+    assert lines[1].split('|')[6].strip() == '_offset'
+    assert len(lines[1]) == len(BATCH_HEADER.split('\n')[0])
+    rows = [line for line in lines[3:] if line.startswith('|')]
+    assert [row.split('|')[1] for row in rows] == ['00084312006', '00084312010']
+    assert [row.split('|')[6].strip() for row in rows] == ['0.4555', '0.7567']
+    assert split['DDO68'].rstrip().endswith('Bye')
+
+
+def test_split_batch_output_unknown():
+    # a row that can't be matched to an object means the split can't be trusted
+    assert split_batch_output(BATCH_OUTPUT, ['DDO68']) == {}
+    assert split_batch_output('ERROR: something went wrong\n', ['DDO68']) == {}
+    assert split_batch_output('\nno observations found\n', ['DDO68']) == {}
+
+
+def test_batch_positions(heasarc, capsys):
+    # most of the positions don't have any observations
+    m33 = name_resolver.position_entry(*M33_POSITION)
+    positions = [m33] + [name_resolver.position_entry(10.0*i, 20.0) for i in range(1, 6)]
+    with HTTPClient(base_url=heasarc.server.url) as client:
+        failed = run_query_heasarc(positions, client=client, resolve_names=False, batch_size=10)
+
+    # one request for all of them
+    assert failed == []
+    assert len(heasarc.queries()) == 1
+    assert table_obsids(m33.replace(' ', '_')) == ['00084312006', '00084312010']
+    for position in positions[1:]:
+        assert len(read_batch_table(os.path.join(position.replace(' ', '_'), 'heasarc_obs.dat'))) == 0
+    assert capsys.readouterr().out.count('No observations of') == 5
+
+
+def test_batch_names(heasarc):
+    heasarc.add_object('NGC 300', [])
+    with HTTPClient(base_url=heasarc.server.url) as client:
+        run_query_heasarc(['M33', 'NGC 300'], client=client, resolve_names=False, batch_size=10)
+    # a name that's missing from the results might not have been resolved,
+    # so it's queried on its own
+    assert len(heasarc.queries()) == 2
+    assert 'Entry=NGC%20300' in heasarc.queries()[1]
+    assert table_obsids() == ['00084312006', '00084312010']
+    assert len(read_batch_table(os.path.join('NGC_300', 'heasarc_obs.dat'))) == 0
+
+
+def test_batch_resolves_names(heasarc, capsys):
+    heasarc.add_object('NGC 300', [], position=(13.722833, -37.684389))
+    objects = ['M33', 'NotAGalaxy', 'NGC 300']
+    with HTTPClient(base_url=heasarc.server.url) as client:
+        failed = run_query_heasarc(objects, client=client, batch_size=10)
+
+        # each name is looked up once, and the positions go in one query
+        assert failed == []
+        assert len(heasarc.lookups()) == 4
+        assert len(heasarc.queries()) == 1
+        assert 'NotAGalaxy' not in heasarc.queries()[0]
+        assert table_obsids() == ['00084312006', '00084312010']
+        assert len(read_batch_table(os.path.join('NGC_300', 'heasarc_obs.dat'))) == 0
+        assert not os.path.exists(os.path.join('NotAGalaxy', 'heasarc_obs.dat'))
+        assert 'failed to resolve NotAGalaxy' in capsys.readouterr().out
+
+        # the second time, nothing needs to be looked up (including the
+        # name that couldn't be resolved)
+        run_query_heasarc(objects, client=client, batch_size=10, cache_ttl=0)
+        assert len(heasarc.lookups()) == 4
+        assert len(heasarc.queries()) == 2
+        assert 'earlier lookup' in capsys.readouterr().out
+
+
+
+# ---------------------------------------------------------------------------
+# incremental queries (adding to the table past its watermark)
+
+NEW_ROW = ['00084312011', '2018-10-08T01:00:00', '10.00000', '20.00000', '30.00000']
+
+
+def run_incremental(client, **kwargs):
+    return run_query_heasarc('M33', client=client, use_cache=False, resolve_names=False, **kwargs)
+
+
+def test_incremental_appends(heasarc):
+    with HTTPClient(base_url=heasarc.server.url) as client:
+        run_incremental(client, incremental=True)
+        assert 'bparam_start_time' not in heasarc.queries()[-1]
+        assert table_obsids() == ['00084312006', '00084312010']
+
+        # nothing new
+        run_incremental(client, incremental=True)
+        assert 'bparam_start_time' in heasarc.queries()[-1]
+        assert table_obsids() == ['00084312006', '00084312010']
+
+        heasarc.observations['M33'] = M33_ROWS + [NEW_ROW]
+        run_incremental(client, incremental=True)
+        run_incremental(client, incremental=True)
+
+    assert table_obsids() == ['00084312006', '00084312010', '00084312011']
+    with open(os.path.join('M33', 'heasarc_obs_watermark.json')) as f:
+        assert json.load(f)['start_time'] == '2018-10-08T01:00:00'
+
+
+def test_late_observation(heasarc):
+    with HTTPClient(base_url=heasarc.server.url) as client:
+        run_incremental(client, incremental=True)
+        # shows up in HEASARC after the table was made, but started a bit
+        # before the latest observation in it
+        late_row = ['00084312009', '2018-10-01T00:00:00', '5.00000', '5.00000', '5.00000']
+        heasarc.observations['M33'] = M33_ROWS + [late_row]
+        run_incremental(client, incremental=True)
+    assert table_obsids() == ['00084312006', '00084312010', '00084312009']
+
+
+def test_full_then_incremental(heasarc):
+    with HTTPClient(base_url=heasarc.server.url) as client:
+        run_incremental(client, incremental=True)
+        heasarc.observations['M33'] = M33_ROWS + [NEW_ROW]
+        # a full query rewrites the table, so the old watermark doesn't apply
+        run_incremental(client)
+        assert not os.path.exists(os.path.join('M33', 'heasarc_obs_watermark.json'))
+        run_incremental(client, incremental=True)
+    assert table_obsids() == ['00084312006', '00084312010', '00084312011']
+
+
+def test_incremental_without_table(heasarc):
+    with HTTPClient(base_url=heasarc.server.url) as client:
+        run_incremental(client, incremental=True)
+        os.remove(os.path.join('M33', 'heasarc_obs.dat'))
+        # the watermark is left behind, but there's no table to add to
+        run_incremental(client, incremental=True)
+    assert 'bparam_start_time' not in heasarc.queries()[-1]
+    assert table_obsids() == ['00084312006', '00084312010']
@@ -0,0 +1,191 @@
+import os
+import urllib.parse
+
+import numpy as np
+import pytest
+
+from heasarc_http import HTTPClient
+from heasarc_table import column_dtype, format_batch_table, read_batch_table
+from name_resolver import position_entry
+from query_heasarc import query_heasarc, query_positions
+from swift_catalog import SwiftCatalog, CATALOG_FIELDS, unit_vectors, snapshot_catalog
+
+
+def random_catalog(rng, ra_centers, dec_centers, n_each=200, spread=0.2):
+    """
+    Catalog with rows scattered around each center (degrees), plus some
+    all over the sky
+    """
+    ra = [rng.uniform(0, 360, 1000)]
+    dec = [np.degrees(np.arcsin(rng.uniform(-1, 1, 1000)))]
+    for ra_c, dec_c in zip(ra_centers, dec_centers):
+        ra.append((ra_c + rng.normal(0, spread, n_each)) % 360)
+        dec.append(np.clip(dec_c + rng.normal(0, spread, n_each), -90, 90))
+    ra = np.concatenate(ra)
+    dec = np.concatenate(dec)
+
+    data = np.zeros(len(ra), dtype=[(name, column_dtype(name)) for name in CATALOG_FIELDS])
+    data['obsid'] = ['{:011d}'.format(i) for i in range(len(ra))]
+    data['ra'] = ra
+    data['dec'] = dec
+    data['start_time'] = np.datetime64('2018-01-01T00:00:00') + np.arange(len(ra)).astype('timedelta64[h]')
+    return data
+
+
+def brute_force(catalog, ra, dec, radius):
+    """
+    Every (position, row) pair within the radius, found by computing all
+    of the separations
+    """
+    radius = np.broadcast_to(radius, len(ra))
+    cos_sep = np.clip(unit_vectors(ra, dec).dot(unit_vectors(catalog.data['ra'], catalog.data['dec']).T), -1, 1)
+    offset = np.degrees(np.arccos(cos_sep)) * 60.0
+    target_index, row_index = np.where(offset <= radius[:, np.newaxis])
+    return target_index, row_index, offset[target_index, row_index]
+
+
+def test_cone_search():
+    rng = np.random.default_rng(3)
+    # including positions near the poles and where RA wraps around
+    ra = np.array([10.0, 359.95, 150.0, 200.0])
+    dec = np.array([41.3, 0.0, 89.95, -89.9])
+    catalog = SwiftCatalog(random_catalog(rng, ra, dec))
+    target_index, row_index, offset = brute_force(catalog, ra, dec, 7.0)
+
+    for t in range(len(ra)):
+        matches = catalog.cone_search(ra[t], dec[t], 7.0)
+        assert len(matches) > 0
+        assert sorted(matches['obsid']) == sorted(catalog.data['obsid'][row_index[target_index == t]])
+        # sorted by offset
+        assert np.all(np.diff(matches['_offset']) >= 0)
+        assert np.all(matches['_offset'] <= 7.0)
+
+
+def test_save_and_merge(tmp_path):
+    rng = np.random.default_rng(4)
+    data = random_catalog(rng, [], [])
+    catalog = SwiftCatalog(data[:600])
+    catalog.save(str(tmp_path / 'swiftmastr.npz'))
+    loaded = SwiftCatalog.load(str(tmp_path / 'swiftmastr.npz'))
+    assert np.array_equal(loaded.data, catalog.data)
+
+    # rows that are already there are replaced
+    new_data = data[500:].copy()
+    new_data['uvot_expo_w2'] = 100.0
+    merged = loaded.merge(new_data)
+    assert len(merged) == len(data)
+    assert sorted(merged.data['obsid']) == sorted(data['obsid'])
+    assert np.all(merged.data['uvot_expo_w2'][np.isin(merged.data['obsid'], new_data['obsid'])] == 100.0)
+    assert merged.latest_start == data['start_time'].max()
+
+
+@pytest.fixture
+def swiftmastr(serve):
+    """
+    Stand-in for HEASARC's swiftmastr table, with the rows in `data`, which
+    honours the start_time limit of incremental snapshots
+    """
+    state = {}
+
+    def respond(handler):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(handler.path).query)
+        data = state['data']
+        if 'bparam_start_time' in query:
+            since = np.datetime64(query['bparam_start_time'][0][len('>='):])
+            data = data[~np.isnat(data['start_time']) & (data['start_time'] >= since)]
+        return 200, {}, format_batch_table(data).encode()
+
+    state['server'] = serve(respond)
+    return state
+
+
+def test_snapshot_catalog(swiftmastr, tmp_path):
+    rng = np.random.default_rng(5)
+    data = random_catalog(rng, [], [])
+    # (an observation that hasn't started yet)
+    data['start_time'][0] = np.datetime64('NaT')
+    swiftmastr['data'] = data[:800]
+    filename = str(tmp_path / 'swiftmastr.npz')
+
+    with HTTPClient(base_url=swiftmastr['server'].url) as client:
+        catalog = snapshot_catalog(filename=filename, client=client, verbose=False)
+        assert len(catalog) == 800
+        assert 'bparam_start_time' not in swiftmastr['server'].log[-1][1]
+
+        # only the newer observations (and a bit before them) are fetched
+        swiftmastr['data'] = data
+        catalog = snapshot_catalog(filename=filename, client=client, verbose=False)
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(swiftmastr['server'].log[-1][1]).query)
+        since = np.datetime64(query['bparam_start_time'][0][len('>='):])
+        assert since == data['start_time'][799] - np.timedelta64(14, 'D')
+
+    assert len(catalog) == len(data)
+    assert sorted(catalog.data['obsid']) == sorted(data['obsid'])
+    assert len(SwiftCatalog.load(filename)) == len(data)
+
+
+def test_query_local_catalog(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('UVOT_DOWNLOAD_CACHE', str(tmp_path / 'cache'))
+    rng = np.random.default_rng(6)
+    catalog = SwiftCatalog(random_catalog(rng, [23.462], [30.660]))
+    catalog.save(str(tmp_path / 'swiftmastr.npz'))
+    position = position_entry(23.462, 30.660)
+
+    query_heasarc(position, local_catalog=str(tmp_path / 'swiftmastr.npz'), use_cache=False)
+
+    table = read_batch_table(os.path.join(position.replace(' ', '_'), 'heasarc_obs.dat'))
+    matches = catalog.cone_search(23.462, 30.660, 7.0)
+    assert list(table['obsid']) == list(matches['obsid'])
+    assert np.allclose(table['_offset'], matches['_offset'], atol=1e-4)
+
+
+def test_cross_match_brute_force():
+    rng = np.random.default_rng(42)
+    ra = np.array([10.0, 359.95, 0.02, 150.0, 200.0, 45.0, 270.0])
+    dec = np.array([41.3, 0.0, 10.0, 89.95, -89.9, -30.0, 60.0])
+    catalog = SwiftCatalog(random_catalog(rng, ra, dec))
+    # a different radius for each position
+    radius = np.array([7.0, 12.0, 3.0, 15.0, 20.0, 0.5, 7.0])
+
+    expected = brute_force(catalog, ra, dec, radius)
+    assert len(expected[0]) > 100
+    lookup = dict(zip(zip(*expected[:2]), expected[2]))
+
+    # (also in small groups of pairs at a time)
+    for max_pairs in [2000000, 50]:
+        target_index, row_index, offset = catalog.cross_match(ra, dec, radius, max_pairs=max_pairs)
+        assert sorted(zip(target_index, row_index)) == sorted(zip(*expected[:2]))
+        assert np.allclose(offset, [lookup[pair] for pair in zip(target_index, row_index)])
+        # sorted by position, then offset
+        assert np.all(np.diff(target_index) >= 0)
+        for t in range(len(ra)):
+            assert np.all(np.diff(offset[target_index == t]) >= 0)
+
+
+def test_cross_match_empty():
+    rng = np.random.default_rng(2)
+    catalog = SwiftCatalog(random_catalog(rng, [], []))
+    target_index, row_index, offset = catalog.cross_match([], [], 7.0)
+    assert len(target_index) == len(row_index) == len(offset) == 0
+    # an empty catalog
+    catalog = SwiftCatalog(random_catalog(rng, [], [])[:0])
+    assert len(catalog.cross_match([10.0], [41.3], 7.0)[0]) == 0
+
+
+def test_query_positions(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(7)
+    ra = np.array([23.462, 10.684, 300.0])
+    dec = np.array([30.660, 41.269, -60.0])
+    catalog = SwiftCatalog(random_catalog(rng, ra[:2], dec[:2], spread=0.05))
+    catalog.save(str(tmp_path / 'swiftmastr.npz'))
+
+    query_positions(['M33', 'M31', 'Nowhere'], ra, dec, search_radius=[7.0, 3.0, 0.1],
+                        local_catalog=str(tmp_path / 'swiftmastr.npz'))
+
+    for obj, t, radius in [('M33', 0, 7.0), ('M31', 1, 3.0)]:
+        table = read_batch_table(os.path.join(obj, 'heasarc_obs.dat'))
+        assert len(table) > 0
+        assert list(table['obsid']) == list(catalog.cone_search(ra[t], dec[t], radius)['obsid'])
+    assert len(read_batch_table(os.path.join('Nowhere', 'heasarc_obs.dat'))) == 0
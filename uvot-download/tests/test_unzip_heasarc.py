@@ -0,0 +1,95 @@
+import os
+import gzip
+
+import pytest
+
+from unzip_heasarc import gunzip_file, unzip_heasarc, find_gz_files
+
+
+def write_gz(filename, data, mtime=1516726077):
+    with open(filename, 'wb') as f:
+        f.write(gzip.compress(data, mtime=0))
+    os.utime(filename, (mtime, mtime))
+
+
+def test_gunzip_file(tmp_path):
+    gz_file = str(tmp_path / 'sw00084312006uw2_sk.img.gz')
+    write_gz(gz_file, b'image data' * 1000)
+
+    out_file = gunzip_file(gz_file)
+
+    # the unzipped file replaces the .gz file, like gunzip
+    assert out_file == gz_file[:-3]
+    assert not os.path.exists(gz_file)
+    with open(out_file, 'rb') as f:
+        assert f.read() == b'image data' * 1000
+    assert os.path.getmtime(out_file) == 1516726077
+
+
+def test_gunzip_corrupt_file(tmp_path):
+    gz_file = str(tmp_path / 'sw00084312006uw2_sk.img.gz')
+    with open(gz_file, 'wb') as f:
+        f.write(gzip.compress(b'image data' * 1000)[:-20])
+
+    with pytest.raises((IOError, EOFError)):
+        gunzip_file(gz_file)
+
+    # nothing half-written is left behind, and the .gz file is still there
+    assert sorted(os.listdir(str(tmp_path))) == ['sw00084312006uw2_sk.img.gz']
+
+
+def make_tree(path):
+    """
+    Downloaded files for two observations: one already unzipped, one
+    corrupt, and the rest still zipped
+    """
+    files = {}
+    for obsid in ['00084312006', '00084312007']:
+        os.makedirs(os.path.join(path, obsid, 'uvot', 'image'))
+        os.makedirs(os.path.join(path, obsid, 'auxil'))
+        for name in [os.path.join('uvot', 'image', 'sw'+obsid+'uw2_sk.img.gz'),
+                     os.path.join('auxil', 'sw'+obsid+'sat.fits.gz')]:
+            files[os.path.join(path, obsid, name)] = (obsid + name).encode() * 100
+            write_gz(os.path.join(path, obsid, name), (obsid + name).encode() * 100)
+    # unzipped in an earlier run (the .gz was left behind)
+    done = os.path.join(path, '00084312006', 'auxil', 'sw00084312006sat.fits')
+    with open(done, 'wb') as f:
+        f.write(b'already unzipped')
+    # cut off part way
+    bad = os.path.join(path, '00084312007', 'auxil', 'sw00084312007sat.fits.gz')
+    with open(bad, 'r+b') as f:
+        f.truncate(30)
+    return files, done, bad
+
+
+def test_find_gz_files(tmp_path):
+    files, done, bad = make_tree(str(tmp_path))
+    gz_list = find_gz_files(str(tmp_path))
+    assert sorted(gz_list) == sorted([f for f in files if f != done + '.gz'])
+    # (folders that aren't there are skipped)
+    gz_list = find_gz_files(str(tmp_path), obsids=['00084312007', '00084312099'])
+    assert sorted(gz_list) == sorted([f for f in files if '00084312007' in f])
+
+def test_unzip_heasarc(tmp_path):
+    files, done, bad = make_tree(str(tmp_path))
+
+    out_files = unzip_heasarc(str(tmp_path), max_workers=2, verbose=False)
+
+    expected = [f for f in files if f not in [done + '.gz', bad]]
+    assert sorted(out_files) == sorted([f[:-3] for f in expected])
+    for gz_file in expected:
+        assert not os.path.exists(gz_file)
+        with open(gz_file[:-3], 'rb') as f:
+            assert f.read() == files[gz_file]
+    # the one that was already unzipped isn't touched
+    with open(done, 'rb') as f:
+        assert f.read() == b'already unzipped'
+    # the corrupt one is reported, and left for another try
+    assert os.path.exists(bad) and not os.path.exists(bad[:-3])
+
+
+def test_unzip_heasarc_obsids(tmp_path):
+    files, done, bad = make_tree(str(tmp_path))
+    out_files = unzip_heasarc(str(tmp_path), obsids=['00084312006'], verbose=False)
+    assert out_files == [os.path.join(str(tmp_path), '00084312006', 'uvot', 'image', 'sw00084312006uw2_sk.img')]
+    assert unzip_heasarc(str(tmp_path), obsids=['00084312006'], verbose=False) == []
@@ -0,0 +1,138 @@
+import os
+import json
+import threading
+
+# name of the journal file within each target's folder
+JOURNAL_NAME = 'download_journal.jsonl'
+
+
+class TransferJournal(object):
+    """
+    Record of the downloads for one target, saved next to the HEASARC
+    table.  For each file, it keeps the URL, local path, expected
+    size, bytes received so far, and the server's Last-Modified/ETag (used
+    to make sure a partial file is resumed against the same version).  For
+    each observation, it records whether all of its files were downloaded,
+    so completed observations don't need their listings crawled again.
+
+    Each update is appended to the file as one line of JSON, so recording
+    progress stays cheap no matter how many files there are.  When the
+    journal is loaded, the lines are replayed (a line cut off by an
+    interruption is ignored) and the file is rewritten in compact form.
+
+    The journal can be shared between threads.
+
+    Parameters
+    ----------
+    filename : string
+        Path of the journal file.  If it exists, it's loaded.
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self.files = {}
+        self.obs = {}
+        if os.path.isfile(filename):
+            with open(filename, 'r') as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._apply(record)
+            self._compact()
+
+    def get_file(self, url):
+        """
+        Journal entry (a dict) for a file URL, or None if there isn't one
+        """
+        with self._lock:
+            entry = self.files.get(url)
+            return None if entry is None else dict(entry)
+
+    def update_file(self, url, **fields):
+        """
+        Update (or create) the entry for a file URL and save the journal
+        """
+        record = {'file':url}
+        record.update(fields)
+        with self._lock:
+            self._apply(record)
+            self._append(record)
+
+    def obs_started(self, obsid):
+        """
+        True if a download of this observation was started
+        """
+        with self._lock:
+            return obsid in self.obs
+
+    def obs_complete(self, obsid, selection=None):
+        """
+        True if all of the files for this observation were downloaded.  If
+        only some of its files were selected (see
+        download_engine.FileSelection), the observation only counts as
+        complete for the same selection (or when everything is downloaded).
+        """
+        with self._lock:
+            record = self.obs.get(obsid, {})
+            if not record.get('complete', False):
+                return False
+            return (record.get('selection') is None) or (record.get('selection') == selection)
+
+    def obs_files(self, obsid):
+        """
+        Local paths of the files recorded for a completed observation
+        """
+        with self._lock:
+            return list(self.obs.get(obsid, {}).get('files', []))
+
+    def start_obs(self, obsid):
+        """
+        Record that a download of this observation has begun
+        """
+        record = {'obs':obsid, 'complete':False, 'files':[]}
+        with self._lock:
+            self._apply(record)
+            self._append(record)
+
+    def finish_obs(self, obsid, files, selection=None):
+        """
+        Record that all of the files (local paths) of this observation were
+        downloaded, or all of the ones in a selection (its key)
+        """
+        record = {'obs':obsid, 'complete':True, 'files':list(files)}
+        if selection is not None:
+            record['selection'] = selection
+        with self._lock:
+            self._apply(record)
+            self._append(record)
+
+    def _apply(self, record):
+        record = dict(record)
+        if 'file' in record:
+            self.files.setdefault(record.pop('file'), {}).update(record)
+        elif 'obs' in record:
+            self.obs[record.pop('obs')] = record
+
+    def _append(self, record):
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        with open(self.filename, 'a') as fh:
+            fh.write(json.dumps(record) + '\n')
+
+    def _compact(self):
+        # write to a temporary file and rename, so an interruption can't
+        # leave a half-written journal
+        tmp_file = self.filename + '.tmp'
+        with open(tmp_file, 'w') as fh:
+            for url in sorted(self.files):
+                record = {'file':url}
+                record.update(self.files[url])
+                fh.write(json.dumps(record) + '\n')
+            for obsid in sorted(self.obs):
+                record = {'obs':obsid}
+                record.update(self.obs[obsid])
+                fh.write(json.dumps(record) + '\n')
+        os.replace(tmp_file, self.filename)
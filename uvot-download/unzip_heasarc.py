@@ -0,0 +1,159 @@
+import os
+import argparse
+import gzip
+import shutil
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def unzip_heasarc(path, obsids=None, max_workers=None, verbose=True):
+    """
+    Unzip all of the downloaded HEASARC files below a folder.  The folder is
+    walked once to make the list of .gz files that don't have an unzipped
+    version yet, and then they're unzipped in a pool of processes.
+
+    Parameters
+    ----------
+    path : string
+        Folder to search (e.g., the folder with a target's heasarc_obs.dat)
+
+    obsids : list of strings (default=None)
+        If set, only look in the subfolders for these observations
+
+    max_workers : int (default=None)
+        Number of processes to use (if None, the number of CPUs)
+
+    verbose : boolean (default=True)
+        If True, print the progress
+
+    Returns
+    -------
+    out_files : list of strings
+        Paths of the unzipped files
+
+    """
+
+    gz_list = find_gz_files(path, obsids=obsids)
+
+    if len(gz_list) == 0:
+        if verbose:
+            print('* no files to unzip in '+path)
+        return []
+
+    if verbose:
+        print('* unzipping '+str(len(gz_list))+' files in '+path)
+
+    out_files = []
+    n_fail = 0
+    # report progress roughly every 10%
+    report_every = max(1, len(gz_list) // 10)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(gunzip_file, gz): gz for gz in gz_list}
+        for n, future in enumerate(as_completed(futures)):
+            try:
+                out_files.append(future.result())
+            except (IOError, EOFError, zlib.error) as e:
+                n_fail += 1
+                print('  could not unzip '+futures[future]+': '+str(e))
+            if verbose and (((n+1) % report_every == 0) or (n+1 == len(gz_list))):
+                print('  unzipped '+str(n+1)+'/'+str(len(gz_list))+' files')
+
+    if verbose and (n_fail > 0):
+        print('* '+str(n_fail)+' files could not be unzipped')
+
+    return out_files
+
+
+def find_gz_files(path, obsids=None):
+    """
+    Walk a folder once and list the .gz files that don't have an unzipped
+    version next to them
+
+    Parameters
+    ----------
+    path : string
+        Folder to search
+
+    obsids : list of strings (default=None)
+        If set, only look in the subfolders for these observations
+
+    Returns
+    -------
+    gz_list : list of strings
+        Paths of the .gz files
+
+    """
+
+    if obsids is None:
+        top_list = [path]
+    else:
+        top_list = [os.path.join(path, obsid) for obsid in sorted(set(obsids))
+                        if os.path.isdir(os.path.join(path, obsid))]
+
+    gz_list = []
+
+    for top in top_list:
+        for dirpath, dirnames, filenames in os.walk(top):
+            names = set(filenames)
+            for name in filenames:
+                if name.endswith('.gz') and (name[:-3] not in names):
+                    gz_list.append(os.path.join(dirpath, name))
+
+    return gz_list
+
+
+def gunzip_file(gz_file):
+    """
+    Unzip a gzipped file in-process, the same way `gunzip` would: the
+    unzipped file replaces the .gz file.  The data are written to a
+    temporary file that is renamed once it's complete, so an interruption
+    never leaves a truncated file behind.
+
+    Parameters
+    ----------
+    gz_file : string
+        Path of the .gz file
+
+    Returns
+    -------
+    out_file : string
+        Path of the unzipped file
+
+    """
+
+    out_file = gz_file[:-3]
+    tmp_file = out_file + '.tmp'
+
+    try:
+        with gzip.open(gz_file, 'rb') as f_in:
+            with open(tmp_file, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out, 1024*1024)
+    except BaseException:
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+    mtime = os.path.getmtime(gz_file)
+    os.utime(tmp_file, (mtime, mtime))
+    os.replace(tmp_file, out_file)
+    os.remove(gz_file)
+
+    return out_file
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs="?", help="Folder with the downloaded data (e.g., the folder with heasarc_obs.dat)", default='')
+    parser.add_argument('-w','--max_workers', help="Number of processes to use for unzipping", type=int, default=None)
+    args = parser.parse_args()
+
+    if not args.path:
+        print('Please specify the folder with the data you would like to unzip.')
+        sys.exit()
+
+    unzip_heasarc(args.path, max_workers=args.max_workers)
+
+if __name__ =="__main__":
+    main()
@@ -0,0 +1,231 @@
+import os
+import argparse
+import sys
+import threading
+
+from query_heasarc import query_heasarc, query_positions, read_target_list
+from download_heasarc import plan_downloads, report_dry_run, finish_target, UVOT_FILTERS, PRIORITIES
+from archive_store import ArchiveStore
+from download_engine import ObsDownloader, FileSelection, DownloadBudget
+from heasarc_http import RetryPolicy
+from heasarc_cache import ListingCache
+from download_plan import DEFAULT_BANDWIDTH
+from heasarc_table import parse_batch_table
+
+
+def uvot_download(input_obj, list_opt=False, targets=False, search_radius=7.0,
+                      download_filters=None, min_exp=0.0, download_all=False,
+                      unzip=True, download_workers=4, max_connections=4,
+                      cache_listings=True, products=None, verify=False, store=None,
+                      priority=None, max_bytes=None, max_time=None, dry_run=False,
+                      bandwidth=DEFAULT_BANDWIDTH, adaptive=False, max_bandwidth=None,
+                      retry_policy=None, **query_args):
+    """
+    Query HEASARC and download the data in one go.  Each object's table is
+    handed straight to the download workers as soon as its query finishes,
+    so the downloads for the first objects run while the later ones are
+    still being queried.  The tables are still saved (heasarc_obs.dat in
+    each object's folder), and the downloads go next to them, the same as
+    running query_heasarc and then download_heasarc.
+
+    Parameters
+    ----------
+    input_obj : string or list of strings
+        Object name(s), or a file with them (see query_heasarc)
+
+    list_opt : boolean (default=False)
+        If True, input_obj is a file with one object name per line
+
+    targets : boolean (default=False)
+        If True, input_obj is a table of target names and positions, which
+        are matched against the local copy of swiftmastr (see
+        query_heasarc.query_positions)
+
+    search_radius : float (default=7.0)
+        Search radius (arcmin)
+
+    download_filters, min_exp, download_all, unzip, cache_listings, products,
+    verify, store, priority, max_bytes, max_time, dry_run, bandwidth,
+    adaptive, max_bandwidth, retry_policy
+        See download_heasarc.  The priority orders all of the observations
+        that are waiting to download, including ones from objects queried
+        later.  As in download_heasarc, an observation that several objects
+        share is only downloaded once, even if their queries finish at the
+        same time.  With dry_run, the queries are still run (and their
+        tables saved), but nothing is downloaded.  The queries and the
+        downloads share one retry policy, so if HEASARC goes down, both
+        pause until it's back.
+
+    download_workers : int (default=4)
+        Number of observations to download at the same time
+
+    max_connections : int (default=4)
+        Maximum number of download connections open to HEASARC at once
+
+    **query_args
+        Passed on to query_heasarc (e.g., max_workers, batch_size,
+        local_catalog, incremental)
+
+    Returns
+    -------
+    results : dict
+        For each object, a list of ObsResult objects (see download_engine),
+        or with dry_run, ObsEstimate objects (see download_plan)
+
+    """
+
+    if download_filters is not None:
+        for item in download_filters:
+            if item not in UVOT_FILTERS:
+                print(item, ' is not allowed in download_filters')
+                return
+
+    if (priority is not None) and (priority not in PRIORITIES):
+        print(priority, ' is not allowed for priority')
+        return
+
+    selection = None if products is None else FileSelection(filters=download_filters, products=products)
+
+    if (store is not None) and not isinstance(store, ArchiveStore):
+        store = ArchiveStore(store)
+    journals = None if store is None else {store.obs_root:store.journal}
+
+    listing_cache = ListingCache() if cache_listings else None
+
+    if retry_policy is None:
+        retry_policy = RetryPolicy()
+
+    budget = None
+    if (max_bytes is not None) or (max_time is not None):
+        budget = DownloadBudget(max_bytes=max_bytes, max_time=max_time)
+
+    # download futures for each object, in the order the tables arrive
+    target_jobs = []
+    lock = threading.Lock()
+
+    # each observation is downloaded by the first object that needs it (see
+    # download_heasarc.dedupe_jobs), and the job and future that do it
+    unique_jobs = {}
+
+    with ObsDownloader(max_workers=download_workers, max_connections=max_connections,
+                           journals=journals, listing_cache=listing_cache,
+                           unzip=(unzip and not dry_run), budget=budget,
+                           adaptive=adaptive, max_bandwidth=max_bandwidth,
+                           retry_policy=retry_policy) as downloader:
+
+        def queue_downloads(obj, output_file, query_output):
+            # the table is used straight from the query, not read back in
+            heasarc_table = parse_batch_table(query_output)
+            if len(heasarc_table) == 0:
+                return
+            save_path = os.path.dirname(os.path.realpath(output_file))
+            download_path = save_path if store is None else store.obs_root
+            job_list = plan_downloads(heasarc_table, download_path, downloader.journal(download_path),
+                                          download_filters=download_filters,
+                                          min_exp=min_exp, download_all=download_all,
+                                          selection=selection, verify=verify, priority=priority)
+            job_list.sort(key=lambda job: job.priority)
+            if (len(job_list) > 0) and not dry_run:
+                print('* downloading '+str(len(job_list))+' observations of '+obj)
+            futures = []
+            with lock:
+                for job in job_list:
+                    if job.obsid not in unique_jobs:
+                        unique_jobs[job.obsid] = (job, None if dry_run else downloader.submit(job))
+                    futures.append(unique_jobs[job.obsid][1])
+                target_jobs.append((obj, save_path, download_path, heasarc_table, job_list, futures))
+
+        if targets:
+            names, ra, dec, radius = read_target_list(input_obj)
+            query_positions(names, ra, dec,
+                                search_radius=(search_radius if radius is None else radius),
+                                local_catalog=(query_args.get('local_catalog') or True),
+                                on_table=queue_downloads)
+        else:
+            query_heasarc(input_obj, list_opt=list_opt, search_radius=search_radius,
+                              display_table=False, on_table=queue_downloads,
+                              retry_policy=retry_policy, **query_args)
+
+    owner_jobs = {obsid:job for obsid, (job, future) in unique_jobs.items()}
+
+    # only report what would be downloaded
+    results = {}
+    if dry_run:
+        estimates = report_dry_run([(target[0], target[4]) for target in target_jobs], owner_jobs,
+                                       downloader.journals, listing_cache=listing_cache,
+                                       max_connections=max_connections,
+                                       max_workers=download_workers, bandwidth=bandwidth)
+        for target, target_estimates in zip(target_jobs, estimates):
+            results[target[0]] = target_estimates
+        if listing_cache is not None:
+            listing_cache.close()
+        return results
+
+    # everything has downloaded once the downloader is closed
+    for obj, save_path, download_path, heasarc_table, job_list, futures in target_jobs:
+        results[obj] = [future.result() for future in futures]
+        finish_target(obj, save_path, download_path, heasarc_table, job_list, results[obj],
+                          owner_jobs, downloader.journals, selection=selection, unzip=unzip,
+                          store=store, download_filters=download_filters, min_exp=min_exp,
+                          verbose=False)
+
+    if listing_cache is not None:
+        listing_cache.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query HEASARC for UVOT observations of objects and download the data")
+    parser.add_argument('input_obj', nargs="?", help="Accepts either the object name as a string or a text file with a list of object names", default='')
+    parser.add_argument('-l','--list', help="Expect the name of a text file that contains a list of objects", action='store_true', default=False)
+    parser.add_argument('-t','--targets', help="Treat input_obj as a table (e.g., FITS or CSV) of target names and positions, and match them against the local copy of swiftmastr", action='store_true', default=False)
+    parser.add_argument('-r','--radius', help="Search radius (arcmin)", type=float, default=7.0)
+    parser.add_argument('-w','--max_workers', help="Number of objects to query at the same time", type=int, default=1)
+    parser.add_argument('--rate_limit', help="Maximum number of query requests per second sent to HEASARC", type=float, default=None)
+    parser.add_argument('--refresh', help="Ignore cached query results and query HEASARC again", action='store_true', default=False)
+    parser.add_argument('-b','--batch_size', help="Number of objects to include in each query request to HEASARC", type=int, default=None)
+    parser.add_argument('--local', help="Search the local copy of swiftmastr (see swift_catalog.py) instead of HEASARC", action='store_true', default=False)
+    parser.add_argument('--incremental', help="Only query for observations newer than the ones already in each object's table", action='store_true', default=False)
+    parser.add_argument('-f','--filters', help="Only download observations with data in at least one of these filters", nargs='+', default=None)
+    parser.add_argument('--min_exp', help="Only download observations with at least this exposure time (s) in one filter", type=float, default=0.0)
+    parser.add_argument('-p','--products', help="Only download these types of files (sky, exposure, raw, event, hk, attitude, auxil) for the requested filters, instead of whole observations", nargs='+', default=None)
+    parser.add_argument('--verify', help="Check the checksums of files from earlier downloads, and download any that are missing or corrupt", action='store_true', default=False)
+    parser.add_argument('-s','--store', help="Shared folder to download each observation into once, and link into the objects' folders (see archive_store.py)", default=None)
+    parser.add_argument('--priority', help="Download the observations with the longest exposure, the newest, or the ones closest to the object first", choices=PRIORITIES, default=None)
+    parser.add_argument('--max_gb', help="Don't start any more observations after downloading this many GB", type=float, default=None)
+    parser.add_argument('--max_hours', help="Don't start any more observations after this many hours", type=float, default=None)
+    parser.add_argument('-n','--dry_run', help="Only report how many files and bytes would be downloaded for each object, and roughly how long it would take", action='store_true', default=False)
+    parser.add_argument('--bandwidth', help="Download speed (MB/s) assumed for the --dry_run time estimates", type=float, default=DEFAULT_BANDWIDTH/1e6)
+    parser.add_argument('--download_all', help="Download all observations, even ones that have already been downloaded", action='store_true', default=False)
+    parser.add_argument('--no_unzip', help="Leave the downloaded files gzipped", action='store_true', default=False)
+    parser.add_argument('-d','--download_workers', help="Number of observations to download at the same time", type=int, default=4)
+    parser.add_argument('--max_connections', help="Maximum number of download connections open to HEASARC at once", type=int, default=4)
+    parser.add_argument('--adaptive', help="Adjust the number of download connections (up to --max_connections) to how HEASARC is responding", action='store_true', default=False)
+    parser.add_argument('--max_rate', help="Most MB/s to download, over all connections", type=float, default=None)
+    args = parser.parse_args()
+
+    if not args.input_obj:
+        print('Please specify an object or list of objects you would like to download.')
+        sys.exit()
+
+    query_args = {}
+    if not args.targets:
+        query_args = {'max_workers':args.max_workers, 'rate_limit':args.rate_limit,
+                          'refresh':args.refresh, 'batch_size':args.batch_size,
+                          'local_catalog':args.local, 'incremental':args.incremental}
+
+    uvot_download(args.input_obj, list_opt=args.list, targets=args.targets,
+                      search_radius=args.radius, download_filters=args.filters,
+                      min_exp=args.min_exp, download_all=args.download_all,
+                      unzip=(not args.no_unzip), download_workers=args.download_workers,
+                      max_connections=args.max_connections, products=args.products,
+                      verify=args.verify, store=args.store, priority=args.priority,
+                      max_bytes=(None if args.max_gb is None else int(args.max_gb*1e9)),
+                      max_time=(None if args.max_hours is None else args.max_hours*3600),
+                      dry_run=args.dry_run, bandwidth=args.bandwidth*1e6, adaptive=args.adaptive,
+                      max_bandwidth=(None if args.max_rate is None else args.max_rate*1e6),
+                      **query_args)
+
+if __name__ =="__main__":
+    main()